@@ -135,6 +135,12 @@ SPECTACULAR_SETTINGS = {
     'DESCRIPTION': 'Документация и тестирование API для Excel Platform',
     'VERSION': '1.0.0',
     'SERVE_INCLUDE_SCHEMA': False,
+    # Files, jobs and upload sessions each have a "status" with their own choices
+    'ENUM_NAME_OVERRIDES': {
+        'UserFileStatusEnum': 'files.models.UserFile.STATUS_CHOICES',
+        'ProcessingJobStatusEnum': 'files.models.ProcessingJob.STATUS_CHOICES',
+        'UploadSessionStatusEnum': 'files.models.UploadSession.STATUS_CHOICES',
+    },
 }
 
 CORS_ALLOWED_ORIGINS = [
@@ -147,4 +153,71 @@ SIMPLE_JWT = {
 }
 
 
-CORS_ALLOW_CREDENTIALS = True
\ No newline at end of file
+CORS_ALLOW_CREDENTIALS = True
+
+# Background report processing (see files/jobs.py and `manage.py process_files`)
+FILES_PROCESS_IN_BACKGROUND = True
+FILES_JOB_WORKERS = 2
+FILES_JOB_POLL_INTERVAL = 1.0
+FILES_JOB_STALE_SECONDS = 30 * 60
+
+# Worker progress (files.jobs) and reader fallbacks (stats) go to the console
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'files': {'handlers': ['console'], 'level': 'INFO'},
+        'stats': {'handlers': ['console'], 'level': 'WARNING'},
+    },
+}
+# Process uploads block by block and store each block's counts: an upload revising the previous one
+# of the same name reuses its unchanged blocks, gets a delta against it and replaces it in summaries
+FILES_INCREMENTAL_REVISIONS = False
+# Share of the previous version's first-block rows an upload's first block must keep to revise it
+FILES_REVISION_MIN_OVERLAP = 0.5
+FILES_ASYNC_WORKERS = 8  # threads the async views run uploads and report building on
+
+# NCT workbook parsing
+NCT_SHEETS = None  # None parses the active sheet, '*' every sheet, or a list of sheet names
+NCT_PARSE_WORKERS = None  # processes used for multi-sheet workbooks; None uses all cores
+NCT_REPORT_ENGINE = 'python'  # 'python' (row loop) or 'pandas' (vectorized columns)
+NCT_UNIVERSITY_CODE = '421'  # KBTU; its first choices are the report's specialization_counts
+NCT_SPECIALIZATION_CHOICES = 1  # choices per applicant (1-4) kept in the specialization matrix
+NCT_XLSX_READER = 'openpyxl'  # 'openpyxl' or 'native' (zipfile + streaming ElementTree parse, same rows, about twice as fast)
+NCT_BLOCK_CACHE_DIR = None  # directory for the parsed-block cache, e.g. BASE_DIR / 'cache' / 'nct_blocks'; None disables it
+NCT_BLOCK_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Row and file deduplication store: 'sqlite' is shared by all processes, 'memory' and
+# 'compact' (numpy fingerprint index, for tens of millions of rows) are per process
+NCT_DEDUP_STORE = 'sqlite'
+NCT_DEDUP_DB = BASE_DIR / 'dedup.sqlite3'
+NCT_DEDUP_MAX_ROW_HASHES = 10000
+
+# Summary responses are cached per user and query; uploads and report saves invalidate them.
+# A file cache is shared by the web and `process_files` worker processes.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'django',
+    }
+}
+FILES_SUMMARY_CACHE_SECONDS = 5 * 60
+
+# Chunked uploads (/api/uploads/): part files are assembled next to MEDIA_ROOT so completing
+# an upload moves them into storage; `process_files` purges sessions idle for longer than the TTL
+FILES_UPLOAD_SESSION_DIR = BASE_DIR / 'upload_sessions'
+FILES_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+FILES_UPLOAD_MAX_CHUNK_SIZE = 64 * 1024 * 1024
+FILES_UPLOAD_MAX_SIZE = 2 * 1024 * 1024 * 1024
+FILES_UPLOAD_SESSION_TTL = 24 * 60 * 60
+
+# Bulk uploads (/api/files/bulk/), processed like single uploads
+FILES_BULK_MAX_FILES = 100
+FILES_BULK_MAX_EXTRACTED_SIZE = 2 * 1024 * 1024 * 1024  # total size of the files in a .zip
+
+# Prometheus metrics at /metrics, shared by web and worker processes; None disables them
+METRICS_DB = BASE_DIR / 'metrics.sqlite3'
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
@@ -0,0 +1,204 @@
+"""
+Async variants of the summary, file list and upload endpoints for ASGI deployments.
+
+They answer the same requests as UserFileViewSet without holding a worker
+thread while they wait: ORM queries use Django's async API, and reading,
+hashing and storing uploads, and building reports when background
+processing is off, run on a bounded thread pool (FILES_ASYNC_WORKERS).
+"""
+import time
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.http import JsonResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_http_methods
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.request import Request
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from .models import UserFile
+from .utils import store_upload
+from .jobs import start_processing
+from .summary import (
+    build_summary_data, parse_summary_params, asummary_version, asummary_validators, summary_cache_key,
+    invalidate_summary
+)
+from .rollups import rollup_date
+from .serializers import UserFileSerializer, UserFileListSerializer, ProcessingJobSerializer
+from .pagination import UserFileCursorPagination
+from .metrics import observe, record_upload
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Return the thread pool blocking work is sent to, sized by FILES_ASYNC_WORKERS."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.FILES_ASYNC_WORKERS,
+                                           thread_name_prefix='files-async')
+    return _executor
+
+
+def _run_closing_connections(func, *args, **kwargs):
+    # Pool threads outlive requests, so close their connections like a request would
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking function on the bounded pool and wait for it without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_executor(), functools.partial(_run_closing_connections, func, *args, **kwargs)
+    )
+
+
+def _json(data, status=200):
+    return JsonResponse(data, status=status, safe=False, json_dumps_params={'ensure_ascii': False})
+
+
+async def authenticate(request):
+    """
+    Authenticate a request with its JWT bearer token, like the DRF views.
+
+    Returns:
+        tuple: (user, None) or (None, 401 response)
+    """
+    try:
+        result = await sync_to_async(JWTAuthentication().authenticate)(request)
+    except AuthenticationFailed as e:  # InvalidToken included
+        return None, _unauthorized(e.detail)
+    if result is None:
+        return None, _unauthorized('Authentication credentials were not provided.')
+    return result[0], None
+
+
+def _unauthorized(detail):
+    # The body and header DRF sends for a failed JWTAuthentication
+    response = _json(detail if isinstance(detail, dict) else {'detail': detail}, status=401)
+    response['WWW-Authenticate'] = 'Bearer realm="api"'
+    return response
+
+
+def _visible_files(user):
+    # Same files as UserFileViewSet.get_queryset()
+    if user.is_staff:
+        return UserFile.objects.all()
+    return UserFile.objects.filter(user=user)
+
+
+@require_GET
+async def summary(request):
+    """Async UserFileViewSet.summary: the same parameters, caching, validators and response."""
+    started = time.perf_counter()
+    user, error_response = await authenticate(request)
+    if error_response is not None:
+        return error_response
+    try:
+        params, error = parse_summary_params(request.GET)
+        if error:
+            return _json({'error': error}, status=400)
+        days, user_only, university, choice = params
+
+        queryset = _visible_files(user)
+        if user_only and not user.is_staff:
+            queryset = queryset.filter(user=user)
+        summary_user = None if user.is_staff else user
+
+        # Unchanged dashboards get a 304 without computing anything
+        version = await asummary_version(summary_user)
+        params = (days, user_only, university, choice, rollup_date(timezone.now()))
+        etag, last_modified = await asummary_validators(queryset, summary_user, version, *params)
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            await run_blocking(observe, 'files_summary_duration_seconds', time.perf_counter() - started,
+                               result='not_modified')
+            return not_modified
+
+        cache_key = summary_cache_key(summary_user, version, *params)
+        summary_data = await cache.aget(cache_key)
+        result = 'cached'
+        if summary_data is None:
+            result = 'computed'
+            summary_data = await sync_to_async(build_summary_data)(
+                queryset, days, user=summary_user, university=university, choice=choice
+            )
+            await cache.aset(cache_key, summary_data, settings.FILES_SUMMARY_CACHE_SECONDS)
+
+        response = _json(summary_data)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        await run_blocking(observe, 'files_summary_duration_seconds', time.perf_counter() - started, result=result)
+        return response
+
+    except Exception as e:
+        return _json({'error': f'Failed to generate summary: {str(e)}'}, status=500)
+
+
+async def list_files(request, user):
+    """A page of the caller's files, newest first, with the cursor pagination of the DRF list."""
+    paginator = UserFileCursorPagination()
+    drf_request = Request(request)
+    # The page is one keyset query; pagination evaluates it synchronously
+    queryset = _visible_files(user).defer('report')
+    page = await sync_to_async(paginator.paginate_queryset)(queryset, drf_request)
+    data = UserFileListSerializer(page, many=True, context={'request': drf_request}).data
+    return _json(paginator.get_paginated_response(data).data)
+
+
+def _store_upload(request, user):
+    """
+    Validate and save an upload and start its processing. Runs on the thread pool.
+
+    Returns:
+        tuple: (response body, status code)
+    """
+    serializer = UserFileSerializer(data=request.FILES, context={'request': request})
+    if not serializer.is_valid():
+        return serializer.errors, 400
+
+    # Hashed while it is written; a duplicate is not kept
+    uploaded_file = serializer.validated_data['file']
+    stored, error = store_upload(uploaded_file.name, uploaded_file)
+    if error:
+        return {'error': error}, 400
+
+    user_file = serializer.save(user=user, **stored)
+    invalidate_summary(user.pk)
+    record_upload('single', user_file.file_size)
+
+    # Queued for a `process_files` worker, or processed now on this thread
+    job = start_processing(user_file)
+    data = dict(serializer.data)
+    if job is not None:
+        data['job'] = ProcessingJobSerializer(job).data
+        return data, 202
+    return data, 201
+
+
+@csrf_exempt
+@require_http_methods(['GET', 'POST'])
+async def files(request):
+    """GET lists the caller's files like the DRF list; POST uploads a file like the DRF create."""
+    user, error_response = await authenticate(request)
+    if error_response is not None:
+        return error_response
+    if request.method == 'GET':
+        return await list_files(request, user)
+    # Parsing the multipart body may spill it to disk, so it runs on the pool with the rest
+    data, status = await run_blocking(_store_upload, request, user)
+    return _json(data, status=status)
@@ -0,0 +1,153 @@
+import os
+import zipfile
+import tempfile
+from datetime import datetime
+from django.conf import settings
+from django.core.files import File
+from stats.utils import merge_reports
+from .models import UserFile
+from .utils import (
+    store_upload, process_userfile_and_save_report
+)
+from .jobs import enqueue_userfile
+from .summary import invalidate_summary
+from .metrics import record_upload
+
+BULK_STATUS_PROCESSED = 'processed'
+BULK_STATUS_QUEUED = 'queued'
+BULK_STATUS_DUPLICATE = 'duplicate'
+BULK_STATUS_FAILED = 'failed'
+
+
+EXTRACT_CHUNK_SIZE = 1024 * 1024
+
+
+class _ArchiveTooLarge(Exception):
+    pass
+
+
+def _copy_limited(source, target, limit):
+    """Copy ``source`` to ``target`` and return the bytes copied, raising _ArchiveTooLarge past ``limit``."""
+    copied = 0
+    while chunk := source.read(EXTRACT_CHUNK_SIZE):
+        copied += len(chunk)
+        if copied > limit:
+            raise _ArchiveTooLarge()
+        target.write(chunk)
+    return copied
+
+
+def _is_uploaded_member(info):
+    # Directories and macOS metadata entries are not uploads
+    name = os.path.basename(info.filename)
+    return not (info.is_dir() or not name or name.startswith('.') or info.filename.startswith('__MACOSX/'))
+
+
+def expand_bulk_upload(uploaded_files):
+    """
+    Return (name, file) pairs for a bulk upload.
+
+    A single .zip is expanded into its files; each member is copied to a
+    temporary file so it is never held in memory whole. Directories and
+    macOS metadata entries are skipped. Archives with more than
+    FILES_BULK_MAX_FILES members or more than FILES_BULK_MAX_EXTRACTED_SIZE
+    bytes of them are refused: the sizes the archive declares are checked
+    first, and the bytes actually extracted are counted against the same
+    limit, since the declared sizes can lie.
+
+    Returns:
+        tuple: (items, None) or (None, error)
+    """
+    if len(uploaded_files) != 1 or not zipfile.is_zipfile(uploaded_files[0]):
+        for uploaded_file in uploaded_files:
+            uploaded_file.seek(0)
+        return [(os.path.basename(f.name), f) for f in uploaded_files], None
+
+    max_files = settings.FILES_BULK_MAX_FILES
+    max_size = settings.FILES_BULK_MAX_EXTRACTED_SIZE
+    too_large_error = f'The archive expands to more than {max_size} bytes'
+    archive = uploaded_files[0]
+    archive.seek(0)
+    items = []
+    with zipfile.ZipFile(archive) as zf:
+        members = [info for info in zf.infolist() if _is_uploaded_member(info)]
+        if len(members) > max_files:
+            return None, f'At most {max_files} files can be uploaded at once'
+        if sum(info.file_size for info in members) > max_size:
+            return None, too_large_error
+        remaining = max_size
+        try:
+            for info in members:
+                name = os.path.basename(info.filename)
+                tmp = tempfile.TemporaryFile()
+                items.append((name, File(tmp, name=name)))
+                with zf.open(info) as member:
+                    remaining -= _copy_limited(member, tmp, remaining)
+                tmp.seek(0)
+        except (_ArchiveTooLarge, zipfile.BadZipFile) as e:
+            for _, item in items:
+                item.close()
+            if isinstance(e, _ArchiveTooLarge):
+                return None, too_large_error
+            return None, f'The archive is damaged: {e}'
+    return items, None
+
+
+def process_bulk_upload(user, items):
+    """
+    Save the files of a bulk upload and build their reports.
+
+    Files are deduplicated against each other and against recent uploads,
+    in upload order. Each remaining file is then handled like a single
+    upload: with FILES_PROCESS_IN_BACKGROUND it gets its own ProcessingJob,
+    otherwise its report is built here by process_userfile_and_save_report(),
+    one file after another in upload order, so which rows count as
+    duplicates of another file never depends on timing.
+
+    Args:
+        user (User): Owner of the files
+        items (list): (name, file) pairs from expand_bulk_upload()
+
+    Returns:
+        tuple: (per-file results in upload order, report merged over the
+            files processed here, or None)
+    """
+    start_time = datetime.now()
+    results = []
+    seen = {}
+    for name, uploaded_file in items:
+        result = {'file_name': name, 'status': None, 'file': None, 'job': None, 'error': None}
+        results.append(result)
+        stored, error = store_upload(name, uploaded_file, seen)
+        if error:
+            result['status'] = BULK_STATUS_DUPLICATE
+            result['error'] = error
+            continue
+        userfile = UserFile(user=user, **stored)
+        userfile.save()
+        record_upload('bulk', userfile.file_size)
+        result['file'] = userfile
+
+    saved = [result for result in results if result['file'] is not None]
+    if not saved:
+        return results, None
+    invalidate_summary(user.pk)
+
+    processed = []
+    for result in saved:
+        if settings.FILES_PROCESS_IN_BACKGROUND:
+            result['job'] = enqueue_userfile(result['file'])
+            result['status'] = BULK_STATUS_QUEUED
+            continue
+        try:
+            report, error = process_userfile_and_save_report(result['file'])
+        except Exception as e:
+            report, error = None, str(e) or e.__class__.__name__
+        if error:
+            result['status'] = BULK_STATUS_FAILED
+            result['error'] = error
+            continue
+        result['status'] = BULK_STATUS_PROCESSED
+        processed.append(report)
+    merged = merge_reports(processed, start_time=start_time) if processed else None
+    return results, merged
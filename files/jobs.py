@@ -0,0 +1,103 @@
+import os
+import time
+import socket
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from .models import ProcessingJob, UserFile
+from .utils import process_userfile_and_save_report, set_userfile_status
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_userfile(userfile):
+    """Queue report generation for an uploaded file and return the job."""
+    return ProcessingJob.objects.create(userfile=userfile)
+
+
+def start_processing(userfile):
+    """
+    Build the report for a newly saved upload.
+
+    With FILES_PROCESS_IN_BACKGROUND the file is queued for a worker and the
+    job is returned; otherwise the report is built now and None is returned.
+    """
+    if settings.FILES_PROCESS_IN_BACKGROUND:
+        return enqueue_userfile(userfile)
+    try:
+        process_userfile_and_save_report(userfile)
+    except Exception as e:
+        # Handle cases where report generation fails but file upload should succeed
+        print(f"Could not generate report for file {userfile.id}: {e}")
+    return None
+
+
+def claim_next_job(worker_name, batch_size=10):
+    """
+    Atomically claim the oldest queued job for this worker.
+
+    Claiming is a conditional UPDATE on the queued status, so several worker
+    processes can poll the same table without picking up the same job.
+    """
+    candidates = ProcessingJob.objects.filter(
+        status=ProcessingJob.STATUS_QUEUED
+    ).order_by('id').values_list('id', flat=True)[:batch_size]
+    for job_id in candidates:
+        claimed = ProcessingJob.objects.filter(
+            pk=job_id, status=ProcessingJob.STATUS_QUEUED
+        ).update(status=ProcessingJob.STATUS_RUNNING, started_at=timezone.now(), worker=worker_name)
+        if claimed:
+            job = ProcessingJob.objects.select_related('userfile').get(pk=job_id)
+            set_userfile_status(job.userfile, UserFile.STATUS_PROCESSING)
+            return job
+    return None
+
+
+def run_job(job):
+    """Process a claimed job and record its outcome."""
+    try:
+        _, error = process_userfile_and_save_report(job.userfile)
+    except Exception as e:
+        error = str(e) or e.__class__.__name__
+    job.status = ProcessingJob.STATUS_FAILED if error else ProcessingJob.STATUS_DONE
+    job.error = error or ''
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'finished_at'])
+    return job
+
+
+def requeue_stale_jobs(stale_after_seconds):
+    """Put running jobs back in the queue if their worker has not finished them in time."""
+    cutoff = timezone.now() - timedelta(seconds=stale_after_seconds)
+    stale = ProcessingJob.objects.filter(status=ProcessingJob.STATUS_RUNNING, started_at__lt=cutoff)
+    UserFile.objects.filter(
+        jobs__in=stale, status=UserFile.STATUS_PROCESSING
+    ).update(status=UserFile.STATUS_PENDING)
+    return stale.update(status=ProcessingJob.STATUS_QUEUED, started_at=None, worker='')
+
+
+def default_worker_name(index=0):
+    return f"{socket.gethostname()}:{os.getpid()}:{index}"
+
+
+def run_worker(worker_name=None, poll_interval=1.0, once=False):
+    """
+    Poll the job table and process jobs until interrupted.
+
+    With ``once`` the worker exits as soon as the queue is empty.
+    """
+    worker_name = worker_name or default_worker_name()
+    processed = 0
+    while True:
+        close_old_connections()
+        job = claim_next_job(worker_name)
+        if job is None:
+            if once:
+                return processed
+            time.sleep(poll_interval)
+            continue
+        job = run_job(job)
+        processed += 1
+        logger.info("[%s] job %d for file %d: %s", worker_name, job.id, job.userfile_id, job.status)
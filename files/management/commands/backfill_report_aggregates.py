@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from files.models import UserFile
+from files.utils import save_report_aggregates
+
+
+class Command(BaseCommand):
+    help = 'Fill the ReportAggregate table from the stored reports of already processed uploads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Rebuild files that already have aggregates too')
+
+    def handle(self, *args, **options):
+        # Superseded versions are left out of the summaries on purpose
+        files = UserFile.objects.filter(has_report=True).exclude(status=UserFile.STATUS_SUPERSEDED)
+        if not options['all']:
+            files = files.filter(aggregates__isnull=True)
+
+        filled = failed = 0
+        for user_file in files.iterator():
+            try:
+                save_report_aggregates(user_file, user_file.report)
+                filled += 1
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f"Could not backfill file {user_file.id}: {e}")
+        self.stdout.write(f"Backfilled {filled} files, {failed} failed")
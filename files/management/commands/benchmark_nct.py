@@ -0,0 +1,267 @@
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import itertools
+import subprocess
+import tracemalloc
+from datetime import datetime
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+from stats import utils as nct
+from stats.synthetic import write_nct_workbook, write_nct_csv
+
+DEFAULT_SIZES = [10000, 100000, 1000000]
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _measure(func, trace_memory):
+    """Run func once and return (result, seconds, peak traced MB or None)."""
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = func()
+    finally:
+        seconds = time.perf_counter() - start
+        peak = None
+        if trace_memory:
+            peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+            tracemalloc.stop()
+    return result, seconds, peak
+
+
+class Command(BaseCommand):
+    help = 'Benchmark NCT parsing, report generation and the summary endpoint on synthetic workbooks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_SIZES,
+                            help='Workbook sizes in data rows')
+        parser.add_argument('--blocks', type=int, default=10, help='NCT blocks per workbook')
+        parser.add_argument('--duplicate-ratio', type=float, default=0.02,
+                            help='Share of rows repeating an earlier row')
+        parser.add_argument('--engine', choices=nct.REPORT_ENGINES, nargs='+', default=['python'],
+                            help='Report engines to benchmark')
+        parser.add_argument('--reader', choices=nct.XLSX_READERS, nargs='+', default=list(nct.XLSX_READERS),
+                            help='Workbook readers to benchmark; with native the rows are checked against openpyxl')
+        parser.add_argument('--format', choices=['xlsx', 'csv'], nargs='+', default=['xlsx'],
+                            help='Input formats to benchmark; csv runs the same data as one CSV file')
+        parser.add_argument('--summary-files', type=int, default=1000,
+                            help='Processed files behind the summary benchmark, 0 skips it')
+        parser.add_argument('--data-dir', default=os.path.join(settings.BASE_DIR, 'benchmarks', 'data'),
+                            help='Where generated workbooks are kept between runs')
+        parser.add_argument('--output', help='Results JSON path (default: benchmarks/results/<time>-<commit>.json)')
+        parser.add_argument('--compare', help='Earlier results JSON to print the change against')
+        parser.add_argument('--no-tracemalloc', action='store_true',
+                            help='Measure time only and skip the second, memory-traced run of each stage')
+
+    def handle(self, *args, **options):
+        trace_memory = not options['no_tracemalloc']
+        os.makedirs(options['data_dir'], exist_ok=True)
+        results = []
+        reader_checks = []
+
+        with tempfile.TemporaryDirectory() as tmp:
+            # Deduplicate against a throwaway store so runs never see each other's rows
+            with override_settings(NCT_DEDUP_DB=os.path.join(tmp, 'dedup.sqlite3')):
+                nct.file_hash_processor, nct.hash_processor = nct.create_hash_processors()
+
+            for rows in options['rows']:
+                inputs = []
+                if 'xlsx' in options['format']:
+                    path, sheet_names = self.workbook(options['data_dir'], rows, options['blocks'],
+                                                      options['duplicate_ratio'])
+                    if 'native' in options['reader']:
+                        reader_checks.append(self.check_readers(path, sheet_names))
+                    inputs += [(reader, path, sheet_names, reader) for reader in options['reader']]
+                if 'csv' in options['format']:
+                    path, _ = self.workbook(options['data_dir'], rows, options['blocks'],
+                                            options['duplicate_ratio'], 'csv')
+                    # A CSV file is one sheet without a name
+                    inputs.append(('csv', path, [None], settings.NCT_XLSX_READER))
+
+                for label, path, sheet_names, reader in inputs:
+                    stages = [
+                        (f'parse[{label}]', lambda: sum(
+                            len(block['data'])
+                            for sheet_name in sheet_names
+                            for block in nct.parse_nct_blocks_correct_header(path, sheet_name)
+                        )),
+                    ]
+                    for engine in options['engine']:
+                        stages.append((f'report[{engine},{label}]', lambda engine=engine: nct.generate_custom_report(
+                            itertools.chain.from_iterable(nct.iter_nct_blocks(path, name) for name in sheet_names),
+                            engine=engine
+                        )))
+                        stages.append((f'process_excel_file[{engine},{label}]',
+                                       lambda engine=engine: nct.process_excel_file(
+                                           path, sheet_names=nct.ALL_SHEETS, engine=engine,
+                                           max_workers=settings.NCT_PARSE_WORKERS
+                                       )))
+                    with override_settings(NCT_XLSX_READER=reader):
+                        for stage, func in stages:
+                            seconds, peak = self.run_stage(func, trace_memory)
+                            results.append(self.record(stage, rows, seconds, peak))
+
+            if options['summary_files']:
+                results.extend(self.benchmark_summary(options['summary_files'], trace_memory, tmp))
+
+        report = {
+            'generated_at': datetime.now().isoformat(),
+            'commit': _git_commit(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'dedup_store': settings.NCT_DEDUP_STORE,
+            'options': {
+                key: options[key]
+                for key in ('rows', 'blocks', 'duplicate_ratio', 'engine', 'reader', 'format', 'summary_files')
+            },
+            'tracemalloc': trace_memory,
+            'reader_checks': reader_checks,
+            'results': results
+        }
+        output = options['output'] or os.path.join(
+            settings.BASE_DIR, 'benchmarks', 'results',
+            f"{datetime.now():%Y%m%d-%H%M%S}-{report['commit'] or 'nogit'}.json"
+        )
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        self.stdout.write(f"Results written to {output}")
+
+        if options['compare']:
+            self.compare(options['compare'], results)
+
+    def workbook(self, data_dir, rows, blocks, duplicate_ratio, file_format='xlsx'):
+        """Return (path, sheet names) of a generated workbook or CSV file, generating it on first use."""
+        name = f"nct-{rows}r-{blocks}b-{duplicate_ratio:g}d"
+        path = os.path.join(data_dir, f"{name}.{file_format}")
+        meta_path = os.path.join(data_dir, f"{name}.{file_format}.json" if file_format != 'xlsx' else f"{name}.json")
+        if not (os.path.exists(path) and os.path.exists(meta_path)):
+            self.stdout.write(f"Generating {path}")
+            write = write_nct_csv if file_format == 'csv' else write_nct_workbook
+            meta = write(path, rows, blocks=blocks, duplicate_ratio=duplicate_ratio)
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+        with open(meta_path, encoding='utf-8') as f:
+            return path, json.load(f)['sheet_names']
+
+    def check_readers(self, path, sheet_names):
+        """Compare the native reader's rows with openpyxl's for every sheet of a workbook."""
+        rows = mismatches = 0
+        first_mismatch = None
+        for sheet_name in sheet_names:
+            expected = nct.iter_workbook_rows(path, sheet_name, reader='openpyxl')
+            actual = nct.iter_workbook_rows(path, sheet_name, reader='native')
+            for number, (a, b) in enumerate(itertools.zip_longest(expected, actual), start=1):
+                rows += 1
+                # 1 == 1.0 == True, so types are compared as well
+                if a != b or [type(v) for v in a or ()] != [type(v) for v in b or ()]:
+                    mismatches += 1
+                    if first_mismatch is None:
+                        first_mismatch = {'sheet': sheet_name, 'row': number, 'openpyxl': repr(a), 'native': repr(b)}
+        name = os.path.basename(path)
+        if mismatches:
+            self.stderr.write(f"native reader differs from openpyxl in {mismatches} of {rows} rows of {name}, "
+                              f"first: {first_mismatch}")
+        else:
+            self.stdout.write(f"native reader matches openpyxl on all {rows} rows of {name}")
+        return {'workbook': name, 'rows': rows, 'mismatches': mismatches, 'first_mismatch': first_mismatch}
+
+    def run_stage(self, func, trace_memory):
+        """
+        Return (seconds, peak MB) of a stage.
+
+        Time comes from an untraced run, since tracemalloc slows allocation
+        heavy code several times over; the peak from a second, traced run.
+        Pool workers are not traced, only the calling process.
+        """
+        nct.hash_processor.reset()
+        nct.file_hash_processor.reset()
+        _, seconds, _ = _measure(func, False)
+        peak = None
+        if trace_memory:
+            nct.hash_processor.reset()
+            nct.file_hash_processor.reset()
+            _, _, peak = _measure(func, True)
+        return seconds, peak
+
+    def record(self, stage, size, seconds, peak):
+        peak_text = f"{peak:9.1f} MB" if peak is not None else ""
+        self.stdout.write(f"{stage:40} {size:>9} {seconds:9.3f} s {peak_text}")
+        return {
+            'stage': stage,
+            'size': size,
+            'seconds': round(seconds, 4),
+            'peak_mb': round(peak, 2) if peak is not None else None
+        }
+
+    def benchmark_summary(self, file_count, trace_memory, tmp):
+        """Time the summary endpoint, cold and cached, over ``file_count`` processed files in a test database."""
+        from django.contrib.auth.models import User
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from files.models import UserFile
+        from files.utils import save_report
+        from files.views import UserFileViewSet
+
+        sample = os.path.join(tmp, 'summary.xlsx')
+        write_nct_workbook(sample, 2000, blocks=2, seed=1)
+        report = nct.generate_custom_report(nct.iter_nct_blocks(sample))
+
+        database_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        results = []
+        try:
+            with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                                   METRICS_DB=None):
+                user = User.objects.create_user('benchmark', is_staff=True)
+                for i in range(file_count):
+                    userfile = UserFile.objects.create(user=user, file=f'uploads/benchmark-{i}.xlsx', file_size=0)
+                    save_report(userfile, report)
+                view = UserFileViewSet.as_view({'get': 'summary'})
+
+                def get_summary():
+                    request = APIRequestFactory().get('/api/files/summary/', {'days': 30})
+                    force_authenticate(request, user=user)
+                    return view(request)
+
+                from django.core.cache import cache
+
+                def cold_summary():
+                    cache.clear()
+                    return get_summary()
+
+                # The cold run clears the cache itself, which is part of its timing
+                seconds, peak = self.run_stage(cold_summary, trace_memory)
+                results.append(self.record('summary[cold]', file_count, seconds, peak))
+                get_summary()
+                seconds, peak = self.run_stage(get_summary, trace_memory)
+                results.append(self.record('summary[cached]', file_count, seconds, peak))
+        finally:
+            connection.creation.destroy_test_db(database_name, verbosity=0)
+        return results
+
+    def compare(self, path, results):
+        with open(path, encoding='utf-8') as f:
+            previous = {(r['stage'], r['size']): r for r in json.load(f)['results']}
+        self.stdout.write(f"Change against {path}:")
+        for result in results:
+            before = previous.get((result['stage'], result['size']))
+            if not before or not before['seconds']:
+                continue
+            change = (result['seconds'] / before['seconds'] - 1) * 100
+            self.stdout.write(f"{result['stage']:40} {result['size']:>9} {change:+7.1f}% time")
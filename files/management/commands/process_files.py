@@ -0,0 +1,59 @@
+import multiprocessing
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from files.jobs import run_worker, requeue_stale_jobs, default_worker_name
+from files.uploads import purge_expired_upload_sessions
+
+
+def _worker_main(index, poll_interval, once):
+    # Each process opens its own database connection on first query
+    run_worker(default_worker_name(index), poll_interval=poll_interval, once=once)
+
+
+class Command(BaseCommand):
+    help = 'Run background workers that build reports for queued file uploads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.FILES_JOB_WORKERS,
+                            help='Number of worker processes')
+        parser.add_argument('--poll-interval', type=float, default=settings.FILES_JOB_POLL_INTERVAL,
+                            help='Seconds to wait between polls of an empty queue')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        requeued = requeue_stale_jobs(settings.FILES_JOB_STALE_SECONDS)
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale jobs")
+        purged = purge_expired_upload_sessions(settings.FILES_UPLOAD_SESSION_TTL)
+        if purged:
+            self.stdout.write(f"Removed {purged} abandoned upload sessions")
+
+        workers = max(1, options['workers'])
+        poll_interval = options['poll_interval']
+        once = options['once']
+        if workers == 1:
+            run_worker(default_worker_name(), poll_interval=poll_interval, once=once)
+            return
+
+        # Connections must not be shared with forked children
+        connections.close_all()
+        # Not daemonic: a worker parsing a multi-sheet workbook starts its own process pool,
+        # which daemonic processes may not do. They are stopped and joined explicitly instead.
+        processes = [
+            multiprocessing.Process(target=_worker_main, args=(i, poll_interval, once))
+            for i in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        self.stdout.write(f"Started {workers} workers")
+        try:
+            for process in processes:
+                process.join()
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+            for process in processes:
+                process.join()
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from files.rollups import rebuild_daily_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily summary rollups from the per-file report aggregates'
+
+    def handle(self, *args, **options):
+        uploads, counts = rebuild_daily_rollups()
+        self.stdout.write(f"Rebuilt {uploads} daily upload rows and {counts} daily count rows")
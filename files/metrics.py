@@ -0,0 +1,209 @@
+import os
+import sqlite3
+import threading
+from django.conf import settings
+
+# Upper bounds of histogram buckets, in the metric's unit
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SIZE_BUCKETS = tuple(2 ** power for power in range(10, 32, 2))  # 1 KB .. 2 GB
+RATE_BUCKETS = (100, 1000, 5000, 10000, 25000, 50000, 100000, 250000, 500000)
+
+# name -> (type, help, buckets)
+METRICS = {
+    'nct_stage_duration_seconds': (
+        'histogram', 'Time spent in each NCT processing stage per file', DURATION_BUCKETS),
+    'nct_processing_duration_seconds': (
+        'histogram', 'Total time to build one file\'s report', DURATION_BUCKETS),
+    'nct_rows_per_second': (
+        'histogram', 'Data rows processed per second of report building, per file', RATE_BUCKETS),
+    'nct_rows_processed_total': ('counter', 'Data rows read from NCT files', None),
+    'nct_dedup_rows_total': ('counter', 'Data rows by deduplication result', None),
+    'nct_reports_total': ('counter', 'Report builds by result', None),
+    'files_uploads_total': ('counter', 'Stored uploads by upload kind', None),
+    'files_upload_size_bytes': ('histogram', 'Size of stored uploads', SIZE_BUCKETS),
+    'files_summary_duration_seconds': (
+        'histogram', 'Summary endpoint latency by how it was answered', DURATION_BUCKETS),
+}
+
+
+def _label_text(labels):
+    # Bucket bounds go last, render_metrics() splits them off the series labels
+    items = sorted(labels.items(), key=lambda item: (item[0] == 'le', item[0]))
+    return ','.join(f'{key}="{value}"' for key, value in items)
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class MetricsStore:
+    """
+    Counter table behind the /metrics endpoint, in a local SQLite file.
+
+    Requests and background job workers run in separate processes, so the
+    samples are kept where all of them can add to them, like the dedup
+    store. Histograms are stored as their cumulative bucket, sum and count
+    samples.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS metric_samples "
+                "(name TEXT NOT NULL, labels TEXT NOT NULL, value REAL NOT NULL, "
+                "PRIMARY KEY (name, labels)) WITHOUT ROWID"
+            )
+
+    def _connection(self):
+        # Connections are neither shared across threads nor inherited across fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def add(self, samples):
+        """Add (sample name, labels dict, amount) triples in one transaction."""
+        with self._connection() as conn:
+            conn.executemany(
+                "INSERT INTO metric_samples (name, labels, value) VALUES (?, ?, ?) "
+                "ON CONFLICT(name, labels) DO UPDATE SET value = value + excluded.value",
+                [(name, _label_text(labels), amount) for name, labels, amount in samples]
+            )
+
+    def samples(self):
+        return self._connection().execute(
+            "SELECT name, labels, value FROM metric_samples ORDER BY name, labels"
+        ).fetchall()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_metrics_store():
+    """Return the store configured by METRICS_DB, or None when metrics are disabled."""
+    global _store
+    if not settings.METRICS_DB:
+        return None
+    with _store_lock:
+        if _store is None or _store.path != str(settings.METRICS_DB):
+            _store = MetricsStore(settings.METRICS_DB)
+    return _store
+
+
+def _histogram_samples(name, value, labels):
+    buckets = METRICS[name][2]
+    samples = [
+        (f'{name}_bucket', {**labels, 'le': _format_value(bound)}, 1)
+        for bound in buckets if value <= bound
+    ]
+    samples.append((f'{name}_bucket', {**labels, 'le': '+Inf'}, 1))
+    samples.append((f'{name}_sum', labels, value))
+    samples.append((f'{name}_count', labels, 1))
+    return samples
+
+
+def _record(samples):
+    store = get_metrics_store()
+    if store is None or not samples:
+        return
+    try:
+        store.add(samples)
+    except sqlite3.Error as e:
+        # Metrics must never fail the request or job that records them
+        print(f"Error recording metrics: {e}")
+
+
+def inc(name, amount=1, **labels):
+    _record([(name, labels, amount)])
+
+
+def observe(name, value, **labels):
+    _record(_histogram_samples(name, value, labels))
+
+
+def record_upload(kind, size):
+    """Count a stored upload of ``kind`` (single, chunked or bulk) and its size in bytes."""
+    samples = [('files_uploads_total', {'kind': kind}, 1)]
+    if size is not None:
+        samples += _histogram_samples('files_upload_size_bytes', size, {})
+    _record(samples)
+
+
+def record_report(report, storage_seconds=None):
+    """Record the stage timings, row counts and throughput of a built report."""
+    metadata = report.get('metadata', {})
+    timings = dict(metadata.get('stage_timings', {}))
+    if storage_seconds is not None:
+        timings['storage_write'] = round(storage_seconds, 4)
+    samples = [('nct_reports_total', {'status': 'success'}, 1)]
+    for stage, seconds in timings.items():
+        samples += _histogram_samples('nct_stage_duration_seconds', seconds, {'stage': stage})
+
+    dedup = metadata.get('deduplication_stats', {})
+    unique = dedup.get('unique_rows_processed', 0)
+    duplicate = dedup.get('duplicate_rows_skipped', 0)
+    samples.append(('nct_rows_processed_total', {}, unique + duplicate))
+    samples.append(('nct_dedup_rows_total', {'result': 'unique'}, unique))
+    samples.append(('nct_dedup_rows_total', {'result': 'duplicate'}, duplicate))
+
+    duration = metadata.get('processing_duration_seconds')
+    if duration is not None:
+        samples += _histogram_samples('nct_processing_duration_seconds', duration, {})
+        if duration > 0:
+            samples += _histogram_samples('nct_rows_per_second', (unique + duplicate) / duration, {})
+    _record(samples)
+
+
+def record_report_failure():
+    inc('nct_reports_total', status='failed')
+
+
+def _sample_order(sample):
+    # Group a histogram's series together, with buckets in increasing order before _sum and _count
+    sample_name, labels, _ = sample
+    series, _, le = labels.partition('le="')
+    le = le.rstrip('"')
+    if not sample_name.endswith('_bucket'):
+        bound = float('inf'), 1 if sample_name.endswith('_count') else 0
+    else:
+        bound = float(le), -1
+    return series.rstrip(','), bound
+
+
+def render_metrics():
+    """Return every metric in the Prometheus text exposition format."""
+    store = get_metrics_store()
+    rows = store.samples() if store is not None else []
+    by_family = {}
+    for sample_name, labels, value in rows:
+        family = sample_name
+        for suffix in ('_bucket', '_sum', '_count'):
+            if sample_name.endswith(suffix) and sample_name[:-len(suffix)] in METRICS:
+                family = sample_name[:-len(suffix)]
+        by_family.setdefault(family, []).append((sample_name, labels, value))
+
+    lines = []
+    for name, (metric_type, help_text, _) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for sample_name, labels, value in sorted(by_family.get(name, []), key=_sample_order):
+            label_part = f"{{{labels}}}" if labels else ""
+            lines.append(f"{sample_name}{label_part} {_format_value(value)}")
+
+    dedup = {labels: value for _, labels, value in by_family.get('nct_dedup_rows_total', [])}
+    duplicate = dedup.get('result="duplicate"', 0)
+    total = duplicate + dedup.get('result="unique"', 0)
+    lines.append("# HELP nct_dedup_hit_ratio Share of processed rows skipped as duplicates")
+    lines.append("# TYPE nct_dedup_hit_ratio gauge")
+    lines.append(f"nct_dedup_hit_ratio {_format_value(duplicate / total if total else 0)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.4 on 2026-10-16 22:38
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def backfill_content_hash(apps, schema_editor):
+    UserFile = apps.get_model('files', 'UserFile')
+    for userfile in UserFile.objects.filter(content_hash='').iterator():
+        if not userfile.file or not userfile.file.storage.exists(userfile.file.name):
+            continue
+        file_hash = hashlib.md5()
+        with userfile.file.open('rb') as f:
+            for chunk in f.chunks():
+                file_hash.update(chunk)
+        userfile.content_hash = file_hash.hexdigest()
+        userfile.save(update_fields=['content_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0005_processingjob'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='processingjob',
+            name='file_hash',
+        ),
+        migrations.AddField(
+            model_name='userfile',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=32),
+        ),
+        migrations.RunPython(backfill_content_hash, migrations.RunPython.noop),
+    ]
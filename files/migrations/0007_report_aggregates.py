@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-16 22:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0006_userfile_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userfile',
+            name='processing_duration_seconds',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='ReportAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('quota', 'Quota'), ('prim', 'Примечание'), ('specialization', 'Specialization')], max_length=16)),
+                ('name', models.CharField(max_length=255)),
+                ('count', models.IntegerField()),
+                ('userfile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='aggregates', to='files.userfile')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'name'], name='files_repor_kind_71612e_idx')],
+                'constraints': [models.UniqueConstraint(fields=('userfile', 'kind', 'name'), name='unique_report_aggregate')],
+            },
+        ),
+    ]
@@ -0,0 +1,105 @@
+# Generated by Django 5.2.4 on 2026-10-16 22:41
+
+from datetime import timezone as dt_timezone
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Exists, FloatField, Min, OuterRef, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+
+
+def backfill_daily_rollups(apps, schema_editor):
+    """
+    Fill the new rollup tables from UserFile and ReportAggregate.
+
+    This is files.rollups.rebuild_daily_rollups() as of this migration,
+    against the historical models, so later changes to it cannot change
+    what the migration does.
+    """
+    UserFile = apps.get_model('files', 'UserFile')
+    ReportAggregate = apps.get_model('files', 'ReportAggregate')
+    DailyUploadRollup = apps.get_model('files', 'DailyUploadRollup')
+    DailyReportCount = apps.get_model('files', 'DailyReportCount')
+
+    # A file is counted once its report has been saved into the aggregate tables
+    counted_files = UserFile.objects.filter(
+        Q(Exists(ReportAggregate.objects.filter(userfile=OuterRef('pk')))) |
+        Q(processing_duration_seconds__isnull=False)
+    )
+    upload_rows = counted_files.annotate(
+        date=TruncDate('uploaded_at', tzinfo=dt_timezone.utc)
+    ).values('user_id', 'date').annotate(
+        file_count=Count('id'),
+        seconds=Coalesce(Sum('processing_duration_seconds'), Value(0.0), output_field=FloatField()),
+        timed_files=Count('processing_duration_seconds')
+    ).order_by()
+    count_rows = ReportAggregate.objects.annotate(
+        date=TruncDate('userfile__uploaded_at', tzinfo=dt_timezone.utc)
+    ).values('userfile__user_id', 'date', 'kind', 'name').annotate(
+        total=Sum('count'),
+        first_id=Min('id')
+    ).order_by('first_id')
+
+    DailyUploadRollup.objects.bulk_create([
+        DailyUploadRollup(
+            user_id=row['user_id'],
+            date=row['date'],
+            files=row['file_count'],
+            processing_seconds=row['seconds'],
+            files_with_processing_data=row['timed_files']
+        )
+        for row in upload_rows
+    ], batch_size=1000)
+    DailyReportCount.objects.bulk_create([
+        DailyReportCount(
+            user_id=row['userfile__user_id'],
+            date=row['date'],
+            kind=row['kind'],
+            name=row['name'],
+            count=row['total']
+        )
+        for row in count_rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0007_report_aggregates'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyReportCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('kind', models.CharField(choices=[('quota', 'Quota'), ('prim', 'Примечание'), ('specialization', 'Specialization')], max_length=16)),
+                ('name', models.CharField(max_length=255)),
+                ('count', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_report_counts', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date', 'kind'], name='files_daily_date_4c4714_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'date', 'kind', 'name'), name='unique_daily_report_count')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyUploadRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('files', models.IntegerField(default=0)),
+                ('processing_seconds', models.FloatField(default=0)),
+                ('files_with_processing_data', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date'], name='files_daily_date_728649_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'date'), name='unique_daily_upload_rollup')],
+            },
+        ),
+        migrations.RunPython(backfill_daily_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.4 on 2026-10-16 22:43
+
+import os
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_name_and_size(apps, schema_editor):
+    UserFile = apps.get_model('files', 'UserFile')
+    for userfile in UserFile.objects.filter(file_size__isnull=True).iterator():
+        if not userfile.file:
+            continue
+        userfile.file_name = os.path.basename(userfile.file.name)
+        if userfile.file.storage.exists(userfile.file.name):
+            userfile.file_size = userfile.file.storage.size(userfile.file.name)
+        userfile.save(update_fields=['file_name', 'file_size'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0008_daily_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userfile',
+            name='file_name',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='userfile',
+            name='file_size',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='userfile',
+            index=models.Index(fields=['uploaded_at', 'id'], name='files_userf_uploade_9938d6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userfile',
+            index=models.Index(fields=['user', 'uploaded_at', 'id'], name='files_userf_user_id_d0521a_idx'),
+        ),
+        migrations.RunPython(backfill_name_and_size, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+import json
+
+from django.db import migrations, models, transaction
+
+
+def backfill_report_json(apps, schema_editor):
+    """
+    Copy each media/reports/*.json file into UserFile.report.
+
+    The files are deleted once the migration has committed, so a failed
+    migration leaves them in place to be read again.
+    """
+    UserFile = apps.get_model('files', 'UserFile')
+    files = UserFile.objects.filter(report_file__isnull=False).exclude(report_file='')
+    for userfile in files.iterator():
+        storage = userfile.report_file.storage
+        if not storage.exists(userfile.report_file.name):
+            continue
+        with userfile.report_file.open('rb') as f:
+            userfile.report = json.loads(f.read().decode('utf-8'))
+        userfile.save(update_fields=['report'])
+        transaction.on_commit(
+            lambda storage=storage, name=userfile.report_file.name: storage.delete(name),
+            using=schema_editor.connection.alias,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0010_upload_sessions'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='userfile',
+            old_name='report',
+            new_name='report_file',
+        ),
+        migrations.AddField(
+            model_name='userfile',
+            name='report',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_report_json, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='userfile',
+            name='report_file',
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-16 23:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0011_userfile_report_json'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='dailyreportcount',
+            name='kind',
+            field=models.CharField(choices=[('quota', 'Quota'), ('prim', 'Примечание'), ('specialization', 'Specialization'), ('university_1', 'University choice 1'), ('university_2', 'University choice 2'), ('university_3', 'University choice 3'), ('university_4', 'University choice 4')], max_length=16),
+        ),
+        migrations.AlterField(
+            model_name='reportaggregate',
+            name='kind',
+            field=models.CharField(choices=[('quota', 'Quota'), ('prim', 'Примечание'), ('specialization', 'Specialization'), ('university_1', 'University choice 1'), ('university_2', 'University choice 2'), ('university_3', 'University choice 3'), ('university_4', 'University choice 4')], max_length=16),
+        ),
+    ]
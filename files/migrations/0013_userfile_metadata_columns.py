@@ -0,0 +1,74 @@
+# Generated by Django 5.2.4 on 2026-10-16 23:17
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+BACKFILL_BATCH_SIZE = 1000
+
+# Status of files without a report, by the status of their latest processing job
+JOB_STATUS_TO_FILE_STATUS = {'running': 'processing', 'failed': 'failed'}
+
+
+def backfill_userfile_columns(apps, schema_editor):
+    UserFile = apps.get_model('files', 'UserFile')
+    ProcessingJob = apps.get_model('files', 'ProcessingJob')
+    latest_job_status = ProcessingJob.objects.filter(userfile=OuterRef('pk')).order_by('-id').values('status')[:1]
+    files = UserFile.objects.annotate(latest_job_status=Subquery(latest_job_status)).only('id', 'report')
+    fields = ['status', 'has_report', 'row_count', 'block_count']
+    batch = []
+    for userfile in files.iterator(chunk_size=BACKFILL_BATCH_SIZE):
+        report = userfile.report
+        if report is not None:
+            metadata = report.get('metadata', {})
+            userfile.status = 'processed'
+            userfile.has_report = True
+            userfile.row_count = metadata.get('total_rows_processed')
+            userfile.block_count = metadata.get('blocks_processed')
+        else:
+            userfile.status = JOB_STATUS_TO_FILE_STATUS.get(userfile.latest_job_status, 'pending')
+        batch.append(userfile)
+        if len(batch) == BACKFILL_BATCH_SIZE:
+            UserFile.objects.bulk_update(batch, fields)
+            batch = []
+    UserFile.objects.bulk_update(batch, fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0012_report_aggregate_university_kinds'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userfile',
+            name='block_count',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='userfile',
+            name='has_report',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='userfile',
+            name='row_count',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='userfile',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('processed', 'Processed'), ('failed', 'Failed')], default='pending', max_length=16),
+        ),
+        migrations.AddIndex(
+            model_name='userfile',
+            index=models.Index(fields=['has_report', 'uploaded_at'], name='files_userf_has_rep_2c281d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userfile',
+            index=models.Index(fields=['user', 'has_report', 'uploaded_at'], name='files_userf_user_id_bc31b8_idx'),
+        ),
+        migrations.RunPython(backfill_userfile_columns, migrations.RunPython.noop),
+    ]
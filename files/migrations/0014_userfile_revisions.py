@@ -0,0 +1,68 @@
+# Generated by Django 5.2.4 on 2026-10-16 23:20
+
+import os
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_source_name(apps, schema_editor):
+    """Name existing uploads after their stored file, as UserFile.save() names new ones."""
+    UserFile = apps.get_model('files', 'UserFile')
+    userfiles = list(UserFile.objects.filter(source_name='').only('id', 'file'))
+    for userfile in userfiles:
+        userfile.source_name = os.path.basename(userfile.file.name)[:255]
+    UserFile.objects.bulk_update(userfiles, ['source_name'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0013_userfile_metadata_columns'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserFileBlock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sheet_name', models.CharField(blank=True, default='', max_length=255)),
+                ('index', models.IntegerField()),
+                ('nct_row', models.IntegerField()),
+                ('fingerprint', models.CharField(max_length=64)),
+                ('row_count', models.IntegerField()),
+                ('partial', models.JSONField()),
+                ('row_fingerprints', models.BinaryField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='userfile',
+            name='previous_version',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='revisions', to='files.userfile'),
+        ),
+        migrations.AddField(
+            model_name='userfile',
+            name='source_name',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='userfile',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('processed', 'Processed'), ('failed', 'Failed'), ('superseded', 'Superseded')], default='pending', max_length=16),
+        ),
+        migrations.AddIndex(
+            model_name='userfile',
+            index=models.Index(fields=['user', 'source_name', 'has_report'], name='files_userf_user_id_cef2b7_idx'),
+        ),
+        migrations.AddField(
+            model_name='userfileblock',
+            name='userfile',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='blocks', to='files.userfile'),
+        ),
+        migrations.AddConstraint(
+            model_name='userfileblock',
+            constraint=models.UniqueConstraint(fields=('userfile', 'sheet_name', 'index'), name='unique_userfile_block'),
+        ),
+        migrations.RunPython(backfill_source_name, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,209 @@
+import os
+import uuid
 from django.db import models
 from django.contrib.auth.models import User
+from stats.utils import MAX_SPECIALIZATION_CHOICES
 
 class UserFile(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_PROCESSING = 'processing'
+    STATUS_PROCESSED = 'processed'
+    STATUS_FAILED = 'failed'
+    STATUS_SUPERSEDED = 'superseded'  # processed, then replaced by a revision
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_PROCESSING, 'Processing'),
+        (STATUS_PROCESSED, 'Processed'),
+        (STATUS_FAILED, 'Failed'),
+        (STATUS_SUPERSEDED, 'Superseded'),
+    ]
+
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     file = models.FileField(upload_to='uploads/')
     uploaded_at = models.DateTimeField(auto_now_add=True)
-    report = models.FileField(upload_to='reports/', null=True, blank=True)  # or use JSONField for inline data
\ No newline at end of file
+    report = models.JSONField(null=True, blank=True)  # built report, stored inline with the row
+    content_hash = models.CharField(max_length=32, blank=True, default='', db_index=True)  # MD5 of the upload
+    processing_duration_seconds = models.FloatField(null=True, blank=True)  # copied from the report metadata
+    # Stored at upload so listings never stat files on disk
+    file_name = models.CharField(max_length=255, blank=True, default='')
+    file_size = models.BigIntegerField(null=True, blank=True)
+    # Copied from the report when it is saved, so listings and filters never read the JSON
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    has_report = models.BooleanField(default=False)
+    row_count = models.IntegerField(null=True, blank=True)  # data rows read, duplicates included
+    block_count = models.IntegerField(null=True, blank=True)
+    # Uploads of the same name by the same user are revisions of one workbook
+    source_name = models.CharField(max_length=255, blank=True, default='')  # name as uploaded
+    previous_version = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True,
+                                         related_name='revisions')
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of the file list, for staff and per user; the
+            # second also serves the (user, uploaded_at) range filters
+            models.Index(fields=['uploaded_at', 'id']),
+            models.Index(fields=['user', 'uploaded_at', 'id']),
+            # Processed files in an upload range, for staff and per user
+            models.Index(fields=['has_report', 'uploaded_at']),
+            models.Index(fields=['user', 'has_report', 'uploaded_at']),
+            # Previous versions of a revised workbook
+            models.Index(fields=['user', 'source_name', 'has_report']),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.file and self.file_size is None:
+            # Before the first save this is the size of the upload, not a stat
+            self.file_size = self.file.size
+        if self.file and not self.source_name:
+            # Likewise the name of the upload, before the storage makes it unique
+            self.source_name = os.path.basename(self.file.name)
+        super().save(*args, **kwargs)
+        # The storage may rename the file while saving it
+        file_name = os.path.basename(self.file.name) if self.file else ''
+        if file_name != self.file_name:
+            self.file_name = file_name
+            UserFile.objects.filter(pk=self.pk).update(file_name=file_name)
+
+class UserFileBlock(models.Model):
+    """
+    One NCT block of a processed file, with its fingerprint and partial counts.
+
+    A revision of the file reuses the partial of every block whose
+    fingerprint is unchanged instead of aggregating it again.
+    """
+    userfile = models.ForeignKey(UserFile, on_delete=models.CASCADE, related_name='blocks')
+    sheet_name = models.CharField(max_length=255, blank=True, default='')
+    index = models.IntegerField()  # position of the block in its sheet
+    nct_row = models.IntegerField()
+    fingerprint = models.CharField(max_length=64)
+    row_count = models.IntegerField()
+    partial = models.JSONField()  # ReportBuilder.partial() of the block alone
+    row_fingerprints = models.BinaryField()  # 64-bit row hash fingerprints, 8 bytes per row
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['userfile', 'sheet_name', 'index'], name='unique_userfile_block'),
+        ]
+
+class ProcessingJob(models.Model):
+    """A queued request to build the report for an uploaded file."""
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    userfile = models.ForeignKey(UserFile, on_delete=models.CASCADE, related_name='jobs')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_QUEUED, db_index=True)
+    error = models.TextField(blank=True)
+    worker = models.CharField(max_length=64, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+class ReportAggregate(models.Model):
+    """One count from a file's report, so summaries can be computed with SQL instead of reading reports."""
+    KIND_QUOTA = 'quota'
+    KIND_PRIM = 'prim'  # Примечание sub-categories
+    KIND_SPECIALIZATION = 'specialization'
+    # Specialization matrix counts, one kind per choice, named "<university>:<specialization>"
+    KIND_UNIVERSITY_CHOICES = {choice: f'university_{choice}' for choice in range(1, MAX_SPECIALIZATION_CHOICES + 1)}
+    KIND_CHOICES = [
+        (KIND_QUOTA, 'Quota'),
+        (KIND_PRIM, 'Примечание'),
+        (KIND_SPECIALIZATION, 'Specialization'),
+    ] + [(kind, f'University choice {choice}') for choice, kind in KIND_UNIVERSITY_CHOICES.items()]
+
+    @classmethod
+    def university_name(cls, university, specialization):
+        return f'{university}:{specialization}'
+
+    userfile = models.ForeignKey(UserFile, on_delete=models.CASCADE, related_name='aggregates')
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    name = models.CharField(max_length=255)
+    count = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['userfile', 'kind', 'name'], name='unique_report_aggregate'),
+        ]
+        indexes = [
+            models.Index(fields=['kind', 'name']),
+        ]
+
+class DailyUploadRollup(models.Model):
+    """Per-user, per-day totals of processed files, kept up to date as reports are saved."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_rollups')
+    date = models.DateField()  # UTC date of the upload
+    files = models.IntegerField(default=0)
+    processing_seconds = models.FloatField(default=0)
+    files_with_processing_data = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'date'], name='unique_daily_upload_rollup'),
+        ]
+        indexes = [
+            models.Index(fields=['date']),
+        ]
+
+class DailyReportCount(models.Model):
+    """Per-user, per-day sum of one ReportAggregate kind and name."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_report_counts')
+    date = models.DateField()  # UTC date of the upload
+    kind = models.CharField(max_length=16, choices=ReportAggregate.KIND_CHOICES)
+    name = models.CharField(max_length=255)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'date', 'kind', 'name'], name='unique_daily_report_count'),
+        ]
+        indexes = [
+            models.Index(fields=['date', 'kind']),
+        ]
+
+class UploadSession(models.Model):
+    """A chunked upload in progress; chunks are written to a part file until the upload is completed."""
+    STATUS_OPEN = 'open'
+    STATUS_COMPLETE = 'complete'
+    STATUS_CHOICES = [
+        (STATUS_OPEN, 'Open'),
+        (STATUS_COMPLETE, 'Complete'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    file_name = models.CharField(max_length=255)
+    total_size = models.BigIntegerField()
+    chunk_size = models.IntegerField()
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_OPEN)
+    userfile = models.ForeignKey(UserFile, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def chunk_count(self):
+        return max(1, -(-self.total_size // self.chunk_size))
+
+    def chunk_length(self, index):
+        """Expected size of chunk ``index``; only the last one may be short."""
+        return min(self.chunk_size, self.total_size - index * self.chunk_size)
+
+class UploadChunk(models.Model):
+    """A chunk received for an UploadSession, with the MD5 of its bytes."""
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE, related_name='chunks')
+    index = models.IntegerField()
+    size = models.IntegerField()
+    md5 = models.CharField(max_length=32)
+    received_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['session', 'index'], name='unique_upload_chunk'),
+        ]
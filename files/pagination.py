@@ -0,0 +1,15 @@
+from rest_framework.pagination import CursorPagination
+
+
+class UserFileCursorPagination(CursorPagination):
+    """
+    Keyset pagination of the file list, newest first.
+
+    Each page is one query that seeks on uploaded_at and orders by
+    (uploaded_at, id), both covered by the UserFile indexes, so deep pages
+    cost the same as the first and no COUNT runs.
+    """
+    ordering = ('-uploaded_at', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
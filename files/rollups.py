@@ -0,0 +1,112 @@
+from datetime import timezone as dt_timezone
+from django.db import transaction
+from django.db.models import Count, Exists, F, FloatField, Min, OuterRef, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+
+ROLLUP_BATCH_SIZE = 1000
+
+
+def rollup_date(uploaded_at):
+    """Day a file is counted on: the UTC date of its upload, like `most_active_days`."""
+    return uploaded_at.astimezone(dt_timezone.utc).date()
+
+
+def apply_rollup_delta(user_id, date, files=0, processing_seconds=0.0, files_with_processing_data=0,
+                       counts=None):
+    """
+    Add deltas to a user's rollup rows for one day.
+
+    Rows are created on first use. The upload row is updated with F()
+    expressions and the count rows are locked before their new totals are
+    written in batches, so concurrent workers saving reports for the same day
+    never lose updates. Call it inside the transaction that changes the
+    underlying aggregates.
+
+    Args:
+        user_id (int): Owner of the files
+        date (date): Rollup day, see rollup_date()
+        files (int): Change in the number of processed files
+        processing_seconds (float): Change in total processing time
+        files_with_processing_data (int): Change in files that reported a processing time
+        counts (dict): (kind, name) -> change in the summed count
+    """
+    from .models import DailyUploadRollup, DailyReportCount
+    if files or processing_seconds or files_with_processing_data:
+        DailyUploadRollup.objects.get_or_create(user_id=user_id, date=date)
+        DailyUploadRollup.objects.filter(user_id=user_id, date=date).update(
+            files=F('files') + files,
+            processing_seconds=F('processing_seconds') + processing_seconds,
+            files_with_processing_data=F('files_with_processing_data') + files_with_processing_data
+        )
+
+    counts = {key: delta for key, delta in (counts or {}).items() if delta}
+    if not counts:
+        return
+    DailyReportCount.objects.bulk_create([
+        DailyReportCount(user_id=user_id, date=date, kind=kind, name=name)
+        for kind, name in counts
+    ], ignore_conflicts=True, batch_size=ROLLUP_BATCH_SIZE)
+    # One locked read and a CASE update per batch instead of an UPDATE per name
+    rows = DailyReportCount.objects.select_for_update().filter(
+        user_id=user_id, date=date, kind__in={kind for kind, name in counts}
+    ).only('id', 'kind', 'name', 'count')
+    changed = []
+    for row in rows:
+        delta = counts.get((row.kind, row.name))
+        if delta:
+            row.count += delta
+            changed.append(row)
+    DailyReportCount.objects.bulk_update(changed, ['count'], batch_size=ROLLUP_BATCH_SIZE)
+
+
+def rebuild_daily_rollups():
+    """
+    Recompute every rollup row from UserFile and ReportAggregate.
+
+    Returns:
+        tuple: (upload rollup rows, report count rows) written
+    """
+    from .models import UserFile, ReportAggregate, DailyUploadRollup, DailyReportCount
+
+    # A file is counted once its report has been saved into the aggregate tables
+    counted_files = UserFile.objects.filter(
+        Q(Exists(ReportAggregate.objects.filter(userfile=OuterRef('pk')))) |
+        Q(processing_duration_seconds__isnull=False)
+    )
+    day = TruncDate('uploaded_at', tzinfo=dt_timezone.utc)
+    upload_rows = counted_files.annotate(date=day).values('user_id', 'date').annotate(
+        file_count=Count('id'),
+        seconds=Coalesce(Sum('processing_duration_seconds'), Value(0.0), output_field=FloatField()),
+        timed_files=Count('processing_duration_seconds')
+    ).order_by()
+    count_rows = ReportAggregate.objects.annotate(
+        date=TruncDate('userfile__uploaded_at', tzinfo=dt_timezone.utc)
+    ).values('userfile__user_id', 'date', 'kind', 'name').annotate(
+        total=Sum('count'),
+        first_id=Min('id')
+    ).order_by('first_id')
+
+    with transaction.atomic():
+        DailyUploadRollup.objects.all().delete()
+        DailyReportCount.objects.all().delete()
+        uploads = DailyUploadRollup.objects.bulk_create([
+            DailyUploadRollup(
+                user_id=row['user_id'],
+                date=row['date'],
+                files=row['file_count'],
+                processing_seconds=row['seconds'],
+                files_with_processing_data=row['timed_files']
+            )
+            for row in upload_rows
+        ], batch_size=ROLLUP_BATCH_SIZE)
+        counts = DailyReportCount.objects.bulk_create([
+            DailyReportCount(
+                user_id=row['userfile__user_id'],
+                date=row['date'],
+                kind=row['kind'],
+                name=row['name'],
+                count=row['total']
+            )
+            for row in count_rows
+        ], batch_size=ROLLUP_BATCH_SIZE)
+    return len(uploads), len(counts)
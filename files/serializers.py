@@ -1,26 +1,73 @@
+from django.urls import reverse
 from rest_framework import serializers
-from .models import UserFile
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema_field
+from .models import UserFile, ProcessingJob, UploadSession
 
 class UserFileSerializer(serializers.ModelSerializer):
-    file_name = serializers.SerializerMethodField()
-    file_size = serializers.SerializerMethodField()
     report_url = serializers.SerializerMethodField()
 
     class Meta:
         model = UserFile
-        fields = ['id', 'file', 'uploaded_at', 'file_name', 'file_size', 'report', 'report_url']
-        read_only_fields = ['report'] # Report is generated, not uploaded
+        fields = ['id', 'file', 'uploaded_at', 'file_name', 'file_size', 'content_hash', 'status', 'has_report',
+                  'row_count', 'block_count', 'processing_duration_seconds', 'source_name', 'previous_version',
+                  'report', 'report_url']
+        # Everything but the file itself is generated, not uploaded
+        read_only_fields = ['content_hash', 'file_name', 'file_size', 'status', 'has_report', 'row_count',
+                            'block_count', 'processing_duration_seconds', 'source_name', 'previous_version',
+                            'report']
 
-    def get_file_name(self, obj):
-        return obj.file.name.split('/')[-1] if obj.file else None
+    @extend_schema_field(OpenApiTypes.URI)
+    def get_report_url(self, obj):
+        if not obj.has_report:
+            return None
+        url = reverse('files-report', args=[obj.pk])
+        request = self.context.get('request')
+        if request:
+            # Resolve the host once per listing instead of once per row
+            if not hasattr(self, '_base_uri'):
+                self._base_uri = request.build_absolute_uri('/')[:-1]
+            return self._base_uri + url
+        return url
 
-    def get_file_size(self, obj):
-        return obj.file.size if obj.file else None
+class UserFileListSerializer(UserFileSerializer):
+    """A row of the file list: status and counts, with the report itself behind report_url."""
 
-    def get_report_url(self, obj):
-        if obj.report:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(obj.report.url)
-            return obj.report.url
-        return None
\ No newline at end of file
+    class Meta(UserFileSerializer.Meta):
+        fields = [field for field in UserFileSerializer.Meta.fields if field != 'report']
+
+class ProcessingJobSerializer(serializers.ModelSerializer):
+    file_id = serializers.IntegerField(source='userfile_id', read_only=True)
+    queued_seconds = serializers.SerializerMethodField()
+    run_seconds = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ProcessingJob
+        fields = ['id', 'file_id', 'status', 'error', 'created_at', 'started_at', 'finished_at',
+                  'queued_seconds', 'run_seconds']
+        read_only_fields = fields
+
+    def get_queued_seconds(self, obj):
+        if obj.started_at:
+            return round((obj.started_at - obj.created_at).total_seconds(), 3)
+        return None
+
+    def get_run_seconds(self, obj):
+        if obj.started_at and obj.finished_at:
+            return round((obj.finished_at - obj.started_at).total_seconds(), 3)
+        return None
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    chunk_size = serializers.IntegerField(required=False, min_value=1)
+    chunk_count = serializers.IntegerField(read_only=True)
+    received_chunks = serializers.SerializerMethodField()
+    file_id = serializers.IntegerField(source='userfile_id', read_only=True)
+
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'file_name', 'total_size', 'chunk_size', 'chunk_count', 'received_chunks',
+                  'status', 'file_id', 'created_at', 'updated_at']
+        read_only_fields = ['status', 'created_at', 'updated_at']
+
+    def get_received_chunks(self, obj):
+        return sorted(obj.chunks.values_list('index', flat=True))
@@ -0,0 +1,248 @@
+import hashlib
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max, Min, Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import UserFile, ReportAggregate, DailyUploadRollup, DailyReportCount
+from .rollups import rollup_date
+from stats.utils import MAX_SPECIALIZATION_CHOICES
+
+
+def specialization_filter(university=None, choice=1, prefix=''):
+    """
+    Q() selecting the specialization counts of the summary.
+
+    Without a university these are the NCT_UNIVERSITY_CODE first choices of
+    the reports; with one, the ``choice`` counts of that university from the
+    specialization matrix.
+
+    Args:
+        university (str): University code, None for the configured one
+        choice (int): Choice number, 1 for first choices
+        prefix (str): Lookup path to the aggregate rows, e.g. 'aggregates__'
+    """
+    if university is None:
+        return Q(**{f'{prefix}kind': ReportAggregate.KIND_SPECIALIZATION})
+    return Q(**{
+        f'{prefix}kind': ReportAggregate.KIND_UNIVERSITY_CHOICES[choice],
+        f'{prefix}name__startswith': ReportAggregate.university_name(university, '')
+    })
+
+
+def aggregate_totals(report_counts, university=None, choice=1):
+    """
+    Sum DailyReportCount rows by kind and name.
+
+    Names keep the order in which they were first stored, like the reports they come from.
+    ``university`` and ``choice`` select the specialization counts, see specialization_filter().
+
+    Returns:
+        tuple: (total_quota_counts, total_specialization_counts)
+    """
+    totals = report_counts.filter(
+        Q(kind__in=[ReportAggregate.KIND_QUOTA, ReportAggregate.KIND_PRIM]) |
+        specialization_filter(university, choice)
+    ).values('kind', 'name').annotate(
+        total=Sum('count'),
+        first_id=Min('id')
+    ).order_by('first_id')
+
+    quota_counts = {}
+    prim_counts = {}
+    specialization_counts = {}
+    by_kind = {
+        ReportAggregate.KIND_QUOTA: quota_counts,
+        ReportAggregate.KIND_PRIM: prim_counts,
+    }
+    prefix = ReportAggregate.university_name(university, '') if university is not None else ''
+    for row in totals:
+        # Names whose files were all re-processed or deleted sum to zero
+        if row['total'] or row['kind'] == ReportAggregate.KIND_QUOTA:
+            counts = by_kind.get(row['kind'], specialization_counts)
+            name = row['name'][len(prefix):] if counts is specialization_counts else row['name']
+            counts[name] = row['total']
+    if prim_counts:
+        quota_counts['Примечание'] = prim_counts
+    return quota_counts, specialization_counts
+
+
+def upload_timeline(files, university=None, choice=1):
+    """Per-file quota and specialization totals, oldest upload first."""
+    rows = files.annotate(
+        quota_count=Coalesce(Sum('aggregates__count', filter=Q(aggregates__kind=ReportAggregate.KIND_QUOTA)), 0),
+        specialization_count=Coalesce(
+            Sum('aggregates__count', filter=specialization_filter(university, choice, prefix='aggregates__')), 0
+        )
+    ).order_by('uploaded_at').values('id', 'file', 'uploaded_at', 'quota_count', 'specialization_count')
+    return [
+        {
+            'file_id': row['id'],
+            'file_name': row['file'].split('/')[-1],
+            'uploaded_at': row['uploaded_at'].isoformat(),
+            'quota_count': row['quota_count'],
+            'specialization_count': row['specialization_count']
+        }
+        for row in rows
+    ]
+
+
+def most_active_days(upload_rollups, limit=10):
+    """Days with the most uploads (UTC dates), busiest first."""
+    rows = upload_rollups.values('date').annotate(uploads=Sum('files')).filter(
+        uploads__gt=0
+    ).order_by('-uploads', 'date')[:limit]
+    return [{'date': row['date'].isoformat(), 'uploads': row['uploads']} for row in rows]
+
+
+def build_summary(files, start_date, end_date, user=None, university=None, choice=1):
+    """
+    Build the `summary` section of the summary endpoint.
+
+    Totals, processing stats and the busiest days come from the daily rollup
+    tables, so the work grows with the number of days rather than files.
+    The range covers whole UTC days, the granularity of the rollups.
+
+    Args:
+        files (QuerySet): UserFiles visible to the caller, for the upload timeline
+        start_date (datetime): Start of the range
+        end_date (datetime): End of the range
+        user (User): Only count this user's files, None for everyone
+        university (str): Count this university's specializations from the stored
+            specialization matrix instead of NCT_UNIVERSITY_CODE first choices
+        choice (int): Which choice of ``university`` to count, 1 to 4
+    """
+    start_day = rollup_date(_aware(start_date))
+    end_day = rollup_date(_aware(end_date))
+    upload_rollups = DailyUploadRollup.objects.filter(date__gte=start_day, date__lte=end_day)
+    report_counts = DailyReportCount.objects.filter(date__gte=start_day, date__lte=end_day)
+    if user is not None:
+        upload_rollups = upload_rollups.filter(user=user)
+        report_counts = report_counts.filter(user=user)
+
+    totals = upload_rollups.aggregate(
+        files=Sum('files'),
+        seconds=Sum('processing_seconds'),
+        timed_files=Sum('files_with_processing_data')
+    )
+    timed_files = totals['timed_files'] or 0
+    total_seconds = totals['seconds'] or 0
+    total_quota_counts, total_specialization_counts = aggregate_totals(report_counts, university, choice)
+
+    day_start = datetime.combine(start_day, time.min, tzinfo=dt_timezone.utc)
+    day_end = datetime.combine(end_day + timedelta(days=1), time.min, tzinfo=dt_timezone.utc)
+    files_in_range = files.filter(
+        uploaded_at__gte=day_start, uploaded_at__lt=day_end, has_report=True
+    ).exclude(status=UserFile.STATUS_SUPERSEDED)
+    return {
+        'total_files': totals['files'] or 0,
+        'total_quota_counts': total_quota_counts,
+        'total_specialization_counts': total_specialization_counts,
+        'processing_stats': {
+            'average_processing_time_seconds': round(total_seconds / timed_files if timed_files else 0, 3),
+            'total_processing_time_seconds': round(total_seconds, 3),
+            'files_with_processing_data': timed_files
+        },
+        'file_upload_timeline': upload_timeline(files_in_range, university, choice),
+        'most_active_days': most_active_days(upload_rollups)
+    }
+
+
+def parse_summary_params(query_params):
+    """
+    Read the summary endpoint's query parameters.
+
+    Returns:
+        tuple: ((days, user_only, university, choice), None) or (None, error message)
+    """
+    try:
+        days = int(query_params.get('days', 30))
+        choice = int(query_params.get('choice', 1))
+    except ValueError:
+        return None, 'days and choice must be integers'
+    if not 1 <= choice <= MAX_SPECIALIZATION_CHOICES:
+        return None, f'choice must be between 1 and {MAX_SPECIALIZATION_CHOICES}'
+    user_only = query_params.get('user_only', 'true').lower() == 'true'
+    university = query_params.get('university') or None
+    return (days, user_only, university, choice), None
+
+
+def build_summary_data(files, days, user=None, university=None, choice=1):
+    """Build the summary endpoint's response body for the last ``days`` days, see build_summary()."""
+    end_date = datetime.now()
+    start_date = end_date - timedelta(days=days)
+    # Totals come from the daily rollup tables, no report files are read
+    summary = build_summary(files, start_date, end_date, user=user, university=university, choice=choice)
+    return {
+        'summary': summary,
+        'metadata': {
+            'generated_at': datetime.now().isoformat(),
+            'time_range_days': days,
+            'files_included': summary['total_files'],
+            'university': university or settings.NCT_UNIVERSITY_CODE,
+            'choice': choice,
+            'date_range': {
+                'start': start_date.isoformat(),
+                'end': end_date.isoformat()
+            }
+        }
+    }
+
+
+def _aware(value):
+    return timezone.make_aware(value) if timezone.is_naive(value) else value
+
+
+def _version_key(user_id):
+    return f"files:summary:version:{user_id if user_id is not None else 'all'}"
+
+
+def invalidate_summary(user_id):
+    """
+    Mark cached summaries that include this user's files as stale.
+
+    Each user has a version key and so does the staff-wide summary; both are
+    set to the current time, which also serves as the summary's last change.
+    """
+    now = timezone.now().timestamp()
+    cache.set_many({_version_key(user_id): now, _version_key(None): now}, timeout=None)
+
+
+def summary_version(user=None):
+    """Time of the last invalidation for a user (None for the staff-wide summary), 0 if unknown."""
+    return cache.get(_version_key(user.pk if user is not None else None), 0)
+
+
+async def asummary_version(user=None):
+    """Async summary_version()."""
+    return await cache.aget(_version_key(user.pk if user is not None else None), 0)
+
+
+def summary_validators(files, user, version, *params):
+    """
+    Return (etag, last_modified timestamp) of a summary.
+
+    They change with the latest upload, the summary version and the query
+    parameters, so an unchanged dashboard can be answered with a 304.
+    """
+    latest = files.aggregate(latest=Max('uploaded_at'))['latest']
+    return _validators(latest, user, version, params)
+
+
+async def asummary_validators(files, user, version, *params):
+    """Async summary_validators()."""
+    latest = (await files.aaggregate(latest=Max('uploaded_at')))['latest']
+    return _validators(latest, user, version, params)
+
+
+def _validators(latest, user, version, params):
+    last_modified = max(latest.timestamp() if latest else 0, version)
+    parts = [user.pk if user is not None else 'all', latest.isoformat() if latest else '', repr(version), *params]
+    etag = hashlib.md5(':'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+    return f'"{etag}"', int(last_modified)
+
+
+def summary_cache_key(user, version, *params):
+    parts = [user.pk if user is not None else 'all', repr(version), *params]
+    return 'files:summary:' + ':'.join(str(part) for part in parts)
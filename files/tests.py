@@ -0,0 +1,868 @@
+import hashlib
+import io
+import json
+import os
+import random
+import tempfile
+import zipfile
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from unittest import mock
+import openpyxl
+from django.contrib.auth.models import User
+from django.core.files import File
+from django.core.management import call_command
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import Sum
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+from files.bulk import expand_bulk_upload
+from files.jobs import claim_next_job, requeue_stale_jobs, run_worker
+from files.models import DailyReportCount, DailyUploadRollup, ProcessingJob, ReportAggregate, UserFile
+from files.rollups import apply_rollup_delta, rebuild_daily_rollups
+from files.summary import build_summary_data
+from files.utils import process_userfile_and_save_report
+from stats import utils as nct
+from stats.synthetic import _data_row, write_nct_workbook
+from stats.testing import dedup_store, report_counts
+
+
+def zip_upload(members):
+    """An uploaded .zip holding (name, bytes) members."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members:
+            zf.writestr(name, data)
+    return SimpleUploadedFile('upload.zip', buffer.getvalue())
+
+
+@override_settings(FILES_BULK_MAX_FILES=3, FILES_BULK_MAX_EXTRACTED_SIZE=1000)
+class ExpandBulkUploadTests(SimpleTestCase):
+    def test_expands_members_within_the_limits(self):
+        items, error = expand_bulk_upload([zip_upload([('a.xlsx', b'a' * 500), ('b.xlsx', b'b' * 400)])])
+        self.assertIsNone(error)
+        self.assertEqual([(name, item.read()) for name, item in items],
+                         [('a.xlsx', b'a' * 500), ('b.xlsx', b'b' * 400)])
+
+    def test_refuses_archives_expanding_past_the_size_limit(self):
+        # 1200 bytes of zeros compress to a few dozen
+        items, error = expand_bulk_upload([zip_upload([('a.xlsx', bytes(800)), ('b.xlsx', bytes(400))])])
+        self.assertIsNone(items)
+        self.assertIn('more than 1000 bytes', error)
+
+    def test_refuses_archives_with_too_many_files(self):
+        items, error = expand_bulk_upload([zip_upload([(f'{i}.xlsx', b'x') for i in range(4)])])
+        self.assertIsNone(items)
+        self.assertIn('At most 3 files', error)
+
+    def test_counts_extracted_bytes_not_declared_sizes(self):
+        upload = zip_upload([('a.xlsx', bytes(5000))])
+        data = bytearray(upload.read())
+        # Declare 10 bytes in the central directory and the local header
+        central = data.find(b'PK\x01\x02')
+        data[central + 24:central + 28] = (10).to_bytes(4, 'little')
+        local = data.find(b'PK\x03\x04')
+        data[local + 22:local + 26] = (10).to_bytes(4, 'little')
+        items, error = expand_bulk_upload([SimpleUploadedFile('upload.zip', bytes(data))])
+        self.assertIsNone(items)
+        self.assertIsNotNone(error)
+
+
+class BulkUploadTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = tmp.name
+        self.enterContext(override_settings(MEDIA_ROOT=os.path.join(tmp.name, 'media')))
+        self.enterContext(dedup_store('memory', tmp.name))
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('bulk', password='bulk'))
+
+        # b.xlsx is a.xlsx without its last row, so every row of b is a duplicate of a
+        path = os.path.join(tmp.name, 'a.xlsx')
+        write_nct_workbook(path, 200, blocks=2, seed=11)
+        with open(path, 'rb') as f:
+            self.a = f.read()
+        wb = openpyxl.load_workbook(path)
+        wb.active.delete_rows(wb.active.max_row)
+        buffer = io.BytesIO()
+        wb.save(buffer)
+        self.b = buffer.getvalue()
+
+    def post(self, members):
+        return self.client.post('/api/files/bulk/', {'files': [zip_upload(members)]}, format='multipart')
+
+    @override_settings(FILES_PROCESS_IN_BACKGROUND=False)
+    def test_files_are_processed_in_upload_order(self):
+        for members, expected in (
+            ([('a.xlsx', self.a), ('b.xlsx', self.b)], [0, 199]),
+            ([('b.xlsx', self.b), ('a.xlsx', self.a)], [0, 199]),
+        ):
+            with self.subTest(first=members[0][0]):
+                nct.hash_processor.reset()
+                nct.file_hash_processor.reset()
+                UserFile.objects.all().delete()
+                response = self.post(members)
+                self.assertEqual(response.status_code, 200)
+                results = response.data['results']
+                self.assertEqual([result['status'] for result in results], ['processed', 'processed'])
+                skipped = [
+                    UserFile.objects.get(pk=result['file']['id'])
+                    .report['metadata']['deduplication_stats']['duplicate_rows_skipped']
+                    for result in results
+                ]
+                self.assertEqual(skipped, expected)
+                self.assertEqual(response.data['merged_report']['metadata']['files_merged'], 2)
+
+    @override_settings(FILES_PROCESS_IN_BACKGROUND=True)
+    def test_files_are_queued_one_job_each(self):
+        response = self.post([('a.xlsx', self.a), ('copy.xlsx', self.a), ('b.xlsx', self.b)])
+        self.assertEqual(response.status_code, 202)
+        results = response.data['results']
+        self.assertEqual([result['status'] for result in results], ['queued', 'duplicate', 'queued'])
+        self.assertEqual([result['job']['status'] if result['job'] else None for result in results],
+                         ['queued', None, 'queued'])
+        self.assertIsNone(response.data['merged_report'])
+        self.assertEqual(ProcessingJob.objects.count(), 2)
+
+
+@override_settings(FILES_PROCESS_IN_BACKGROUND=False)
+class DuplicateUploadTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.media = os.path.join(tmp.name, 'media')
+        self.enterContext(override_settings(MEDIA_ROOT=self.media))
+        self.enterContext(dedup_store('memory', tmp.name))
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('dup', password='dup'))
+
+        path = os.path.join(tmp.name, 'a.xlsx')
+        write_nct_workbook(path, 50, seed=5)
+        with open(path, 'rb') as f:
+            self.data = f.read()
+
+    def upload(self, name):
+        return self.client.post('/api/files/', {'file': SimpleUploadedFile(name, self.data)}, format='multipart')
+
+    def stored_files(self):
+        return sorted(os.listdir(os.path.join(self.media, 'uploads')))
+
+    def test_content_hash_is_computed_while_the_upload_is_stored(self):
+        response = self.upload('a.xlsx')
+        self.assertEqual(response.status_code, 201)
+        userfile = UserFile.objects.get()
+        self.assertEqual(userfile.content_hash, hashlib.md5(self.data).hexdigest())
+        self.assertEqual(userfile.file_size, len(self.data))
+        with userfile.file.open('rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_same_content_under_another_name_is_rejected_and_not_stored(self):
+        self.assertEqual(self.upload('a.xlsx').status_code, 201)
+        stored = self.stored_files()
+        response = self.upload('renamed.xlsx')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('already been processed', response.json()['error'])
+        self.assertEqual(UserFile.objects.count(), 1)
+        self.assertEqual(self.stored_files(), stored)
+
+    def test_failed_uploads_do_not_count_as_duplicates(self):
+        with mock.patch('files.utils.process_excel_file', return_value=(None, 'broken')):
+            self.upload('a.xlsx')
+        self.assertFalse(UserFile.objects.get().has_report)
+        self.assertEqual(self.upload('a.xlsx').status_code, 201)
+
+
+@override_settings(FILES_PROCESS_IN_BACKGROUND=True)
+class JobTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = tmp.name
+        self.enterContext(override_settings(MEDIA_ROOT=os.path.join(tmp.name, 'media')))
+        self.enterContext(dedup_store('memory', tmp.name))
+        self.user = User.objects.create_user('jobs', password='jobs')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, seed):
+        path = os.path.join(self.directory, f'{seed}.xlsx')
+        write_nct_workbook(path, 20, seed=seed)
+        with open(path, 'rb') as f:
+            response = self.client.post('/api/files/', {'file': f}, format='multipart')
+        self.assertEqual(response.status_code, 202)
+        return UserFile.objects.get(pk=response.data['id'])
+
+    def test_jobs_are_claimed_oldest_first_and_once(self):
+        first, second = self.upload(1), self.upload(2)
+        job = claim_next_job('a')
+        self.assertEqual((job.userfile_id, job.status, job.worker), (first.pk, ProcessingJob.STATUS_RUNNING, 'a'))
+        first.refresh_from_db()
+        self.assertEqual(first.status, UserFile.STATUS_PROCESSING)
+        self.assertEqual(claim_next_job('b').userfile_id, second.pk)
+        self.assertIsNone(claim_next_job('c'))
+
+    def test_stale_running_jobs_are_requeued(self):
+        stale, fresh = self.upload(1), self.upload(2)
+        claim_next_job('a')
+        claim_next_job('b')
+        ProcessingJob.objects.filter(userfile=stale).update(started_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(requeue_stale_jobs(30 * 60), 1)
+        self.assertEqual(ProcessingJob.objects.get(userfile=stale).status, ProcessingJob.STATUS_QUEUED)
+        self.assertEqual(ProcessingJob.objects.get(userfile=fresh).status, ProcessingJob.STATUS_RUNNING)
+        stale.refresh_from_db()
+        self.assertEqual(stale.status, UserFile.STATUS_PENDING)
+        self.assertEqual(claim_next_job('c').userfile_id, stale.pk)
+
+    def test_worker_processes_the_queue_and_logs_each_job(self):
+        userfile = self.upload(1)
+        status_url = f'/api/files/{userfile.pk}/status/'
+        self.assertEqual(self.client.get(status_url).data['status'], ProcessingJob.STATUS_QUEUED)
+
+        with self.assertLogs('files.jobs', 'INFO') as logs:
+            self.assertEqual(run_worker('w', once=True), 1)
+        self.assertEqual(logs.output, [f'INFO:files.jobs:[w] job {userfile.jobs.get().pk} for file {userfile.pk}: done'])
+
+        data = self.client.get(status_url).data
+        self.assertEqual((data['file_id'], data['status'], data['error']), (userfile.pk, ProcessingJob.STATUS_DONE, ''))
+        self.assertIsNotNone(data['run_seconds'])
+        userfile.refresh_from_db()
+        self.assertTrue(userfile.has_report)
+
+    def test_status_of_a_file_without_a_job_or_of_another_user(self):
+        with override_settings(FILES_PROCESS_IN_BACKGROUND=False):
+            path = os.path.join(self.directory, 'a.xlsx')
+            write_nct_workbook(path, 20, seed=3)
+            with open(path, 'rb') as f:
+                self.assertEqual(self.client.post('/api/files/', {'file': f}, format='multipart').status_code, 201)
+        userfile = UserFile.objects.get()
+        self.assertEqual(self.client.get(f'/api/files/{userfile.pk}/status/').status_code, 404)
+
+        queued = self.upload(4)
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user('other', password='other'))
+        self.assertEqual(other.get(f'/api/files/{queued.pk}/status/').status_code, 404)
+
+
+@override_settings(FILES_PROCESS_IN_BACKGROUND=False)
+class SummaryCacheTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = tmp.name
+        self.enterContext(override_settings(MEDIA_ROOT=os.path.join(tmp.name, 'media')))
+        self.enterContext(dedup_store('memory', tmp.name))
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('summary', password='summary'))
+
+    def upload(self, seed):
+        path = os.path.join(self.directory, f'{seed}.xlsx')
+        write_nct_workbook(path, 20, seed=seed)
+        with open(path, 'rb') as f:
+            response = self.client.post('/api/files/', {'file': f}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def summary(self, etag=None, **params):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return self.client.get('/api/files/summary/', params, **headers)
+
+    def test_unchanged_summary_is_not_modified(self):
+        self.upload(1)
+        response = self.summary()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Last-Modified', response)
+        etag = response['ETag']
+        not_modified = self.summary(etag)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b'')
+        # Other parameters are another representation
+        self.assertEqual(self.summary(etag, days=7).status_code, 200)
+
+    def test_uploads_and_deletes_change_the_etag(self):
+        first = self.upload(1)
+        before = self.summary()
+        self.upload(2)
+        after = self.summary(before['ETag'])
+        self.assertEqual(after.status_code, 200)
+        self.assertNotEqual(after['ETag'], before['ETag'])
+        self.assertEqual(after.data['metadata']['files_included'], before.data['metadata']['files_included'] + 1)
+
+        # Deleting invalidates once its transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.delete(f'/api/files/{first}/').status_code, 204)
+        deleted = self.summary(after['ETag'])
+        self.assertEqual(deleted.status_code, 200)
+        self.assertEqual(deleted.data['metadata']['files_included'], before.data['metadata']['files_included'])
+
+
+class FileListTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('list', password='list')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        other = User.objects.create_user('other', password='other')
+        start = timezone.now() - timedelta(days=1)
+        for i in range(8):
+            userfile = UserFile.objects.create(user=other if i == 3 else self.user,
+                                               file=f'uploads/{i}.xlsx', file_size=100 + i)
+            # Pairs of files share an upload time, so the id breaks ties
+            UserFile.objects.filter(pk=userfile.pk).update(uploaded_at=start + timedelta(minutes=i // 2))
+        self.expected = list(
+            UserFile.objects.filter(user=self.user).order_by('-uploaded_at', '-id').values_list('id', flat=True)
+        )
+
+    def test_pages_follow_the_cursor_newest_first(self):
+        ids = []
+        url = '/api/files/?page_size=3'
+        # The listing reads file names and sizes from the table, never from the storage
+        with mock.patch.object(FileSystemStorage, 'size', side_effect=AssertionError('stat')), \
+                mock.patch.object(FileSystemStorage, 'exists', side_effect=AssertionError('stat')):
+            while url:
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+                self.assertLessEqual(len(response.data['results']), 3)
+                ids += [row['id'] for row in response.data['results']]
+                url = response.data['next']
+        self.assertEqual(ids, self.expected)
+        self.assertEqual(len(self.expected), 7)
+
+    def test_files_added_between_pages_do_not_shift_the_next_page(self):
+        first = self.client.get('/api/files/?page_size=3')
+        UserFile.objects.create(user=self.user, file='uploads/new.xlsx', file_size=1)
+        second = self.client.get(first.data['next'])
+        self.assertEqual([row['id'] for row in second.data['results']], self.expected[3:6])
+
+
+@override_settings(FILES_PROCESS_IN_BACKGROUND=False)
+class ChunkedUploadTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.sessions = os.path.join(tmp.name, 'sessions')
+        self.enterContext(override_settings(MEDIA_ROOT=os.path.join(tmp.name, 'media'),
+                                            FILES_UPLOAD_SESSION_DIR=self.sessions))
+        self.enterContext(dedup_store('memory', tmp.name))
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('chunks', password='chunks'))
+
+        path = os.path.join(tmp.name, 'big.xlsx')
+        write_nct_workbook(path, 100, blocks=2, seed=6)
+        with open(path, 'rb') as f:
+            self.data = f.read()
+        self.chunk_size = 4096
+
+    def start(self):
+        response = self.client.post('/api/uploads/', {
+            'file_name': 'big.xlsx', 'total_size': len(self.data), 'chunk_size': self.chunk_size
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data
+
+    def put_chunk(self, session, index, data=None, md5=None):
+        data = data if data is not None else self.data[index * self.chunk_size:(index + 1) * self.chunk_size]
+        headers = {'HTTP_X_CHUNK_MD5': md5} if md5 else {}
+        return self.client.put(f"/api/uploads/{session['id']}/chunks/{index}/", data,
+                               content_type='application/octet-stream', **headers)
+
+    def complete(self, session):
+        return self.client.post(f"/api/uploads/{session['id']}/complete/")
+
+    def test_chunks_in_any_order_with_retries_make_the_file(self):
+        session = self.start()
+        count = session['chunk_count']
+        self.assertEqual(count, -(-len(self.data) // self.chunk_size))
+        for index in reversed(range(1, count)):
+            self.assertEqual(self.put_chunk(session, index).status_code, 200)
+
+        # A corrupted chunk is refused and sent again
+        self.assertEqual(self.put_chunk(session, 0, md5=hashlib.md5(b'other').hexdigest()).status_code, 400)
+        self.assertEqual(self.put_chunk(session, 0, data=b'x' * 10).status_code, 400)
+        self.assertEqual(self.client.get(f"/api/uploads/{session['id']}/").data['received_chunks'],
+                         list(range(1, count)))
+        response = self.complete(session)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'Missing chunks: [0]')
+
+        first = self.data[:self.chunk_size]
+        self.assertEqual(self.put_chunk(session, 0, md5=hashlib.md5(first).hexdigest()).status_code, 200)
+        response = self.complete(session)
+        self.assertEqual(response.status_code, 201)
+        userfile = UserFile.objects.get(pk=response.data['id'])
+        with userfile.file.open('rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual(userfile.content_hash, hashlib.md5(self.data).hexdigest())
+        self.assertEqual((userfile.source_name, userfile.file_size), ('big.xlsx', len(self.data)))
+        self.assertTrue(userfile.has_report)
+        self.assertEqual(os.listdir(self.sessions), [])
+
+        self.assertEqual(self.complete(session).data['error'], 'Upload session is already complete')
+        self.assertEqual(self.put_chunk(session, 0).status_code, 400)
+
+    def test_duplicate_of_a_recent_upload_is_dropped(self):
+        self.assertEqual(self.client.post('/api/files/', {'file': SimpleUploadedFile('big.xlsx', self.data)},
+                                          format='multipart').status_code, 201)
+        session = self.start()
+        for index in range(session['chunk_count']):
+            self.put_chunk(session, index)
+        response = self.complete(session)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('already been processed', response.data['error'])
+        self.assertEqual(UserFile.objects.count(), 1)
+        self.assertEqual(os.listdir(self.sessions), [])
+
+
+@override_settings(FILES_PROCESS_IN_BACKGROUND=False, METRICS_ALLOWED_IPS=['127.0.0.1'])
+class MetricsEndpointTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = tmp.name
+        self.enterContext(override_settings(MEDIA_ROOT=os.path.join(tmp.name, 'media'),
+                                            METRICS_DB=os.path.join(tmp.name, 'metrics.sqlite3')))
+        self.enterContext(dedup_store('memory', tmp.name))
+
+    def test_only_allowed_addresses_can_scrape(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code, 403)
+        with override_settings(METRICS_ALLOWED_IPS=[]):
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+    def test_uploads_and_reports_are_counted(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('metrics', password='metrics'))
+        path = os.path.join(self.directory, 'a.xlsx')
+        write_nct_workbook(path, 40, seed=2)
+        with open(path, 'rb') as f:
+            self.assertEqual(client.post('/api/files/', {'file': f}, format='multipart').status_code, 201)
+
+        response = self.client.get('/metrics')
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        lines = response.content.decode('utf-8').splitlines()
+        self.assertIn('files_uploads_total{kind="single"} 1', lines)
+        self.assertIn('nct_reports_total{status="success"} 1', lines)
+        self.assertIn('nct_rows_processed_total 40', lines)
+        buckets = [line for line in lines if line.startswith('files_upload_size_bytes_bucket')]
+        self.assertEqual(buckets[-1], 'files_upload_size_bytes_bucket{le="+Inf"} 1')
+        self.assertIn('files_upload_size_bytes_count 1', lines)
+
+    def test_disabled_metrics_render_no_samples(self):
+        with override_settings(METRICS_DB=None):
+            lines = self.client.get('/metrics').content.decode('utf-8').splitlines()
+        # Only the derived dedup ratio has a value
+        self.assertEqual([line for line in lines if not line.startswith('# ')], ['nct_dedup_hit_ratio 0'])
+
+
+@override_settings(FILES_PROCESS_IN_BACKGROUND=False)
+class AsyncViewTests(TransactionTestCase):
+    """The async views answer like the DRF ones. Uploads run on the thread pool, so no TestCase transaction."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = tmp.name
+        self.enterContext(override_settings(MEDIA_ROOT=os.path.join(tmp.name, 'media')))
+        self.enterContext(dedup_store('memory', tmp.name))
+        user = User.objects.create_user('async', password='async')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+
+    def upload(self, url, seed):
+        path = os.path.join(self.directory, f'{seed}.xlsx')
+        if not os.path.exists(path):
+            write_nct_workbook(path, 30, seed=seed)
+        with open(path, 'rb') as f:
+            return self.client.post(url, {'file': f}, format='multipart')
+
+    def test_upload_and_duplicate(self):
+        response = self.upload('/api/async/files/', 1)
+        self.assertEqual(response.status_code, 201)
+        userfile = UserFile.objects.get(pk=response.json()['id'])
+        self.assertTrue(userfile.has_report)
+        self.assertEqual(response.json()['content_hash'], userfile.content_hash)
+
+        duplicate = self.upload('/api/async/files/', 1)
+        self.assertEqual(duplicate.status_code, 400)
+        self.assertIn('already been processed', duplicate.json()['error'])
+        self.assertEqual(UserFile.objects.count(), 1)
+
+    def test_list_and_summary_equal_the_drf_views(self):
+        for seed in range(1, 4):
+            self.assertEqual(self.upload('/api/files/', seed).status_code, 201)
+
+        sync_page = self.client.get('/api/files/?page_size=2').json()
+        async_page = self.client.get('/api/async/files/?page_size=2').json()
+        self.assertEqual(async_page['results'], sync_page['results'])
+        self.assertEqual(self.client.get(async_page['next']).json()['results'],
+                         self.client.get(sync_page['next']).json()['results'])
+
+        sync_summary = self.client.get('/api/files/summary/?days=7')
+        async_summary = self.client.get('/api/async/files/summary/?days=7')
+        self.assertEqual(async_summary.status_code, 200)
+        self.assertEqual(async_summary.json()['summary'], sync_summary.json()['summary'])
+        self.assertEqual(async_summary['ETag'], sync_summary['ETag'])
+        not_modified = self.client.get('/api/async/files/summary/?days=7', HTTP_IF_NONE_MATCH=async_summary['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_requests_without_a_token_are_refused(self):
+        self.client.credentials()
+        for url in ('/api/async/files/', '/api/async/files/summary/'):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 401)
+                self.assertEqual(response['WWW-Authenticate'], 'Bearer realm="api"')
+
+
+class ApplyRollupDeltaTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('rollups', password='rollups')
+        self.day = date(2025, 7, 1)
+
+    def stored_counts(self):
+        return dict(
+            ((kind, name), count)
+            for kind, name, count in DailyReportCount.objects.filter(user=self.user, date=self.day)
+            .values_list('kind', 'name', 'count')
+        )
+
+    def test_batches_thousands_of_names(self):
+        counts = {(ReportAggregate.KIND_UNIVERSITY_CHOICES[1], f'University {i}'): i + 1 for i in range(3000)}
+        with CaptureQueriesContext(connection) as queries:
+            apply_rollup_delta(self.user.pk, self.day, counts=counts)
+        self.assertLess(len(queries), 50)
+        self.assertEqual(self.stored_counts(), counts)
+
+    def test_adds_to_existing_rows(self):
+        quota = ReportAggregate.KIND_QUOTA
+        apply_rollup_delta(self.user.pk, self.day, counts={(quota, 'Сирота'): 3, (quota, 'Инвалид'): 2})
+        apply_rollup_delta(self.user.pk, self.day, counts={(quota, 'Сирота'): -1, (quota, 'Многодетные'): 4})
+        self.assertEqual(self.stored_counts(), {
+            (quota, 'Сирота'): 2, (quota, 'Инвалид'): 2, (quota, 'Многодетные'): 4
+        })
+
+
+def per_report_summary(userfiles):
+    """The summary totals as the summary endpoint used to compute them, by reading every report."""
+    quota_counts, specialization_counts, processing_times = {}, {}, []
+    for userfile in userfiles:
+        report = userfile.report
+        for category, count in report.get('quota_counts', {}).items():
+            if category == 'Примечание' and isinstance(count, dict):
+                nested = quota_counts.setdefault(category, {})
+                for sub_category, sub_count in count.items():
+                    nested[sub_category] = nested.get(sub_category, 0) + sub_count
+            else:
+                quota_counts[category] = quota_counts.get(category, 0) + count
+        for specialization, count in report.get('specialization_counts', {}).items():
+            specialization_counts[specialization] = specialization_counts.get(specialization, 0) + count
+        if 'processing_duration_seconds' in report.get('metadata', {}):
+            processing_times.append(report['metadata']['processing_duration_seconds'])
+    return {
+        'total_files': len(userfiles),
+        'total_quota_counts': quota_counts,
+        'total_specialization_counts': specialization_counts,
+        'processing_stats': {
+            'average_processing_time_seconds': round(
+                sum(processing_times) / len(processing_times) if processing_times else 0, 3),
+            'total_processing_time_seconds': round(sum(processing_times), 3),
+            'files_with_processing_data': len(processing_times)
+        },
+    }
+
+
+class RollupSummaryTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = tmp.name
+        self.enterContext(override_settings(MEDIA_ROOT=os.path.join(tmp.name, 'media')))
+        self.enterContext(dedup_store('memory', tmp.name))
+        self.users = [User.objects.create_user(name, password=name) for name in ('first', 'second')]
+        self.files = []
+        # Files of both users spread over three days
+        for seed, (user, days_ago) in enumerate([(0, 0), (0, 2), (1, 2), (1, 5)], start=1):
+            path = os.path.join(tmp.name, f'{seed}.xlsx')
+            write_nct_workbook(path, 60, blocks=2, seed=seed)
+            userfile = UserFile(user=self.users[user])
+            with open(path, 'rb') as f:
+                userfile.file.save(f'{seed}.xlsx', File(f), save=False)
+            userfile.save()
+            UserFile.objects.filter(pk=userfile.pk).update(uploaded_at=timezone.now() - timedelta(days=days_ago))
+            userfile.refresh_from_db()
+            report, error = process_userfile_and_save_report(userfile)
+            self.assertIsNone(error)
+            userfile.refresh_from_db()
+            self.files.append(userfile)
+
+    def rollup_rows(self):
+        return (
+            sorted(DailyUploadRollup.objects.values_list('user_id', 'date', 'files', 'files_with_processing_data')),
+            sorted(DailyReportCount.objects.filter(count__gt=0).values_list('user_id', 'date', 'kind', 'name', 'count')),
+        )
+
+    def test_rollup_summary_equals_the_per_report_summary(self):
+        for user, expected_files in ((None, self.files), (self.users[0], self.files[:2]), (self.users[1], self.files[2:])):
+            with self.subTest(user=user):
+                # The view passes the files the caller can see
+                files = UserFile.objects.filter(user=user) if user else UserFile.objects.all()
+                summary = build_summary_data(files, 30, user=user)['summary']
+                expected = per_report_summary(expected_files)
+                self.assertEqual({key: summary[key] for key in expected}, expected)
+                self.assertEqual([row['file_id'] for row in summary['file_upload_timeline']],
+                                 [userfile.pk for userfile in sorted(expected_files, key=lambda f: f.uploaded_at)])
+
+    def test_timeline_counts_equal_the_reports(self):
+        timeline = build_summary_data(UserFile.objects.all(), 30)['summary']['file_upload_timeline']
+        self.assertEqual(
+            {row['file_id']: (row['quota_count'], row['specialization_count']) for row in timeline},
+            {
+                userfile.pk: (
+                    sum(v for v in userfile.report['quota_counts'].values() if isinstance(v, (int, float))),
+                    sum(userfile.report['specialization_counts'].values())
+                )
+                for userfile in self.files
+            }
+        )
+
+    def test_backfilling_stored_reports_again_changes_nothing(self):
+        before = build_summary_data(UserFile.objects.all(), 30)['summary']
+        aggregates = sorted(ReportAggregate.objects.values_list('userfile_id', 'kind', 'name', 'count'))
+        call_command('backfill_report_aggregates', '--all', stdout=io.StringIO())
+        self.assertEqual(sorted(ReportAggregate.objects.values_list('userfile_id', 'kind', 'name', 'count')),
+                         aggregates)
+        self.assertEqual(build_summary_data(UserFile.objects.all(), 30)['summary'], before)
+
+
+    def test_rebuilding_gives_the_incrementally_kept_rows(self):
+        before = self.rollup_rows()
+        rebuild_daily_rollups()
+        self.assertEqual(self.rollup_rows(), before)
+
+
+class RevisionTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = tmp.name
+        self.enterContext(override_settings(MEDIA_ROOT=os.path.join(tmp.name, 'media'), NCT_BLOCK_CACHE_DIR=None,
+                                            FILES_INCREMENTAL_REVISIONS=True))
+        self.row_store = self.enterContext(dedup_store('memory', tmp.name))
+        self.user = User.objects.create_user('revisions', password='revisions')
+
+    def workbook(self, name, seed=7):
+        path = os.path.join(self.directory, name)
+        write_nct_workbook(path, 600, blocks=6, duplicate_ratio=0.05, seed=seed)
+        return path
+
+    def without_row(self, source, name, row):
+        """A copy of a workbook with one data row deleted."""
+        wb = openpyxl.load_workbook(source)
+        wb.active.delete_rows(row)
+        path = os.path.join(self.directory, name)
+        wb.save(path)
+        return path
+
+    def with_appended_rows(self, source, name):
+        """A copy of a workbook with two new data rows at the end of every block."""
+        wb = openpyxl.load_workbook(source)
+        ws = wb.active
+        banners = [row for row in range(1, ws.max_row + 1) if ws.cell(row, 1).value == nct.NCT_BANNER]
+        rng = random.Random(99)
+        for end in [ws.max_row + 1] + banners[:0:-1]:
+            ws.insert_rows(end, 2)
+            for offset in range(2):
+                for column, value in enumerate(_data_row(rng, 10000 + end + offset), start=1):
+                    ws.cell(end + offset, column, value)
+        path = os.path.join(self.directory, name)
+        wb.save(path)
+        return path
+
+    def upload(self, path):
+        with open(path, 'rb') as f:
+            userfile = UserFile.objects.create(user=self.user, file=File(f, name='grants.xlsx'))
+        report, error = process_userfile_and_save_report(userfile)
+        self.assertIsNone(error)
+        userfile.refresh_from_db()
+        return userfile
+
+    def counted_files(self):
+        return set(ReportAggregate.objects.values_list('userfile_id', flat=True).distinct())
+
+    def test_unrelated_workbook_of_the_same_name_is_a_new_file(self):
+        first = self.upload(self.workbook('first.xlsx', seed=1))
+        second = self.upload(self.workbook('second.xlsx', seed=2))
+        first.refresh_from_db()
+        self.assertIsNone(second.previous_version_id)
+        self.assertNotIn('revision', second.report)
+        self.assertEqual(first.status, UserFile.STATUS_PROCESSED)
+        self.assertEqual(self.counted_files(), {first.pk, second.pk})
+
+    def test_first_revision_reuses_blocks_and_reads_the_file_once(self):
+        v1 = self.workbook('v1.xlsx')
+        v2 = self.without_row(v1, 'v2.xlsx', 100)
+        first = self.upload(v1)
+        self.assertEqual(first.blocks.count(), 6)
+        with mock.patch.object(nct, 'load_nct_workbook', wraps=nct.load_nct_workbook) as load:
+            second = self.upload(v2)
+        self.assertEqual(load.call_count, 1)
+        self.assertEqual(second.previous_version_id, first.pk)
+        # The row is deleted from the first block, the other five are unchanged
+        self.assertEqual(second.report['metadata']['blocks_reused'], 5)
+        self.assertEqual(second.report['revision']['blocks'],
+                         {'unchanged': 5, 'changed': 1, 'added': 0, 'removed': 0})
+
+    def test_rows_appended_to_every_block_revise_the_file(self):
+        v1 = self.workbook('v1.xlsx')
+        v2 = self.with_appended_rows(v1, 'v2.xlsx')
+        first = self.upload(v1)
+        second = self.upload(v2)
+        first.refresh_from_db()
+        self.assertEqual(second.previous_version_id, first.pk)
+        self.assertEqual(first.status, UserFile.STATUS_SUPERSEDED)
+        self.assertEqual(self.counted_files(), {second.pk})
+        self.assertEqual(second.report['revision']['blocks']['changed'], 6)
+
+        # Counted as if the previous version had never been uploaded
+        self.row_store.reset()
+        expected, _ = nct.process_excel_file(v2)
+        self.assertEqual(report_counts(second.report), report_counts(expected))
+
+    def test_pooled_and_cached_sheets_give_the_same_report(self):
+        path = os.path.join(self.directory, 'sheets.xlsx')
+        write_nct_workbook(path, 600, blocks=4, duplicate_ratio=0.05, seed=3, max_rows_per_sheet=200)
+        expected, _ = nct.process_excel_file(path, sheet_names=nct.ALL_SHEETS)
+        cache_dir = os.path.join(self.directory, 'cache')
+        with override_settings(NCT_SHEETS=nct.ALL_SHEETS, NCT_PARSE_WORKERS=2, NCT_BLOCK_CACHE_DIR=cache_dir):
+            for _ in range(2):  # a cache miss, then a hit
+                self.row_store.reset()
+                userfile = self.upload(path)
+                self.assertEqual(report_counts(userfile.report), report_counts(expected))
+                self.assertEqual(sorted(userfile.blocks.values_list('sheet_name', 'index')),
+                                 [('Лист1', 0), ('Лист2', 0), ('Лист3', 0), ('Лист4', 0)])
+                self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+    def test_deleting_the_middle_of_a_revision_chain(self):
+        v1 = self.workbook('v1.xlsx')
+        v2 = self.without_row(v1, 'v2.xlsx', 100)
+        v3 = self.without_row(v2, 'v3.xlsx', 300)
+        a, b, c = self.upload(v1), self.upload(v2), self.upload(v3)
+        self.assertEqual((b.previous_version_id, c.previous_version_id), (a.pk, b.pk))
+        self.assertGreater(c.report['metadata']['blocks_reused'], 0)
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(client.delete(f'/api/files/{b.pk}/').status_code, 204)
+        a.refresh_from_db()
+        c.refresh_from_db()
+        self.assertEqual(a.status, UserFile.STATUS_SUPERSEDED)
+        self.assertEqual(c.previous_version_id, a.pk)
+        self.assertEqual(self.counted_files(), {c.pk})
+        self.assertEqual(DailyUploadRollup.objects.aggregate(files=Sum('files'))['files'], 1)
+
+        # Deleting the latest version counts the one before it again
+        self.assertEqual(client.delete(f'/api/files/{c.pk}/').status_code, 204)
+        a.refresh_from_db()
+        self.assertEqual(a.status, UserFile.STATUS_PROCESSED)
+        self.assertEqual(self.counted_files(), {a.pk})
+        self.assertEqual(DailyUploadRollup.objects.aggregate(files=Sum('files'))['files'], 1)
+
+
+class MigrationTests(TransactionTestCase):
+    """Runs data migrations against rows created in the schema they migrate from."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.media = os.path.join(tmp.name, 'media')
+        self.enterContext(override_settings(MEDIA_ROOT=self.media))
+        self.addCleanup(self.migrate, MigrationExecutor(connection).loader.graph.leaf_nodes('files'))
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def test_0008_backfills_the_daily_rollups(self):
+        apps = self.migrate([('files', '0007_report_aggregates')])
+        UserFile = apps.get_model('files', 'UserFile')
+        ReportAggregate = apps.get_model('files', 'ReportAggregate')
+        user_id = User.objects.create_user('old').pk
+        day = date(2025, 7, 1)
+        for seconds, counts in ((1.5, {'Сирота': 3, 'Инвалид': 1}), (None, {'Сирота': 2})):
+            userfile = UserFile.objects.create(user_id=user_id, file='uploads/a.xlsx',
+                                               processing_duration_seconds=seconds)
+            UserFile.objects.filter(pk=userfile.pk).update(
+                uploaded_at=datetime.combine(day, datetime.min.time(), tzinfo=dt_timezone.utc))
+            ReportAggregate.objects.bulk_create([
+                ReportAggregate(userfile=userfile, kind='quota', name=name, count=count)
+                for name, count in counts.items()
+            ])
+        # Never processed, so not counted
+        UserFile.objects.create(user_id=user_id, file='uploads/b.xlsx')
+
+        apps = self.migrate([('files', '0008_daily_rollups')])
+        self.assertEqual(
+            list(apps.get_model('files', 'DailyUploadRollup').objects.values_list(
+                'user_id', 'date', 'files', 'processing_seconds', 'files_with_processing_data')),
+            [(user_id, day, 2, 1.5, 1)]
+        )
+        self.assertEqual(
+            dict(apps.get_model('files', 'DailyReportCount').objects.values_list('name', 'count')),
+            {'Сирота': 5, 'Инвалид': 1}
+        )
+
+    def test_0011_moves_report_files_into_the_row_and_deletes_them(self):
+        apps = self.migrate([('files', '0010_upload_sessions')])
+        UserFile = apps.get_model('files', 'UserFile')
+        report = {'quota_counts': {'Бюджет': 3}, 'metadata': {'total_rows': 3}}
+        userfile = UserFile(user_id=User.objects.create_user('old').pk, file='uploads/a.xlsx')
+        userfile.report.save('a.json', ContentFile(json.dumps(report).encode('utf-8')), save=False)
+        userfile.save()
+        report_path = os.path.join(self.media, userfile.report.name)
+        self.assertTrue(os.path.exists(report_path))
+
+        apps = self.migrate([('files', '0011_userfile_report_json')])
+        self.assertEqual(apps.get_model('files', 'UserFile').objects.get(pk=userfile.pk).report, report)
+        self.assertFalse(os.path.exists(report_path))
+
+    def test_0013_backfills_status_and_counts(self):
+        apps = self.migrate([('files', '0012_report_aggregate_university_kinds')])
+        UserFile = apps.get_model('files', 'UserFile')
+        ProcessingJob = apps.get_model('files', 'ProcessingJob')
+        user_id = User.objects.create_user('old').pk
+        report = {'quota_counts': {}, 'metadata': {'total_rows_processed': 40, 'blocks_processed': 2}}
+        cases = {
+            'processed': (report, []),
+            'running': (None, ['failed', 'running']),
+            'failed': (None, ['done', 'failed']),
+            'queued': (None, ['queued']),
+            'untouched': (None, []),
+        }
+        pks = {}
+        for name, (file_report, job_statuses) in cases.items():
+            userfile = UserFile.objects.create(user_id=user_id, file=f'uploads/{name}.xlsx', report=file_report)
+            for job_status in job_statuses:
+                ProcessingJob.objects.create(userfile=userfile, status=job_status)
+            pks[name] = userfile.pk
+
+        apps = self.migrate([('files', '0013_userfile_metadata_columns')])
+        columns = {
+            userfile.pk: (userfile.status, userfile.has_report, userfile.row_count, userfile.block_count)
+            for userfile in apps.get_model('files', 'UserFile').objects.all()
+        }
+        self.assertEqual({name: columns[pk] for name, pk in pks.items()}, {
+            'processed': ('processed', True, 40, 2),
+            'running': ('processing', False, None, None),
+            'failed': ('failed', False, None, None),
+            'queued': ('pending', False, None, None),
+            'untouched': ('pending', False, None, None),
+        })
@@ -0,0 +1,188 @@
+import os
+import hashlib
+from datetime import timedelta
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+from .models import UserFile, UploadSession, UploadChunk
+from .utils import is_duplicate_upload, duplicate_upload_error
+
+# Bytes read from the request or the part file at a time
+STREAM_BLOCK_SIZE = 64 * 1024
+
+
+class PartFile(File):
+    """
+    An assembled part file handed to storage.
+
+    FileSystemStorage moves files that expose temporary_file_path() instead
+    of copying them, so completing an upload does not rewrite its bytes.
+    """
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def part_path(session):
+    return os.path.join(str(settings.FILES_UPLOAD_SESSION_DIR), f"{session.pk}.part")
+
+
+def create_upload_session(user, file_name, total_size, chunk_size=None):
+    """
+    Start a chunked upload and reserve its part file.
+
+    Args:
+        user (User): Owner of the upload
+        file_name (str): Original file name
+        total_size (int): Size of the whole file in bytes
+        chunk_size (int): Bytes per chunk, defaults to FILES_UPLOAD_CHUNK_SIZE
+
+    Returns:
+        tuple: (UploadSession, None) or (None, error message)
+    """
+    if total_size <= 0:
+        return None, "total_size must be positive"
+    if total_size > settings.FILES_UPLOAD_MAX_SIZE:
+        return None, f"File is larger than {settings.FILES_UPLOAD_MAX_SIZE} bytes"
+    chunk_size = chunk_size or settings.FILES_UPLOAD_CHUNK_SIZE
+    if not 0 < chunk_size <= settings.FILES_UPLOAD_MAX_CHUNK_SIZE:
+        return None, f"chunk_size must be between 1 and {settings.FILES_UPLOAD_MAX_CHUNK_SIZE} bytes"
+
+    session = UploadSession.objects.create(
+        user=user,
+        file_name=os.path.basename(file_name),
+        total_size=total_size,
+        chunk_size=chunk_size
+    )
+    os.makedirs(str(settings.FILES_UPLOAD_SESSION_DIR), exist_ok=True)
+    with open(part_path(session), 'wb') as f:
+        # Sparse file, so chunks can be written at their offset in any order
+        f.truncate(total_size)
+    return session, None
+
+
+def write_chunk(session, index, stream, content_length, expected_md5=None):
+    """
+    Write one chunk from a request stream at its offset in the part file.
+
+    The chunk is hashed while it is copied, so only STREAM_BLOCK_SIZE bytes
+    are held in memory. Sending a chunk again overwrites it, which is how a
+    client retries after a dropped connection.
+
+    Args:
+        session (UploadSession): Open upload session
+        index (int): Zero-based chunk number
+        stream: File-like request body
+        content_length (int): Declared body size
+        expected_md5 (str): Optional hex MD5 the chunk must match
+
+    Returns:
+        tuple: (UploadChunk, None) or (None, error message)
+    """
+    if session.status != UploadSession.STATUS_OPEN:
+        return None, "Upload session is already complete"
+    if not 0 <= index < session.chunk_count:
+        return None, f"Chunk index must be between 0 and {session.chunk_count - 1}"
+    expected_size = session.chunk_length(index)
+    if content_length != expected_size:
+        return None, f"Chunk {index} must be {expected_size} bytes, got {content_length}"
+
+    chunk_hash = hashlib.md5()
+    written = 0
+    with open(part_path(session), 'r+b') as f:
+        f.seek(index * session.chunk_size)
+        while written < expected_size:
+            data = stream.read(min(STREAM_BLOCK_SIZE, expected_size - written))
+            if not data:
+                break
+            f.write(data)
+            chunk_hash.update(data)
+            written += len(data)
+    if written != expected_size:
+        return None, f"Chunk {index} ended after {written} of {expected_size} bytes"
+    md5 = chunk_hash.hexdigest()
+    if expected_md5 and expected_md5.lower() != md5:
+        return None, f"Chunk {index} MD5 mismatch: expected {expected_md5}, got {md5}"
+
+    chunk, _ = UploadChunk.objects.update_or_create(
+        session=session, index=index,
+        defaults={'size': written, 'md5': md5}
+    )
+    UploadSession.objects.filter(pk=session.pk).update(updated_at=timezone.now())
+    return chunk, None
+
+
+def missing_chunks(session):
+    received = set(session.chunks.values_list('index', flat=True))
+    return [i for i in range(session.chunk_count) if i not in received]
+
+
+def hash_part_file(path):
+    """MD5 of an assembled part file, read in blocks."""
+    file_hash = hashlib.md5()
+    with open(path, 'rb') as f:
+        while data := f.read(1024 * 1024):
+            file_hash.update(data)
+    return file_hash.hexdigest()
+
+
+def complete_upload_session(session):
+    """
+    Turn a fully received upload into a UserFile.
+
+    The part file is hashed in one streaming pass, checked for duplicates
+    like a direct upload and moved into storage.
+
+    Returns:
+        tuple: (UserFile, None) or (None, error message)
+    """
+    if session.status != UploadSession.STATUS_OPEN:
+        return None, "Upload session is already complete"
+    missing = missing_chunks(session)
+    if missing:
+        return None, f"Missing chunks: {missing}"
+    # Claim the session so a repeated request cannot create a second file
+    claimed = UploadSession.objects.filter(
+        pk=session.pk, status=UploadSession.STATUS_OPEN
+    ).update(status=UploadSession.STATUS_COMPLETE)
+    if not claimed:
+        return None, "Upload session is already complete"
+
+    path = part_path(session)
+    file_hash = hash_part_file(path)
+    if is_duplicate_upload(file_hash):
+        abort_upload_session(session)
+        return None, duplicate_upload_error()
+
+    with transaction.atomic():
+        with open(path, 'rb') as f:
+            userfile = UserFile(user=session.user, content_hash=file_hash, file_size=session.total_size,
+                                source_name=session.file_name)
+            userfile.file.save(session.file_name, PartFile(f, name=session.file_name), save=False)
+            userfile.save()
+        UploadSession.objects.filter(pk=session.pk).update(userfile=userfile)
+        session.chunks.all().delete()
+    if os.path.exists(path):
+        # Storages that copy instead of moving leave the part behind
+        os.unlink(path)
+    return userfile, None
+
+
+def abort_upload_session(session):
+    """Delete a session, its chunk records and its part file."""
+    path = part_path(session)
+    session.delete()
+    if os.path.exists(path):
+        os.unlink(path)
+
+
+def purge_expired_upload_sessions(max_age_seconds):
+    """Abort open sessions that have not received a chunk for ``max_age_seconds``."""
+    cutoff = timezone.now() - timedelta(seconds=max_age_seconds)
+    expired = UploadSession.objects.filter(status=UploadSession.STATUS_OPEN, updated_at__lt=cutoff)
+    count = 0
+    for session in expired:
+        abort_upload_session(session)
+        count += 1
+    return count
@@ -1,10 +1,16 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import UserFileViewSet
+from .views import UserFileViewSet, UploadSessionViewSet, metrics
+from . import async_views
 
 router = DefaultRouter()
 router.register(r'files', UserFileViewSet, basename='files')
+router.register(r'uploads', UploadSessionViewSet, basename='uploads')
 
 urlpatterns = [
     path('api/', include(router.urls)),
+    # Async variants of the list, upload and summary endpoints, for ASGI servers
+    path('api/async/files/', async_views.files, name='async-files'),
+    path('api/async/files/summary/', async_views.summary, name='async-files-summary'),
+    path('metrics', metrics, name='metrics'),
 ]
\ No newline at end of file
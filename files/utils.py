@@ -1,17 +1,337 @@
 import os
-import json
+import time
+import hashlib
 from django.core.files import File
-from django.core.files.base import ContentFile
 from django.conf import settings
-from stats.utils import process_excel_file
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from stats.utils import process_excel_file, file_hash_processor, NCT_PARSER_VERSION
+from stats.revisions import process_revision, report_delta
+from stats.block_cache import BlockCache
+from stats.timing import StageTimer, stage
+from .metrics import record_report, record_report_failure
+from .rollups import apply_rollup_delta, rollup_date
 
-def process_userfile_and_save_report(userfile):
+# UserFileBlock fields process_revision() reads back from a previous version
+REVISION_BLOCK_FIELDS = ('sheet_name', 'index', 'fingerprint', 'partial', 'row_fingerprints')
+
+def get_block_cache():
+    """Return the parsed-block cache configured in settings, or None when it is disabled."""
+    if not settings.NCT_BLOCK_CACHE_DIR:
+        return None
+    return BlockCache(settings.NCT_BLOCK_CACHE_DIR, settings.NCT_BLOCK_CACHE_MAX_BYTES, NCT_PARSER_VERSION)
+
+class HashingFile(File):
+    """Wraps an upload and computes the MD5 of the chunks the storage reads from it."""
+
+    def __init__(self, file, name=None):
+        super().__init__(file, name or file.name)
+        self.md5 = hashlib.md5()
+
+    def chunks(self, chunk_size=None):
+        for chunk in self.file.chunks(chunk_size):
+            self.md5.update(chunk)
+            yield chunk
+
+    def hexdigest(self):
+        return self.md5.hexdigest()
+
+def store_upload(name, uploaded_file, seen=None):
+    """
+    Write an upload to the file storage unless it is a duplicate.
+
+    The MD5 is computed while the storage writes the file, so the upload is
+    read once. UserFile.content_hash is the only record of what was
+    uploaded: a file matching a recent upload (see is_duplicate_upload()),
+    or one in ``seen``, is deleted from the storage again.
+
+    Args:
+        name (str): Name of the upload
+        uploaded_file (File): The upload
+        seen (dict, optional): content hash -> name of the files stored
+            earlier in the same request; the new file is added to it
+
+    Returns:
+        tuple: (UserFile field values for the stored file, None) or (None, error message)
+    """
+    from .models import UserFile
+    field = UserFile._meta.get_field('file')
+    hashing_file = HashingFile(uploaded_file, name)
+    stored_name = field.storage.save(field.generate_filename(None, name), hashing_file,
+                                     max_length=field.max_length)
+    file_hash = hashing_file.hexdigest()
+    if seen is not None and file_hash in seen:
+        field.storage.delete(stored_name)
+        return None, f"Same content as {seen[file_hash]} in this upload"
+    if is_duplicate_upload(file_hash):
+        field.storage.delete(stored_name)
+        return None, duplicate_upload_error()
+    if seen is not None:
+        seen[file_hash] = name
+    return {
+        'file': stored_name,
+        'content_hash': file_hash,
+        'file_size': uploaded_file.size,
+        'source_name': os.path.basename(name),
+    }, None
+
+def duplicate_upload_error():
+    return f"File has already been processed recently (within {file_hash_processor.time_window.total_seconds() / 3600} hours)."
+
+def is_duplicate_upload(file_hash):
+    """
+    Check if the same content was uploaded within the file hash time window.
+
+    Uploads whose processing failed do not count, so a file can be retried.
+    """
+    from .models import UserFile, ProcessingJob
+    cutoff = timezone.now() - file_hash_processor.time_window
+    return UserFile.objects.filter(
+        content_hash=file_hash,
+        uploaded_at__gte=cutoff
+    ).filter(
+        Q(has_report=True) | Q(jobs__status__in=[
+            ProcessingJob.STATUS_QUEUED, ProcessingJob.STATUS_RUNNING, ProcessingJob.STATUS_DONE
+        ])
+    ).exists()
+
+def iter_report_aggregates(report):
+    """Yield (kind, name, count) for every count in a report."""
+    from .models import ReportAggregate
+    for category, count in report.get('quota_counts', {}).items():
+        if category == 'Примечание' and isinstance(count, dict):
+            for sub_category, sub_count in count.items():
+                yield ReportAggregate.KIND_PRIM, sub_category, sub_count
+        else:
+            yield ReportAggregate.KIND_QUOTA, category, count
+    for specialization, count in report.get('specialization_counts', {}).items():
+        yield ReportAggregate.KIND_SPECIALIZATION, specialization, count
+    for choice, universities in report.get('specialization_matrix', {}).items():
+        kind = ReportAggregate.KIND_UNIVERSITY_CHOICES[int(choice)]
+        for university, counts in universities.items():
+            for specialization, count in counts.items():
+                yield kind, ReportAggregate.university_name(university, specialization), count
+
+def replace_report_aggregates(userfile, report):
+    """
+    Replace a file's ReportAggregate rows and processing duration with the counts of its report.
+
+    The difference to what was stored before is applied to the file's daily
+    rollups in the same transaction, so re-processing a file never counts it twice.
+
+    Args:
+        userfile (UserFile): File the report belongs to
+        report (dict): Report as returned by process_excel_file, or None to remove the file's counts
+    """
+    from .models import UserFile, ReportAggregate
+    from .summary import invalidate_summary
+    with transaction.atomic():
+        # Lock the file so two saves of the same report compute their deltas in turn
+        previous = UserFile.objects.select_for_update().only('processing_duration_seconds').get(pk=userfile.pk)
+        old_counts = {
+            (kind, name): count
+            for kind, name, count in userfile.aggregates.values_list('kind', 'name', 'count')
+        }
+        old_duration = previous.processing_duration_seconds
+        was_counted = bool(old_counts) or old_duration is not None
+
+        new_counts = {}
+        new_duration = None
+        if report is not None:
+            for kind, name, count in iter_report_aggregates(report):
+                new_counts[(kind, name)] = new_counts.get((kind, name), 0) + count
+            new_duration = report.get('metadata', {}).get('processing_duration_seconds')
+
+        userfile.aggregates.all().delete()
+        ReportAggregate.objects.bulk_create([
+            ReportAggregate(userfile=userfile, kind=kind, name=name, count=count)
+            for (kind, name), count in new_counts.items()
+        ])
+        userfile.processing_duration_seconds = new_duration
+        userfile.save(update_fields=['processing_duration_seconds'])
+
+        user_id = userfile.user_id
+        transaction.on_commit(lambda: invalidate_summary(user_id))
+        apply_rollup_delta(
+            userfile.user_id,
+            rollup_date(userfile.uploaded_at),
+            files=(report is not None) - was_counted,
+            processing_seconds=(new_duration or 0) - (old_duration or 0),
+            files_with_processing_data=(new_duration is not None) - (old_duration is not None),
+            counts={
+                key: new_counts.get(key, 0) - old_counts.get(key, 0)
+                for key in {**new_counts, **old_counts}
+            }
+        )
+
+def save_report_aggregates(userfile, report):
+    """Store a report's counts for summaries, see replace_report_aggregates()."""
+    replace_report_aggregates(userfile, report)
+
+def remove_report_aggregates(userfile):
+    """Take a file's counts out of the summaries, e.g. before it is deleted."""
+    replace_report_aggregates(userfile, None)
+
+def process_userfile_and_save_report(userfile, file_hash=None):
+    """
+    Build and save the report of an uploaded file.
+
+    With FILES_INCREMENTAL_REVISIONS every file is processed block by block
+    and its blocks are stored for a later revision to reuse. A file that
+    revises the previous upload of the same name (see find_previous_version()
+    and stats.revisions.revises()) reuses the partials of its unchanged
+    blocks, its report gets a "revision" delta against that upload, and the
+    previous version stops counting in summaries.
+
+    Returns:
+        tuple: (report, None) or (None, error)
+    """
+    from .models import UserFile
     file_path = userfile.file.path
-    report, error = process_excel_file(file_path)
+    file_hash = file_hash or userfile.content_hash or None
+    incremental = settings.FILES_INCREMENTAL_REVISIONS
+    try:
+        if incremental:
+            previous = find_previous_version(userfile)
+            previous_blocks = list(previous.blocks.order_by('pk').values(*REVISION_BLOCK_FIELDS)) if previous else []
+            report, blocks, revised, error = process_revision(
+                file_path,
+                previous_blocks=previous_blocks,
+                file_hash=file_hash,
+                sheet_names=settings.NCT_SHEETS,
+                engine=settings.NCT_REPORT_ENGINE,
+                max_workers=settings.NCT_PARSE_WORKERS,
+                block_cache=get_block_cache(),
+                min_overlap=settings.FILES_REVISION_MIN_OVERLAP
+            )
+        else:
+            report, error = process_excel_file(
+                file_path,
+                file_hash=file_hash,
+                sheet_names=settings.NCT_SHEETS,
+                max_workers=settings.NCT_PARSE_WORKERS,
+                engine=settings.NCT_REPORT_ENGINE,
+                block_cache=get_block_cache()
+            )
+    except Exception:
+        record_report_failure()
+        set_userfile_status(userfile, UserFile.STATUS_FAILED)
+        raise
     if error:
+        record_report_failure()
+        set_userfile_status(userfile, UserFile.STATUS_FAILED)
         return None, error
-    # Save report as in-memory file
-    report_filename = os.path.splitext(os.path.basename(userfile.file.name))[0] + '.report.json'
-    report_content = json.dumps(report, ensure_ascii=False, indent=2)
-    userfile.report.save(report_filename, ContentFile(report_content.encode('utf-8')), save=True)
+    if incremental:
+        save_revision(userfile, report, blocks, previous if revised else None, previous_blocks)
+    else:
+        save_report(userfile, report)
     return report, None
+
+def find_previous_version(userfile):
+    """
+    Return the earlier upload a file may be a revision of, or None.
+
+    That is the latest processed upload of the same name by the same user.
+    Whether the file really revises it is decided while the file is
+    processed, see stats.revisions.revises(); an upload processed before
+    FILES_INCREMENTAL_REVISIONS was turned on has no stored blocks to
+    compare with and is never revised.
+    """
+    from .models import UserFile
+    if not userfile.source_name:
+        return None
+    return UserFile.objects.filter(
+        user_id=userfile.user_id,
+        source_name=userfile.source_name,
+        has_report=True,
+        status=UserFile.STATUS_PROCESSED,
+        pk__lt=userfile.pk
+    ).order_by('-pk').first()
+
+def save_revision(userfile, report, blocks, previous=None, previous_blocks=()):
+    """
+    Save a report built by process_revision(), with its blocks for the next revision.
+
+    With a ``previous`` version the report gets a "revision" delta against it,
+    and the previous version is marked superseded and taken out of the
+    summaries, so the workbook is counted once.
+    """
+    from .models import UserFile, UserFileBlock
+    if previous is not None:
+        report['revision'] = {
+            'previous_file_id': previous.pk,
+            **report_delta(previous.report, report, blocks, previous_blocks)
+        }
+    save_report(userfile, report)
+
+    with transaction.atomic():
+        userfile.blocks.all().delete()
+        UserFileBlock.objects.bulk_create([
+            UserFileBlock(userfile=userfile, **{field: block[field] for field in REVISION_BLOCK_FIELDS},
+                          nct_row=block['nct_row'], row_count=block['row_count'])
+            for block in blocks
+        ])
+        if previous is not None:
+            userfile.previous_version = previous
+            userfile.save(update_fields=['previous_version'])
+            remove_report_aggregates(previous)
+            set_userfile_status(previous, UserFile.STATUS_SUPERSEDED)
+
+def restore_previous_version(userfile):
+    """
+    Take a file out of its revision chain, e.g. before it is deleted.
+
+    A superseded file's revision is linked to the version before it instead,
+    so only one version of the workbook counts. Otherwise the version the
+    file superseded is counted in the summaries again.
+    """
+    from .models import UserFile
+    if userfile.status == UserFile.STATUS_SUPERSEDED:
+        UserFile.objects.filter(previous_version=userfile).update(previous_version=userfile.previous_version_id)
+        return
+    previous = userfile.previous_version
+    if previous is None or previous.status != UserFile.STATUS_SUPERSEDED:
+        return
+    with transaction.atomic():
+        save_report_aggregates(previous, previous.report)
+        set_userfile_status(previous, UserFile.STATUS_PROCESSED)
+
+def report_columns(report):
+    """UserFile column values describing a saved report."""
+    from .models import UserFile
+    metadata = report.get('metadata', {})
+    return {
+        'status': UserFile.STATUS_PROCESSED,
+        'has_report': True,
+        'row_count': metadata.get('total_rows_processed'),
+        'block_count': metadata.get('blocks_processed'),
+    }
+
+def set_userfile_status(userfile, status):
+    """Record a processing status change without touching the file's other columns."""
+    from .models import UserFile
+    userfile.status = status
+    UserFile.objects.filter(pk=userfile.pk).update(status=status)
+
+def save_report(userfile, report):
+    """
+    Store a built report on the file and in the summary aggregates.
+
+    The aggregates are written first so their time can go into the report's
+    stage_timings; the write of the report itself, serialization included,
+    is only counted in the metrics.
+    """
+    timer = StageTimer()
+    with timer.activate():
+        with stage('storage_write'):
+            save_report_aggregates(userfile, report)
+    report.setdefault('metadata', {}).setdefault('stage_timings', {}).update(timer.as_dict())
+
+    started = time.perf_counter()
+    userfile.report = report
+    columns = report_columns(report)
+    for name, value in columns.items():
+        setattr(userfile, name, value)
+    userfile.save(update_fields=['report', *columns])
+    record_report(report, storage_seconds=timer.totals['storage_write'] + time.perf_counter() - started)
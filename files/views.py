@@ -1,28 +1,48 @@
 import os
 import json
+import time
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.decorators import action
 from django.conf import settings
-from stats.utils import process_excel_file, file_hash_processor
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from django.shortcuts import get_object_or_404
 from .models import UserFile
-from .utils import process_userfile_and_save_report
-from rest_framework import viewsets, permissions
-from .serializers import UserFileSerializer
+from .utils import (
+    process_userfile_and_save_report, store_upload,
+    remove_report_aggregates, restore_previous_version
+)
+from .jobs import start_processing
+from .summary import (
+    build_summary_data, parse_summary_params, summary_version, summary_validators, summary_cache_key,
+    invalidate_summary
+)
+from .rollups import rollup_date
+from rest_framework import viewsets, permissions, mixins
+from .serializers import UserFileSerializer, UserFileListSerializer, ProcessingJobSerializer, UploadSessionSerializer
+from .bulk import expand_bulk_upload, process_bulk_upload
+from .uploads import create_upload_session, write_chunk, complete_upload_session, abort_upload_session
+from .models import UploadSession
+from .pagination import UserFileCursorPagination
+from .metrics import observe, record_upload, render_metrics
 from drf_spectacular.utils import extend_schema, OpenApiParameter, OpenApiExample
 from drf_spectacular.types import OpenApiTypes
-from datetime import datetime, timedelta
 
 class UserFileViewSet(viewsets.ModelViewSet):
     serializer_class = UserFileSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = UserFileCursorPagination
 
     @extend_schema(
         operation_id='create_user_file',
         summary='Create a new file upload',
-        description='Upload a new file for processing',
+        description='Upload a new file for processing. When background processing is enabled '
+                    'the report is built by a worker and the response is 202 with the queued job.',
         request={
             'multipart/form-data': {
                 'type': 'object',
@@ -38,6 +58,7 @@ class UserFileViewSet(viewsets.ModelViewSet):
         },
         responses={
             201: UserFileSerializer,
+            202: UserFileSerializer,
             400: {
                 'type': 'object',
                 'properties': {
@@ -48,7 +69,12 @@ class UserFileViewSet(viewsets.ModelViewSet):
     )
     def create(self, request, *args, **kwargs):
         try:
-            return super().create(request, *args, **kwargs)
+            response = super().create(request, *args, **kwargs)
+            job = getattr(self, 'job', None)
+            if job is not None:
+                response.data['job'] = ProcessingJobSerializer(job).data
+                response.status_code = status.HTTP_202_ACCEPTED
+            return response
         except Exception as e:
             # Handle duplicate file error
             if "File has already been processed recently" in str(e):
@@ -59,16 +85,151 @@ class UserFileViewSet(viewsets.ModelViewSet):
             # Re-raise other exceptions
             raise
 
+    @extend_schema(
+        operation_id='bulk_upload_user_files',
+        summary='Upload and process several files at once',
+        description='Accepts several Excel files, or a single .zip of them. Files are deduplicated against '
+                    'each other and against recent uploads, then processed like single uploads: queued for '
+                    'background workers (202, with a job per file) or processed in upload order. Returns a '
+                    'result per file and a report merged over the files processed in the request.',
+        request={
+            'multipart/form-data': {
+                'type': 'object',
+                'properties': {
+                    'files': {
+                        'type': 'array',
+                        'items': {'type': 'string', 'format': 'binary'},
+                        'description': 'Excel files, or one .zip archive'
+                    }
+                },
+                'required': ['files']
+            }
+        },
+        responses={
+            200: {
+                'type': 'object',
+                'properties': {
+                    'results': {'type': 'array'},
+                    'merged_report': {'type': 'object'}
+                }
+            },
+            202: {
+                'type': 'object',
+                'properties': {
+                    'results': {'type': 'array'},
+                    'merged_report': {'type': 'object'}
+                }
+            },
+            400: {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string'}
+                }
+            }
+        }
+    )
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """Save and process a batch of files in one request."""
+        uploaded_files = request.FILES.getlist('files')
+        if not uploaded_files:
+            return Response({'error': 'No files uploaded'}, status=status.HTTP_400_BAD_REQUEST)
+        items, error = expand_bulk_upload(uploaded_files)
+        if error:
+            return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            if not items:
+                return Response({'error': 'The archive contains no files'}, status=status.HTTP_400_BAD_REQUEST)
+            if len(items) > settings.FILES_BULK_MAX_FILES:
+                return Response(
+                    {'error': f'At most {settings.FILES_BULK_MAX_FILES} files can be uploaded at once'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            results, merged_report = process_bulk_upload(request.user, items)
+        finally:
+            # Members of a .zip are temporary files
+            for _, item in items:
+                item.close()
+
+        context = self.get_serializer_context()
+        for result in results:
+            if result['file'] is not None:
+                result['file'] = UserFileSerializer(result['file'], context=context).data
+            if result['job'] is not None:
+                result['job'] = ProcessingJobSerializer(result['job']).data
+        queued = any(result['job'] is not None for result in results)
+        return Response({'results': results, 'merged_report': merged_report},
+                        status=status.HTTP_202_ACCEPTED if queued else status.HTTP_200_OK)
+
+    @extend_schema(
+        operation_id='get_user_file_report',
+        summary='Get the report of a file',
+        description='Returns the report built for the file, read from the file row itself',
+        responses={
+            200: {'type': 'object'},
+            404: {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string'}
+                }
+            }
+        }
+    )
+    @action(detail=True, methods=['get'])
+    def report(self, request, pk=None):
+        """Get the report built for a file."""
+        user_file = self.get_object()
+        if user_file.report is None:
+            return Response(
+                {'error': 'The report for this file is not ready'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return Response(user_file.report)
+
+    @extend_schema(
+        operation_id='get_user_file_status',
+        summary='Get processing status of a file',
+        description='Returns the latest processing job of the file: queued, running, done or failed, with timings',
+        responses={
+            200: ProcessingJobSerializer,
+            404: {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string'}
+                }
+            }
+        }
+    )
+    @action(detail=True, methods=['get'], url_path='status')
+    def processing_status(self, request, pk=None):
+        """Get the status of the latest processing job for a file."""
+        user_file = self.get_object()
+        job = user_file.jobs.order_by('-id').first()
+        if job is None:
+            return Response(
+                {'error': 'No processing job for this file'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return Response(ProcessingJobSerializer(job).data)
+
     def get_queryset(self):
         user = self.request.user
-        if user.is_staff:
-            return UserFile.objects.all()
-        return UserFile.objects.filter(user=user)
+        queryset = UserFile.objects.all() if user.is_staff else UserFile.objects.filter(user=user)
+        if self.action == 'list':
+            # List rows leave the report out, so it is not loaded either
+            queryset = queryset.defer('report')
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return UserFileListSerializer
+        return UserFileSerializer
 
     @extend_schema(
         operation_id='get_reports_summary',
         summary='Get summary of all reports',
-        description='Aggregates data from all processed reports and returns summary statistics',
+        description='Aggregates data from all processed reports and returns summary statistics. '
+                    'Responses carry an ETag and Last-Modified; a matching conditional request gets a 304.',
         parameters=[
             OpenApiParameter(
                 name='days',
@@ -83,9 +244,26 @@ class UserFileViewSet(viewsets.ModelViewSet):
                 location=OpenApiParameter.QUERY,
                 description='Include only current user files (default: true for non-staff)',
                 required=False
+            ),
+            OpenApiParameter(
+                name='university',
+                type=OpenApiTypes.STR,
+                location=OpenApiParameter.QUERY,
+                description='University code whose specializations are counted, from the stored '
+                            'specialization matrix (default: NCT_UNIVERSITY_CODE first choices)',
+                required=False
+            ),
+            OpenApiParameter(
+                name='choice',
+                type=OpenApiTypes.INT,
+                location=OpenApiParameter.QUERY,
+                description='Which choice of `university` to count, 1 to 4 (default: 1); '
+                            'only choices up to NCT_SPECIALIZATION_CHOICES are stored',
+                required=False
             )
         ],
         responses={
+            304: None,
             200: {
                 'type': 'object',
                 'properties': {
@@ -106,7 +284,9 @@ class UserFileViewSet(viewsets.ModelViewSet):
                         'properties': {
                             'generated_at': {'type': 'string'},
                             'time_range_days': {'type': 'integer'},
-                            'files_included': {'type': 'integer'}
+                            'files_included': {'type': 'integer'},
+                            'university': {'type': 'string'},
+                            'choice': {'type': 'integer'}
                         }
                     }
                 }
@@ -116,141 +296,44 @@ class UserFileViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def summary(self, request):
         """Get aggregated summary of all reports."""
+        started = time.perf_counter()
         try:
             # Get query parameters
-            days = int(request.query_params.get('days', 30))
-            user_only = request.query_params.get('user_only', 'true').lower() == 'true'
-            
-            # Calculate date range
-            end_date = datetime.now()
-            start_date = end_date - timedelta(days=days)
+            params, error = parse_summary_params(request.query_params)
+            if error:
+                return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+            days, user_only, university, choice = params
             
             # Get files in date range
             queryset = self.get_queryset()
             if user_only and not request.user.is_staff:
                 queryset = queryset.filter(user=request.user)
             
-            files_in_range = queryset.filter(
-                uploaded_at__gte=start_date,
-                uploaded_at__lte=end_date,
-                report__isnull=False
-            ).order_by('uploaded_at')
-            
-            print(f"Found {files_in_range.count()} files with reports")
+            summary_user = None if request.user.is_staff else request.user
             
-            # Initialize summary data
-            total_quota_counts = {}
-            total_specialization_counts = {}
-            processing_times = []
-            upload_timeline = []
-            daily_uploads = {}
+            # Unchanged dashboards get a 304 without computing anything
+            version = summary_version(summary_user)
+            params = (days, user_only, university, choice, rollup_date(timezone.now()))
+            etag, last_modified = summary_validators(queryset, summary_user, version, *params)
+            not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if not_modified is not None:
+                observe('files_summary_duration_seconds', time.perf_counter() - started, result='not_modified')
+                return not_modified
             
-            # Process each file's report
-            for user_file in files_in_range:
-                print(f"Processing file {user_file.id}: {user_file.file.name}")
-                print(f"Report path: {user_file.report.name if user_file.report else 'None'}")
-                
-                try:
-                    # Read report file
-                    if user_file.report and user_file.report.storage.exists(user_file.report.name):
-                        print(f"Report file exists, reading...")
-                        with user_file.report.open('rb') as f:
-                            report_content = f.read().decode('utf-8')
-                            print(f"Report content length: {len(report_content)}")
-                            report_data = json.loads(report_content)
-                        
-                        print(f"Report data keys: {list(report_data.keys())}")
-                        
-                        # Aggregate quota counts
-                        if 'quota_counts' in report_data:
-                            print(f"Found quota_counts: {report_data['quota_counts']}")
-                            for category, count in report_data['quota_counts'].items():
-                                if category == 'Примечание' and isinstance(count, dict):
-                                    # Handle nested Примечание data
-                                    if category not in total_quota_counts:
-                                        total_quota_counts[category] = {}
-                                    for sub_category, sub_count in count.items():
-                                        total_quota_counts[category][sub_category] = \
-                                            total_quota_counts[category].get(sub_category, 0) + sub_count
-                                else:
-                                    total_quota_counts[category] = total_quota_counts.get(category, 0) + count
-                        
-                        # Aggregate specialization counts
-                        if 'specialization_counts' in report_data:
-                            print(f"Found specialization_counts: {report_data['specialization_counts']}")
-                            for specialization, count in report_data['specialization_counts'].items():
-                                total_specialization_counts[specialization] = \
-                                    total_specialization_counts.get(specialization, 0) + count
-                        
-                        # Collect processing statistics
-                        if 'metadata' in report_data:
-                            metadata = report_data['metadata']
-                            if 'processing_duration_seconds' in metadata:
-                                processing_times.append(metadata['processing_duration_seconds'])
-                        
-                        # Track upload timeline
-                        upload_timeline.append({
-                            'file_id': user_file.id,
-                            'file_name': user_file.file.name.split('/')[-1],
-                            'uploaded_at': user_file.uploaded_at.isoformat(),
-                            'quota_count': sum(v for v in report_data.get('quota_counts', {}).values() 
-                                             if isinstance(v, (int, float))),
-                            'specialization_count': sum(report_data.get('specialization_counts', {}).values())
-                        })
-                        
-                        # Track daily uploads
-                        date_key = user_file.uploaded_at.date().isoformat()
-                        daily_uploads[date_key] = daily_uploads.get(date_key, 0) + 1
-                        
-                    else:
-                        print(f"Report file does not exist or is None")
-                        
-                except Exception as e:
-                    print(f"Error processing report for file {user_file.id}: {e}")
-                    import traceback
-                    traceback.print_exc()
-                    continue
+            cache_key = summary_cache_key(summary_user, version, *params)
+            summary_data = cache.get(cache_key)
+            result = 'cached'
+            if summary_data is None:
+                result = 'computed'
+                summary_data = build_summary_data(queryset, days, user=summary_user,
+                                                  university=university, choice=choice)
+                cache.set(cache_key, summary_data, settings.FILES_SUMMARY_CACHE_SECONDS)
             
-            # Calculate summary statistics
-            total_files = len(files_in_range)
-            avg_processing_time = sum(processing_times) / len(processing_times) if processing_times else 0
-            
-            # Get most active days
-            most_active_days = sorted(
-                daily_uploads.items(), 
-                key=lambda x: x[1], 
-                reverse=True
-            )[:10]
-            
-            # Prepare response
-            summary_data = {
-                'summary': {
-                    'total_files': total_files,
-                    'total_quota_counts': total_quota_counts,
-                    'total_specialization_counts': total_specialization_counts,
-                    'processing_stats': {
-                        'average_processing_time_seconds': round(avg_processing_time, 3),
-                        'total_processing_time_seconds': round(sum(processing_times), 3),
-                        'files_with_processing_data': len(processing_times)
-                    },
-                    'file_upload_timeline': upload_timeline,
-                    'most_active_days': [
-                        {'date': date, 'uploads': count} 
-                        for date, count in most_active_days
-                    ]
-                },
-                'metadata': {
-                    'generated_at': datetime.now().isoformat(),
-                    'time_range_days': days,
-                    'files_included': total_files,
-                    'date_range': {
-                        'start': start_date.isoformat(),
-                        'end': end_date.isoformat()
-                    }
-                }
-            }
-            
-            return Response(summary_data, status=status.HTTP_200_OK)
+            response = Response(summary_data, status=status.HTTP_200_OK)
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+            observe('files_summary_duration_seconds', time.perf_counter() - started, result=result)
+            return response
             
         except Exception as e:
             return Response(
@@ -262,35 +345,116 @@ class UserFileViewSet(viewsets.ModelViewSet):
         # Get the uploaded file
         uploaded_file = serializer.validated_data['file']
         
-        # Create a temporary file path to check for duplicates
-        import tempfile
-        import os
+        # Hashed while it is written; a duplicate is not kept
+        stored, error = store_upload(uploaded_file.name, uploaded_file)
+        if error:
+            raise Exception(error)
         
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as temp_file:
-            # Write uploaded file content to temporary file
-            for chunk in uploaded_file.chunks():
-                temp_file.write(chunk)
-            temp_file_path = temp_file.name
+        # File is not a duplicate - save it and process
+        user_file_instance = serializer.save(user=self.request.user, **stored)
+        invalidate_summary(self.request.user.pk)
+        record_upload('single', user_file_instance.file_size)
         
+        # Queued for a `process_files` worker, or processed now
+        self.job = start_processing(user_file_instance)
+
+    def perform_destroy(self, instance):
+        # Take the file out of the daily rollups before its aggregates are deleted with it
+        remove_report_aggregates(instance)
+        # A deleted revision hands the count back to the version it replaced
+        restore_previous_version(instance)
+        instance.delete()
+
+class UploadSessionViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.DestroyModelMixin,
+                           viewsets.GenericViewSet):
+    """
+    Chunked, resumable uploads for large workbooks.
+
+    Create a session, PUT each chunk as the raw request body to
+    ``chunks/<index>/`` (in any order, retrying only the ones that failed),
+    then POST ``complete/`` to turn the upload into a file and start its report.
+    """
+    serializer_class = UploadSessionSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(user=self.request.user)
+
+    @extend_schema(
+        operation_id='create_upload_session',
+        summary='Start a chunked upload',
+        description='Returns the session id, the chunk size and the number of chunks to send',
+        responses={201: UploadSessionSerializer, 400: {'type': 'object', 'properties': {'error': {'type': 'string'}}}}
+    )
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        session, error = create_upload_session(
+            request.user,
+            serializer.validated_data['file_name'],
+            serializer.validated_data['total_size'],
+            serializer.validated_data.get('chunk_size')
+        )
+        if error:
+            return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.get_serializer(session).data, status=status.HTTP_201_CREATED)
+
+    @extend_schema(
+        operation_id='upload_session_chunk',
+        summary='Upload one chunk',
+        description='The request body is the raw chunk. Every chunk but the last must be exactly chunk_size bytes. '
+                    'An optional X-Chunk-MD5 header is checked against the received bytes.',
+        request={'application/octet-stream': {'type': 'string', 'format': 'binary'}},
+        responses={200: {'type': 'object', 'properties': {
+            'index': {'type': 'integer'}, 'size': {'type': 'integer'}, 'md5': {'type': 'string'}
+        }}, 400: {'type': 'object', 'properties': {'error': {'type': 'string'}}}}
+    )
+    @action(detail=True, methods=['put'], url_path=r'chunks/(?P<index>\d+)')
+    def chunk(self, request, pk=None, index=None):
+        session = self.get_object()
         try:
-            # Check if file is a duplicate before saving
-            file_hash = file_hash_processor.create_file_hash(temp_file_path)
-            if file_hash_processor.is_file_recent(file_hash):
-                # File is a duplicate - don't save it
-                error_msg = f"File has already been processed recently (within {file_hash_processor.time_window.total_seconds() / 3600} hours)."
-                raise Exception(error_msg)
-            
-            # File is not a duplicate - save it and process
-            user_file_instance = serializer.save(user=self.request.user)
-            
-            # Now process the file to generate a report
-            try:
-                process_userfile_and_save_report(user_file_instance)
-            except Exception as e:
-                # Handle cases where report generation fails but file upload should succeed
-                print(f"Could not generate report for file {user_file_instance.id}: {e}")
-                
-        finally:
-            # Clean up temporary file
-            if os.path.exists(temp_file_path):
-                os.unlink(temp_file_path)
+            content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            content_length = 0
+        # Read the body as a stream; request.data would buffer it through the parsers
+        chunk, error = write_chunk(
+            session, int(index), request.stream, content_length,
+            expected_md5=request.META.get('HTTP_X_CHUNK_MD5')
+        )
+        if error:
+            return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'index': chunk.index, 'size': chunk.size, 'md5': chunk.md5})
+
+    @extend_schema(
+        operation_id='complete_upload_session',
+        summary='Finish a chunked upload',
+        description='Assembles the file, checks it for duplicates and starts report generation. '
+                    'The response is 202 with the queued job when background processing is enabled.',
+        request=None,
+        responses={201: UserFileSerializer, 202: UserFileSerializer,
+                   400: {'type': 'object', 'properties': {'error': {'type': 'string'}}}}
+    )
+    @action(detail=True, methods=['post'])
+    def complete(self, request, pk=None):
+        session = self.get_object()
+        user_file, error = complete_upload_session(session)
+        if error:
+            return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+        invalidate_summary(request.user.pk)
+        record_upload('chunked', user_file.file_size)
+        job = start_processing(user_file)
+        data = UserFileSerializer(user_file, context=self.get_serializer_context()).data
+        if job is None:
+            return Response(data, status=status.HTTP_201_CREATED)
+        data['job'] = ProcessingJobSerializer(job).data
+        return Response(data, status=status.HTTP_202_ACCEPTED)
+
+    def perform_destroy(self, instance):
+        abort_upload_session(instance)
+
+
+def metrics(request):
+    """Processing and upload metrics in the Prometheus text format, for scrapers on METRICS_ALLOWED_IPS."""
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
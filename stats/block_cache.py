@@ -0,0 +1,227 @@
+import os
+import gzip
+import json
+import uuid
+import hashlib
+import datetime
+import itertools
+
+# Data rows stored per columnar record
+CHUNK_ROWS = 10000
+
+BLOCK_FIELDS = ("sheet_name", "nct_row", "categories", "header_row")
+
+# Cell values JSON has no type for, stored as a one-key object: {"datetime": "2024-01-01T00:00:00"}
+_DECODERS = {
+    "datetime": datetime.datetime.fromisoformat,
+    "date": datetime.date.fromisoformat,
+    "time": datetime.time.fromisoformat,
+    "timedelta": lambda parts: datetime.timedelta(*parts),
+}
+
+def _encode(value):
+    if isinstance(value, datetime.datetime):
+        return {"datetime": value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {"date": value.isoformat()}
+    if isinstance(value, datetime.time):
+        return {"time": value.isoformat()}
+    if isinstance(value, datetime.timedelta):
+        return {"timedelta": [value.days, value.seconds, value.microseconds]}
+    raise TypeError(f"{type(value).__name__} values cannot be stored in the block cache")
+
+def _decode(obj):
+    if len(obj) == 1:
+        key, value = next(iter(obj.items()))
+        if key in _DECODERS:
+            return _DECODERS[key](value)
+    return obj
+
+def _dump(f, record):
+    f.write(json.dumps(record, ensure_ascii=False, allow_nan=True, default=_encode))
+    f.write("\n")
+
+def _load(f):
+    line = f.readline()
+    if not line:
+        raise EOFError
+    return json.loads(line, object_hook=_decode)
+
+def _write_rows(f, rows, chunk_rows):
+    """Yield rows unchanged while writing them to ``f`` as column chunks."""
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_rows))
+        if not chunk:
+            break
+        lengths = [len(row) for row in chunk]
+        # Rows keep their own length so row hashes match the uncached parse
+        if min(lengths) == max(lengths):
+            lengths = None
+        columns = list(itertools.zip_longest(*chunk))
+        _dump(f, ("rows", lengths, columns))
+        yield from chunk
+    _dump(f, ("end", None))
+
+def write_blocks(path, blocks, chunk_rows=CHUNK_ROWS):
+    """
+    Yield NCT blocks unchanged while recording them to a cache file.
+
+    Blocks are written as gzipped JSON lines, one record per line: the
+    block header, then its data rows in column chunks. JSON keeps a cache
+    file from running code when it is read, unlike pickle; dates and times
+    are stored as tagged objects so every cell reads back with its type and
+    value. The file appears
+    at ``path`` only once every block has been read to the end, so a failed
+    or abandoned parse never leaves a truncated entry behind.
+    """
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=1) as f:
+            for block in blocks:
+                _dump(f, ("block", {key: block[key] for key in BLOCK_FIELDS}))
+                data = _write_rows(f, block["data"], chunk_rows)
+                yield dict(block, data=data)
+                for _ in data:
+                    pass
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+def _read_rows(f):
+    while True:
+        record = _load(f)
+        if record[0] == "end":
+            return
+        _, lengths, columns = record
+        rows = zip(*columns) if columns else iter(())
+        if lengths is None:
+            for row in rows:
+                yield list(row)
+        else:
+            for row, length in zip(rows, lengths):
+                yield list(row[:length])
+
+def read_blocks(path):
+    """Yield NCT blocks from a cache file, reading data rows lazily like iter_nct_blocks."""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        while True:
+            try:
+                kind, header = _load(f)
+            except EOFError:
+                return
+            data = _read_rows(f)
+            yield dict(header, data=data)
+            for _ in data:
+                pass
+
+class BlockCache:
+    """
+    Content-addressed cache of parsed NCT blocks on disk.
+
+    Entries are keyed by the file's content hash, the parser version and the
+    sheet selection, so a changed workbook or parser never hits a stale
+    entry. The directory is capped at ``max_bytes``; the least recently used
+    entries are evicted first.
+    """
+
+    SUFFIX = '.blocks.jsonl.gz'
+
+    def __init__(self, directory, max_bytes, parser_version):
+        """
+        Args:
+            directory (str): Directory holding the cache files
+            max_bytes (int): Size cap for the whole directory
+            parser_version (int): Version of the block parser the entries come from
+        """
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+        self.parser_version = parser_version
+        os.makedirs(self.directory, exist_ok=True)
+
+    def entry_path(self, file_hash, sheet_names=None):
+        selection = json.dumps(sheet_names, ensure_ascii=False)
+        selection_hash = hashlib.md5(selection.encode('utf-8')).hexdigest()[:12]
+        name = f"{file_hash}-v{self.parser_version}-{selection_hash}{self.SUFFIX}"
+        return os.path.join(self.directory, name)
+
+    def entry(self, file_hash, sheet_names=None):
+        return BlockCacheEntry(self, self.entry_path(file_hash, sheet_names))
+
+    def get(self, file_hash, sheet_names=None):
+        """Return a lazy block iterator for a cached file, or None on a miss."""
+        return self.entry(file_hash, sheet_names).get()
+
+    def discard(self, paths):
+        for path in paths:
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def evict(self):
+        """Remove least recently used entries until the directory fits in max_bytes."""
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(self.SUFFIX):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(self.SUFFIX):
+                os.unlink(entry.path)
+
+class BlockCacheEntry:
+    """One cache entry: a file hash, parser version and sheet selection."""
+
+    def __init__(self, cache, path):
+        self.cache = cache
+        self.path = path
+
+    def get(self):
+        """Return a lazy block iterator for the entry, or None on a miss."""
+        try:
+            # Touch the entry so eviction sees it as recently used
+            os.utime(self.path)
+        except FileNotFoundError:
+            return None
+        return read_blocks(self.path)
+
+    def record(self, blocks):
+        """Wrap a block iterator so that reading it to the end stores it in the cache."""
+        yield from write_blocks(self.path, blocks)
+        self.cache.evict()
+
+    def segment_paths(self, count):
+        """Paths for per-sheet segments that commit_segments() joins into the entry."""
+        token = uuid.uuid4().hex
+        return [f"{self.path}.{token}.{i}.part" for i in range(count)]
+
+    def commit_segments(self, segment_paths):
+        """Join segments written by write_blocks() in order into the entry."""
+        tmp_path = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        try:
+            # Concatenated gzip members read back as one stream
+            with open(tmp_path, 'wb') as out:
+                for segment_path in segment_paths:
+                    with open(segment_path, 'rb') as segment:
+                        while chunk := segment.read(1024 * 1024):
+                            out.write(chunk)
+            os.replace(tmp_path, self.path)
+        finally:
+            self.discard(segment_paths + [tmp_path])
+        self.cache.evict()
+
+    def discard(self, paths):
+        self.cache.discard(paths)
@@ -0,0 +1,62 @@
+import csv
+import codecs
+
+DELIMITED_EXTENSIONS = (".csv", ".tsv")
+SNIFF_BYTES = 64 * 1024  # read to detect the encoding and the delimiter
+CSV_DELIMITERS = ",;\t"  # Excel writes ';' where the decimal separator is ','
+
+
+def is_delimited_file(file_path):
+    return file_path.lower().endswith(DELIMITED_EXTENSIONS)
+
+
+def detect_encoding(sample):
+    """
+    Guess the encoding of a CSV export from its first bytes.
+
+    A byte order mark wins; otherwise text that decodes as UTF-8 is UTF-8
+    and anything else is taken to be cp1251, the Windows Cyrillic code page
+    Excel uses for "CSV" on Russian and Kazakh systems.
+    """
+    if sample.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"  # Excel's "Unicode text" export, tab separated
+    try:
+        # Not final: the sample may end in the middle of a character
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+    except UnicodeDecodeError:
+        return "cp1251"
+    return "utf-8"
+
+
+def detect_delimiter(file_path, text):
+    """Tab for .tsv; for .csv the delimiter csv.Sniffer finds in ``text``, ',' if it finds none."""
+    if file_path.lower().endswith(".tsv"):
+        return "\t"
+    try:
+        return csv.Sniffer().sniff(text, delimiters=CSV_DELIMITERS).delimiter
+    except csv.Error:
+        return ","
+
+
+def iter_delimited_rows(file_path):
+    """
+    Yield the rows of a CSV or TSV file as lists, like worksheet rows.
+
+    Empty fields become None, as empty cells do in openpyxl; every other
+    value stays text, which is all the NCT report reads. Quoted fields may
+    span lines, as the multi-line specialization cells do.
+    """
+    with open(file_path, "rb") as f:
+        sample = f.read(SNIFF_BYTES)
+    encoding = detect_encoding(sample)
+    text = sample.decode(encoding, errors="ignore")
+    # Sniff on whole lines only
+    if len(sample) == SNIFF_BYTES and "\n" in text:
+        text = text[:text.rindex("\n")]
+    delimiter = detect_delimiter(file_path, text)
+
+    with open(file_path, encoding=encoding, errors="replace", newline="") as f:
+        for row in csv.reader(f, delimiter=delimiter):
+            yield [value if value != "" else None for value in row]
@@ -0,0 +1,233 @@
+import time
+from collections import deque
+import numpy as np
+
+FINGERPRINT_DTYPE = np.uint64
+
+def fingerprints_from_hex(hex_digests):
+    """Turn hex digests into 64-bit fingerprints (the first 8 bytes of each digest)."""
+    return np.fromiter((int(h[:16], 16) for h in hex_digests), dtype=FINGERPRINT_DTYPE, count=len(hex_digests))
+
+class BloomFilter:
+    """Bit array Bloom filter over 64-bit fingerprints, using double hashing."""
+
+    def __init__(self, capacity, bits_per_entry=10):
+        self.num_bits = max(64, int(capacity * bits_per_entry))
+        self.num_hashes = max(1, round(bits_per_entry * 0.693))
+        self.bits = np.zeros((self.num_bits + 7) // 8, dtype=np.uint8)
+
+    def _positions(self, fingerprints):
+        h1 = fingerprints & np.uint64(0xFFFFFFFF)
+        h2 = (fingerprints >> np.uint64(32)) | np.uint64(1)
+        steps = np.arange(self.num_hashes, dtype=np.uint64)
+        return (h1[:, None] + steps[None, :] * h2[:, None]) % np.uint64(self.num_bits)
+
+    def add(self, fingerprints):
+        if len(fingerprints):
+            positions = self._positions(fingerprints).ravel()
+            np.bitwise_or.at(self.bits, positions >> np.uint64(3), (1 << (positions & np.uint64(7))).astype(np.uint8))
+
+    def might_contain(self, fingerprints):
+        positions = self._positions(fingerprints)
+        set_bits = (self.bits[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1
+        return set_bits.all(axis=1)
+
+    def clear(self):
+        self.bits[:] = 0
+
+class _Bucket:
+    """Fingerprints first added during one time slice of the window."""
+
+    __slots__ = ("start", "segments", "size")
+
+    def __init__(self, start):
+        self.start = start
+        self.segments = deque()  # sorted uint64 arrays, oldest first
+        self.size = 0
+
+    def compact(self, segment_size):
+        """
+        Drop repeated fingerprints from the bucket's segments once it stops receiving writes.
+
+        The merged fingerprints are split back into sorted segments of at
+        most ``segment_size``, so capacity eviction still drops a bounded
+        number at a time. Returns the number of fingerprints dropped.
+        """
+        if len(self.segments) <= 1:
+            return 0
+        merged = np.unique(np.concatenate(self.segments))
+        removed = self.size - len(merged)
+        self.segments = deque(merged[i:i + segment_size] for i in range(0, len(merged), segment_size))
+        self.size = len(merged)
+        return removed
+
+class FingerprintIndex:
+    """
+    Time-windowed set of 64-bit fingerprints held in sorted numpy arrays.
+
+    The window is split into ``bucket_count`` time buckets. New fingerprints
+    go into a small Python set that is sealed into a sorted array every
+    ``segment_size`` entries, and a bucket's arrays are merged when time moves
+    on to the next bucket. Expiry and capacity eviction drop whole buckets
+    from the old end of a deque, so they cost O(1) amortized per entry, and
+    timestamps are kept per bucket rather than per entry. Recency therefore
+    has a resolution of window / bucket_count. Capacity is enforced oldest
+    first a segment at a time, so at most max_entries / bucket_count more
+    entries than needed are evicted, and a batch larger than the capacity
+    keeps its newest max_entries.
+
+    An optional Bloom filter answers most negative lookups without touching
+    the arrays. It cannot forget entries, so it is rebuilt once a quarter of
+    its contents have been evicted.
+    """
+
+    def __init__(self, time_window_seconds, max_entries, bucket_count=16, segment_size=65536,
+                 bloom_bits_per_entry=10, clock=time.time):
+        """
+        Args:
+            time_window_seconds (int): How long a fingerprint stays recent
+            max_entries (int): Capacity; the oldest buckets are evicted beyond it
+            bucket_count (int): Time buckets per window
+            segment_size (int): Entries buffered before being sealed into an array
+            bloom_bits_per_entry (int): Bloom filter size, 0 disables the filter
+            clock (callable): Returns the current time in seconds
+        """
+        self.time_window = int(time_window_seconds)
+        self.max_entries = max_entries
+        self.bucket_width = max(1, self.time_window // bucket_count)
+        # Small indexes seal often enough for capacity eviction to stay fine-grained
+        self.segment_size = max(1, min(segment_size, max_entries // bucket_count))
+        self.clock = clock
+        self.bloom = BloomFilter(max_entries, bloom_bits_per_entry) if bloom_bits_per_entry else None
+        self.reset()
+
+    def reset(self):
+        self.buckets = deque()
+        self.pending = {}  # unsealed fingerprints of the newest bucket, in insertion order
+        self.size = 0
+        self.bloom_stale = 0
+        if self.bloom is not None:
+            self.bloom.clear()
+
+    def __len__(self):
+        return self.size
+
+    def _now(self):
+        return int(self.clock())
+
+    def _seal(self):
+        """Move pending fingerprints into sorted segments of at most segment_size, oldest first."""
+        pending = list(self.pending)
+        for i in range(0, len(pending), self.segment_size):
+            segment = np.array(pending[i:i + self.segment_size], dtype=FINGERPRINT_DTYPE)
+            segment.sort()
+            self.buckets[-1].segments.append(segment)
+        self.pending = {}
+
+    def _drop_oldest(self):
+        bucket = self.buckets.popleft()
+        self.size -= bucket.size
+        self.bloom_stale += bucket.size
+        if not self.buckets:
+            # The pending fingerprints belong to the bucket just dropped
+            self.size -= len(self.pending)
+            self.pending = {}
+
+    def _rebuild_bloom(self):
+        self.bloom.clear()
+        for bucket in self.buckets:
+            for segment in bucket.segments:
+                self.bloom.add(segment)
+        if self.pending:
+            self.bloom.add(np.fromiter(self.pending, dtype=FINGERPRINT_DTYPE, count=len(self.pending)))
+        self.bloom_stale = 0
+
+    def _after_drop(self):
+        if self.bloom is not None and self.bloom_stale > max(self.size, 1) // 4:
+            self._rebuild_bloom()
+
+    def expire(self, now=None):
+        """Roll over to the current bucket and drop buckets that left the window."""
+        now = self._now() if now is None else now
+        bucket_start = now - now % self.bucket_width
+        if not self.buckets or self.buckets[-1].start != bucket_start:
+            if self.buckets:
+                self._seal()
+                self.size -= self.buckets[-1].compact(self.segment_size)
+            self.buckets.append(_Bucket(bucket_start))
+        dropped = False
+        while len(self.buckets) > 1 and self.buckets[0].start + self.bucket_width <= now - self.time_window:
+            self._drop_oldest()
+            dropped = True
+        if dropped:
+            self._after_drop()
+
+    def add_many(self, fingerprints):
+        """Record fingerprints as seen now, in order; only the newest max_entries of them fit."""
+        self.expire()
+        fingerprints = np.asarray(fingerprints, dtype=FINGERPRINT_DTYPE)[-self.max_entries:]
+        bucket = self.buckets[-1]
+        before = len(self.pending)
+        for fp in fingerprints.tolist():
+            # Re-adding moves a fingerprint to the new end, like a dict refresh of its timestamp
+            self.pending.pop(fp, None)
+            self.pending[fp] = None
+        added = len(self.pending) - before
+        bucket.size += added
+        self.size += added
+        if self.bloom is not None:
+            self.bloom.add(fingerprints)
+        if len(self.pending) >= self.segment_size:
+            self._seal()
+        self._enforce_capacity()
+
+    def _enforce_capacity(self):
+        dropped = False
+        while self.size > self.max_entries:
+            oldest = self.buckets[0]
+            if not oldest.segments:
+                if len(self.buckets) > 1:
+                    self._drop_oldest()
+                    dropped = True
+                    continue
+                if not self.pending:
+                    break
+                self._seal()
+            # Shed the oldest sealed segment, at most segment_size entries
+            segment = oldest.segments.popleft()
+            oldest.size -= len(segment)
+            self.size -= len(segment)
+            self.bloom_stale += len(segment)
+            dropped = True
+        if dropped:
+            self._after_drop()
+
+    def contains_many(self, fingerprints):
+        """Return a boolean array telling which fingerprints were seen within the window."""
+        self.expire()
+        fingerprints = np.asarray(fingerprints, dtype=FINGERPRINT_DTYPE)
+        found = np.zeros(len(fingerprints), dtype=bool)
+        if not len(fingerprints) or not self.size:
+            return found
+        candidates = np.arange(len(fingerprints))
+        if self.bloom is not None:
+            candidates = candidates[self.bloom.might_contain(fingerprints)]
+            if not len(candidates):
+                return found
+        queries = fingerprints[candidates]
+        hits = np.zeros(len(queries), dtype=bool)
+        for bucket in self.buckets:
+            for segment in bucket.segments:
+                positions = np.searchsorted(segment, queries)
+                in_range = positions < len(segment)
+                hits[in_range] |= segment[positions[in_range]] == queries[in_range]
+        if self.pending:
+            hits |= np.fromiter((int(q) in self.pending for q in queries), dtype=bool, count=len(queries))
+        found[candidates] = hits
+        return found
+
+    def memory_bytes(self):
+        arrays = sum(segment.nbytes for bucket in self.buckets for segment in bucket.segments)
+        bloom = self.bloom.bits.nbytes if self.bloom is not None else 0
+        # A pending int in a dict costs roughly 100 bytes
+        return arrays + bloom + len(self.pending) * 100
@@ -0,0 +1,99 @@
+import os
+import sqlite3
+import threading
+
+# Keep IN (...) lists under SQLite's bound-parameter limit
+LOOKUP_BATCH_SIZE = 500
+
+class SQLiteHashStore:
+    """
+    Hash -> last-seen timestamp table in a local SQLite file.
+
+    Every process and thread opens its own connection to the same file, so
+    all gunicorn workers and background job workers see the same hashes,
+    and they survive restarts. Hashes are stored as binary digests in a
+    WITHOUT ROWID table with an index on the timestamp for expiry. The file
+    is created on first use, not when the store is constructed.
+    """
+
+    def __init__(self, path, table):
+        """
+        Args:
+            path (str): SQLite database file, created if missing
+            table (str): Table name, one per kind of hash
+        """
+        self.path = str(path)
+        self.table = table
+        self._local = threading.local()
+
+    def _connection(self):
+        # Connections are neither shared across threads nor inherited across fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with conn:
+                conn.execute(
+                    f"CREATE TABLE IF NOT EXISTS {self.table} "
+                    f"(hash BLOB PRIMARY KEY, seen_at REAL NOT NULL) WITHOUT ROWID"
+                )
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_seen_at ON {self.table} (seen_at)")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def recent(self, hashes, since):
+        """Return the subset of hex ``hashes`` seen at or after the ``since`` timestamp."""
+        keys = list({bytes.fromhex(h) for h in hashes})
+        found = set()
+        conn = self._connection()
+        for i in range(0, len(keys), LOOKUP_BATCH_SIZE):
+            batch = keys[i:i + LOOKUP_BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            rows = conn.execute(
+                f"SELECT hash FROM {self.table} WHERE seen_at >= ? AND hash IN ({placeholders})",
+                [since, *batch]
+            )
+            found.update(row[0].hex() for row in rows)
+        return found
+
+    def add(self, hashes, seen_at):
+        """Insert hex ``hashes`` or refresh their timestamp, in one transaction."""
+        if not hashes:
+            return
+        with self._connection() as conn:
+            conn.executemany(
+                f"INSERT INTO {self.table} (hash, seen_at) VALUES (?, ?) "
+                f"ON CONFLICT(hash) DO UPDATE SET seen_at = excluded.seen_at",
+                [(bytes.fromhex(h), seen_at) for h in hashes]
+            )
+
+    def delete_older_than(self, cutoff):
+        with self._connection() as conn:
+            return conn.execute(f"DELETE FROM {self.table} WHERE seen_at < ?", [cutoff]).rowcount
+
+    def trim(self, max_hashes):
+        """Delete the oldest hashes so that at most ``max_hashes`` remain."""
+        excess = self.count() - max_hashes
+        if excess <= 0:
+            return 0
+        with self._connection() as conn:
+            return conn.execute(
+                f"DELETE FROM {self.table} WHERE hash IN "
+                f"(SELECT hash FROM {self.table} ORDER BY seen_at LIMIT ?)",
+                [excess]
+            ).rowcount
+
+    def count(self):
+        return self._connection().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def clear(self):
+        with self._connection() as conn:
+            conn.execute(f"DELETE FROM {self.table}")
+
+    def size_bytes(self):
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
@@ -0,0 +1,131 @@
+import itertools
+import numpy as np
+import pandas as pd
+from stats.utils import ReportBuilder, get_column_plan
+
+# Rows turned into one DataFrame at a time, so a huge block never sits in memory whole
+CHUNK_ROWS = 50000
+
+SPECIALIZATION_LINE = r'(?m)^([^\n]*\S[^\n]* - [^\n]*\S[^\n]*)$'
+
+def _str_values(column):
+    """Return the column's string accessor, or None if it holds no strings."""
+    try:
+        return column.str
+    except AttributeError:
+        return None
+
+def _string_mask(column, predicate):
+    """Apply a vectorized string predicate to a column; non-string cells are False."""
+    values = _str_values(column)
+    if values is None:
+        return pd.Series(False, index=column.index)
+    return predicate(values).fillna(False).astype(bool)
+
+def _specialization_mask(column):
+    """Cells that hold specialization data: a " - " and a line break, as a numpy array."""
+    return _string_mask(column, lambda s: s.contains(" - ", regex=False) & s.contains("\n", regex=False)).to_numpy()
+
+def _add_counts(counts, series):
+    """Add value counts to a dict, keeping first-appearance order like the row loop."""
+    for key, count in series.value_counts(sort=False).items():
+        counts[key] = counts.get(key, 0) + int(count)
+
+class PandasReportBuilder(ReportBuilder):
+    """
+    ReportBuilder that aggregates each block as columns instead of cell by cell.
+
+    Each chunk is deduplicated against hash_processor in one batch, then the
+    unique rows become an object DataFrame and quota, Примечание and
+    specialization counts are computed with column operations. The report is
+    identical to the one built by ReportBuilder.
+    """
+
+    def add_block(self, block):
+        self.metadata["blocks_processed"] += 1
+        plan = get_column_plan(block)
+
+        rows = iter(block['data'])
+        while True:
+            chunk = list(itertools.islice(rows, CHUNK_ROWS))
+            if not chunk:
+                break
+            self.metadata["total_rows_processed"] += len(chunk)
+            unique_rows = self.filter_new_rows(chunk, plan)
+            if unique_rows:
+                self.add_frame(pd.DataFrame(unique_rows, dtype=object), plan)
+
+    def add_frame(self, frame, plan):
+        """Aggregate a frame of unique data rows, one column per Excel column."""
+        self._count_quotas(frame, plan.quota_columns)
+        if plan.prim_idx is not None and plan.prim_idx < frame.shape[1]:
+            self._count_prim(frame[plan.prim_idx])
+        self._count_specializations(frame, plan.specialization_idx)
+
+    def _count_quotas(self, frame, quota_columns):
+        plus_masks = {}
+        for idx, cat in quota_columns:
+            if idx >= frame.shape[1]:
+                continue
+            plus_masks[idx] = _string_mask(frame[idx], lambda s: s.strip() == "+")
+            self.quota_counts[cat] += int(plus_masks[idx].sum())
+        if plus_masks:
+            has_quota = np.logical_or.reduce([mask.to_numpy() for mask in plus_masks.values()])
+            self.metadata["rows_with_quotas"] += int(has_quota.sum())
+
+    def _count_prim(self, column):
+        values = _str_values(column)
+        if values is None:
+            return
+        stripped = values.strip()
+        prim_values = column[stripped.notna() & (stripped != "")]
+        self.metadata["rows_with_prim"] += len(prim_values)
+        if prim_values.empty:
+            return
+        items = prim_values.str.split(",").explode().str.strip()
+        _add_counts(self.prim_counts, items[items != ""])
+
+    def _count_specializations(self, frame, spec_idx=None):
+        # A specialization cell contains " - " and a line break; one per row counts, the
+        # "Код группы ОП" cell if it is one and otherwise the first one in the row
+        positions, cells = [], []
+        rest = np.arange(len(frame))
+        if spec_idx is not None and spec_idx < frame.shape[1]:
+            preferred = _specialization_mask(frame[spec_idx])
+            positions.append(preferred.nonzero()[0])
+            cells.append(frame[spec_idx].to_numpy()[preferred])
+            rest = (~preferred).nonzero()[0]
+        if len(rest):
+            remaining = frame.iloc[rest]
+            matches = np.column_stack([_specialization_mask(remaining[col]) for col in remaining.columns])
+            has_cell = matches.any(axis=1)
+            positions.append(rest[has_cell])
+            cells.append(remaining.to_numpy()[has_cell.nonzero()[0], matches.argmax(axis=1)[has_cell]])
+        cells = pd.Series(np.concatenate(cells), index=np.concatenate(positions), dtype=object).sort_index()
+        if cells.empty:
+            return
+
+        # Lines with " - " are the choices, in order; the first one is the first choice
+        lines = cells.str.findall(SPECIALIZATION_LINE).explode().dropna()
+        choice = lines.groupby(level=0).cumcount()
+        lines = lines[(choice < self.specialization_choices).to_numpy()]
+        choice = choice[choice < self.specialization_choices]
+        parts = lines.str.strip().str.split(" - ", regex=False)
+        if (parts.str.len() != 2).any():
+            raise ValueError("Malformed specialization line, expected 'code - university'")
+        spec = parts.str[0].str.strip()
+        univ = parts.str[1].str.strip()
+        selected = ((choice == 0) & (univ == self.university)).to_numpy()
+        self.metadata["rows_with_specializations"] += int(selected.sum())
+        _add_counts(self.specialization_counts, spec[selected])
+        self._count_matrix(choice, univ, spec)
+
+    def _count_matrix(self, choice, univ, spec):
+        # Keep first-appearance order within each choice, like the row loop
+        for number in range(self.specialization_choices):
+            mask = (choice == number).to_numpy()
+            matrix = self.specialization_matrix[str(number + 1)]
+            pairs = pd.Series(list(zip(univ[mask], spec[mask])), dtype=object)
+            for (university, specialization), count in pairs.value_counts(sort=False).items():
+                counts = matrix.setdefault(university, {})
+                counts[specialization] = counts.get(specialization, 0) + int(count)
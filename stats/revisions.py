@@ -0,0 +1,239 @@
+import hashlib
+import itertools
+from datetime import datetime
+import numpy as np
+from stats.utils import (
+    load_nct_blocks, get_report_builder_class, get_specialization_settings,
+    get_column_plan, file_hash_processor, hash_processor, NCT_PARSER_VERSION, REPORT_COUNTERS
+)
+from stats.fingerprint_index import fingerprints_from_hex, FINGERPRINT_DTYPE
+from stats.timing import StageTimer, stage
+
+BLOCK_REUSED = "unchanged"
+BLOCK_CHANGED = "changed"
+BLOCK_ADDED = "added"
+
+
+def _trimmed(values):
+    # Trailing empty cells depend on the sheet's used range, not on the data
+    values = list(values)
+    while values and values[-1] is None:
+        values.pop()
+    return tuple(values)
+
+
+def block_fingerprint(block, rows):
+    """
+    SHA-256 of a block's header, ab-categories and data rows.
+
+    The parser version and the specialization settings are part of it, so
+    stored partials are never reused across a change in how they are counted.
+    """
+    digest = hashlib.sha256()
+    digest.update(repr((NCT_PARSER_VERSION, get_specialization_settings())).encode("utf-8"))
+    digest.update(repr(_trimmed(block["header_row"])).encode("utf-8"))
+    digest.update(repr(_trimmed(block["categories"])).encode("utf-8"))
+    for row in rows:
+        digest.update(repr(_trimmed(row)).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def pack_row_fingerprints(row_hashes):
+    """Row hashes as 64-bit fingerprints packed into bytes, 8 per row."""
+    return fingerprints_from_hex(row_hashes).tobytes()
+
+
+def unpack_row_fingerprints(data):
+    return np.frombuffer(bytes(data), dtype=FINGERPRINT_DTYPE)
+
+
+def _row_fingerprints(block, rows):
+    identity_columns = get_column_plan(block).identity_columns
+    return fingerprints_from_hex(
+        [hash_processor.create_row_hash(row, identity_columns=identity_columns) for row in rows]
+    )
+
+
+def revises(block, rows, fingerprint, previous_blocks, min_overlap):
+    """
+    Decide from its first block whether a file revises a previous version.
+
+    It does when the block is unchanged from one of ``previous_blocks``, or
+    still holds at least ``min_overlap`` of the rows of the previous
+    version's first block, so appending or editing rows keeps the link
+    while an unrelated workbook of the same name does not get it. The first
+    block has to decide, as the answer changes which rows count as
+    duplicates from the first block on.
+    """
+    if not previous_blocks:
+        return False
+    if any(previous["fingerprint"] == fingerprint for previous in previous_blocks):
+        return True
+    previous_rows = set(unpack_row_fingerprints(previous_blocks[0]["row_fingerprints"]).tolist())
+    if not previous_rows:
+        return False
+    kept = previous_rows.intersection(_row_fingerprints(block, rows).tolist())
+    return len(kept) >= min_overlap * len(previous_rows)
+
+
+def process_revision(file_path, previous_blocks=(), file_hash=None, sheet_names=None, engine="python",
+                     max_workers=None, block_cache=None, min_overlap=0.5):
+    """
+    Build a file's report block by block, keeping each block's partial counts.
+
+    The file is read once (see load_nct_blocks(), which ``max_workers`` and
+    ``block_cache`` are passed to). Every block is fingerprinted, aggregated
+    on its own and merged into the report, and the blocks are returned with
+    their partials for a later revision of the file to reuse.
+
+    ``previous_blocks`` are the stored blocks of an earlier upload the file
+    may revise, decided on the first block (see revises()). When it does, a
+    block whose fingerprint matches a previous block merges that block's
+    stored partial instead of being aggregated again, and rows of the
+    previous version are not counted as duplicates unless an earlier block
+    of this file has them too. When it does not, ``previous_blocks`` are
+    ignored and the report equals process_excel_file()'s.
+
+    Args:
+        file_path (str): Workbook or CSV/TSV file
+        previous_blocks (list): Blocks of the previous version, first block first, dicts
+            with sheet_name, index, fingerprint, partial and row_fingerprints (bytes)
+        file_hash (str): Hash of the file, computed when not given
+        sheet_names (list): Sheets to read, None for the active sheet
+        engine (str): Report engine, see get_report_builder_class()
+        max_workers (int): Processes several sheets are parsed in
+        block_cache (BlockCache): Cache of parsed blocks, or None
+        min_overlap (float): See revises()
+
+    Returns:
+        tuple: (report, blocks, revised, None) or (None, None, None, error). Each
+            block is a dict with sheet_name, index, nct_row, fingerprint, row_count,
+            partial, row_fingerprints and status (unchanged, changed or added;
+            always added when ``revised`` is False). The report metadata gets the
+            number of reused partials as blocks_reused
+    """
+    start_time = datetime.now()
+    timer = StageTimer()
+    with timer.activate():
+        loaded, error = load_nct_blocks(file_path, file_hash=file_hash, sheet_names=sheet_names,
+                                        max_workers=max_workers, block_cache=block_cache)
+        if error:
+            return None, None, None, error
+
+        builder_class = get_report_builder_class(engine)
+        builder = builder_class(loaded["file_hash"])
+        blocks = []
+        reused = 0
+        revised = None
+        reusable = {}
+        previous_rows = set()
+        previous_positions = set()
+        sheet_blocks = {}
+        file_blocks = loaded["blocks"]
+        try:
+            for block in file_blocks:
+                rows = list(block["data"])
+                with stage("fingerprint"):
+                    fingerprint = block_fingerprint(block, rows)
+                if revised is None:
+                    revised = revises(block, rows, fingerprint, previous_blocks, min_overlap)
+                    for previous in previous_blocks if revised else ():
+                        # Identical blocks are reused in order, as each has its own partial
+                        reusable.setdefault(previous["fingerprint"], []).append(previous)
+                        previous_rows.update(unpack_row_fingerprints(previous["row_fingerprints"]).tolist())
+                        previous_positions.add((previous["sheet_name"], previous["index"]))
+
+                sheet_name = block["sheet_name"] or ""
+                index = sheet_blocks.get(sheet_name, 0)
+                sheet_blocks[sheet_name] = index + 1
+                matches = reusable.get(fingerprint)
+                previous = matches.pop(0) if matches else None
+                if previous is not None:
+                    partial = previous["partial"]
+                    row_fingerprints = previous["row_fingerprints"]
+                    reused += 1
+                    status = BLOCK_REUSED
+                else:
+                    block_builder = builder_class(previous_rows=previous_rows, record_rows=True)
+                    block_builder.add_blocks([dict(block, data=rows)])
+                    partial = block_builder.partial()
+                    # Stage times are already on this timer, row hashes already in hash_processor
+                    partial.pop("stage_timings")
+                    partial.pop("row_hashes")
+                    row_fingerprints = pack_row_fingerprints(block_builder.seen_row_hashes)
+                    status = BLOCK_CHANGED if (sheet_name, index) in previous_positions else BLOCK_ADDED
+                if previous_rows:
+                    # A row repeated in a later block is a duplicate again, as in a full build
+                    previous_rows.difference_update(unpack_row_fingerprints(row_fingerprints).tolist())
+                builder.merge(dict(partial, row_hashes=[]))
+                blocks.append({
+                    "sheet_name": sheet_name,
+                    "index": index,
+                    "nct_row": block["nct_row"],
+                    "fingerprint": fingerprint,
+                    "row_count": len(rows),
+                    "partial": partial,
+                    "row_fingerprints": row_fingerprints,
+                    "status": status
+                })
+        finally:
+            if hasattr(file_blocks, "close"):
+                file_blocks.close()
+
+        report = builder.build()
+        file_hash_processor.add_file_hash(loaded["file_hash"])
+
+    metadata = report["metadata"]
+    metadata["blocks_reused"] = reused
+    metadata["processing_start"] = start_time.isoformat()
+    metadata["processing_duration_seconds"] = round(timer.elapsed(), 3)
+    metadata["stage_timings"] = timer.as_dict()
+    return report, blocks, bool(revised), None
+
+
+def _count_delta(current, previous):
+    keys = dict.fromkeys(itertools.chain(current, previous))
+    delta = {key: current.get(key, 0) - previous.get(key, 0) for key in keys}
+    return {key: change for key, change in delta.items() if change}
+
+
+def report_delta(previous_report, report, blocks, previous_blocks):
+    """
+    Describe how a revision's report differs from its previous version's.
+
+    Counts are the revision's minus the previous version's, and only
+    non-zero changes are listed.
+
+    Args:
+        previous_report (dict): Report of the previous version
+        report (dict): Report of the revision
+        blocks (list): The revision's blocks, as returned by process_revision
+        previous_blocks (list): The previous version's blocks
+    """
+    quota = dict(report["quota_counts"])
+    previous_quota = dict(previous_report["quota_counts"])
+    prim = quota.pop("Примечание", {})
+    previous_prim = previous_quota.pop("Примечание", {})
+    positions = {(block["sheet_name"], block["index"]) for block in blocks}
+    statuses = [block["status"] for block in blocks]
+    metadata = report["metadata"]
+    previous_metadata = previous_report["metadata"]
+    return {
+        "blocks": {
+            BLOCK_REUSED: statuses.count(BLOCK_REUSED),
+            BLOCK_CHANGED: statuses.count(BLOCK_CHANGED),
+            BLOCK_ADDED: statuses.count(BLOCK_ADDED),
+            "removed": sum(
+                1 for block in previous_blocks if (block["sheet_name"], block["index"]) not in positions
+            )
+        },
+        "counters": _count_delta(
+            {key: metadata.get(key, 0) for key in REPORT_COUNTERS},
+            {key: previous_metadata.get(key, 0) for key in REPORT_COUNTERS}
+        ),
+        "quota_counts": _count_delta(quota, previous_quota),
+        "prim_counts": _count_delta(prim, previous_prim),
+        "specialization_counts": _count_delta(
+            report["specialization_counts"], previous_report["specialization_counts"]
+        )
+    }
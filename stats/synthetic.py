@@ -0,0 +1,141 @@
+import csv
+import random
+import itertools
+import openpyxl
+from stats.utils import NCT_BANNER, NCT_HEADER_MARKER
+
+# Leave room for banner and header rows under Excel's 1,048,576 row limit
+MAX_ROWS_PER_SHEET = 1000000
+
+# The AB_CATEGORIES columns in a fixed order; the set's own order changes with PYTHONHASHSEED
+CATEGORY_COLUMNS = (
+    "АБ", "АГП", "ТиПО", "О, КНП, ИК, СС", "Сир", "Инв", "ВОВ", "Отл", "Село", "Кандас",
+    "Многод. семья", "Неполная семья", "Семьи с инв."
+)
+
+NCT_HEADER = (
+    ["№", "ФИО", "ИКТ", "ИИН", "№ сертификата", "Средний балл", "Имеющие преимущественное право"]
+    + [None] * (len(CATEGORY_COLUMNS) - 1)
+    + ["Квота", NCT_HEADER_MARKER, "Примечание"]
+)
+NCT_CATEGORY_ROW = [None] * 6 + list(CATEGORY_COLUMNS) + [None] * 3
+
+UNIVERSITIES = ["421", "019", "047", "002", "031"]  # 421 is KBTU, the one counted in reports
+SPECIALIZATIONS = [f"B0{code}" for code in range(40, 70)]
+PRIM_VALUES = [None, None, None, None, "Сирота", "Инв", "Инв, Сирота", "Многодетная", " "]
+QUOTA_PROBABILITY = 0.08
+
+
+def _banner_rows(block_index):
+    return [
+        [NCT_BANNER, None, None],
+        [f"Список претендентов на образовательный грант, блок {block_index + 1}", None],
+        [],
+        NCT_HEADER,
+        NCT_CATEGORY_ROW,
+    ]
+
+
+def _data_row(rng, number):
+    specializations = "\n".join(
+        f"{rng.choice(SPECIALIZATIONS)} - {rng.choice(UNIVERSITIES)}"
+        for _ in range(rng.randint(1, 4))
+    )
+    row = [
+        number,
+        f"Абитуриент {number}",
+        rng.randint(1000000, 9999999),
+        str(rng.randint(10 ** 11, 10 ** 12 - 1)),
+        f"{rng.randint(0, 9999999):07d}",
+        rng.randint(50, 140),
+    ]
+    row += ["+" if rng.random() < QUOTA_PROBABILITY else None for _ in CATEGORY_COLUMNS]
+    row += [rng.choice(["ОК", "АБ", None]), specializations, rng.choice(PRIM_VALUES)]
+    return row
+
+
+def _iter_nct_blocks(rows, blocks, seed, duplicate_ratio):
+    """
+    Yield (banner and header rows, data row count, data rows) for each synthetic NCT block.
+
+    The data rows are generated lazily and must be consumed before the next block.
+    """
+    rng = random.Random(seed)
+    state = {"number": 0, "recent": []}
+
+    def data_rows(count):
+        recent = state["recent"]
+        for _ in range(count):
+            if recent and rng.random() < duplicate_ratio:
+                yield rng.choice(recent)
+                continue
+            state["number"] += 1
+            row = _data_row(rng, state["number"])
+            if len(recent) < 1000:
+                recent.append(row)
+            else:
+                recent[rng.randrange(len(recent))] = row
+            yield row
+
+    for block_index in range(blocks):
+        block_rows = rows // blocks + (1 if block_index < rows % blocks else 0)
+        yield _banner_rows(block_index), block_rows, data_rows(block_rows)
+
+
+def write_nct_workbook(path, rows, blocks=10, seed=0, duplicate_ratio=0.0, max_rows_per_sheet=MAX_ROWS_PER_SHEET):
+    """
+    Write a synthetic NCT workbook with the layout the parser expects.
+
+    Every block has the "Национальный Центр Тестирования" banner, a title, the
+    header row with "Код группы ОП", the ab-category row and data rows with
+    "+" quota cells, multi-line "code - university" cells and Примечание
+    values. Blocks move to a new sheet when a sheet would pass
+    ``max_rows_per_sheet``. The workbook is streamed with openpyxl's
+    write-only mode, so a million rows do not sit in memory.
+
+    Args:
+        path (str): Output .xlsx path
+        rows (int): Data rows in total
+        blocks (int): Number of NCT blocks the rows are split into
+        seed (int): Random seed, the same arguments always give the same file
+        duplicate_ratio (float): Share of data rows that repeat an earlier row, for deduplication
+
+    Returns:
+        dict: rows, blocks and sheet names written
+    """
+    blocks = max(1, min(blocks, rows or 1))
+    wb = openpyxl.Workbook(write_only=True)
+    sheet_names = []
+    ws = None
+    sheet_rows = 0
+    for header, block_rows, data in _iter_nct_blocks(rows, blocks, seed, duplicate_ratio):
+        if ws is None or sheet_rows + len(header) + block_rows > max_rows_per_sheet:
+            sheet_names.append(f"Лист{len(sheet_names) + 1}")
+            ws = wb.create_sheet(sheet_names[-1])
+            sheet_rows = 0
+        for row in itertools.chain(header, data):
+            ws.append(row)
+        sheet_rows += len(header) + block_rows
+    wb.save(path)
+    return {"rows": rows, "blocks": blocks, "sheet_names": sheet_names}
+
+
+def write_nct_csv(path, rows, blocks=10, seed=0, duplicate_ratio=0.0, delimiter=",", encoding="utf-8"):
+    """
+    Write the rows write_nct_workbook() would write with the same arguments as one CSV file.
+
+    Args:
+        path (str): Output .csv or .tsv path
+        delimiter (str): Field separator, ';' and '\t' are what Excel writes besides ','
+        encoding (str): 'utf-8', 'utf-8-sig' or 'cp1251', as partner exports come in
+
+    Returns:
+        dict: rows, blocks and sheet names written (none for CSV)
+    """
+    blocks = max(1, min(blocks, rows or 1))
+    with open(path, "w", encoding=encoding, newline="") as f:
+        writer = csv.writer(f, delimiter=delimiter)
+        for header, _, data in _iter_nct_blocks(rows, blocks, seed, duplicate_ratio):
+            writer.writerows(header)
+            writer.writerows(data)
+    return {"rows": rows, "blocks": blocks, "sheet_names": []}
@@ -0,0 +1,30 @@
+import os
+from contextlib import contextmanager
+from django.test import override_settings
+from stats import utils as nct
+
+
+@contextmanager
+def dedup_store(store, directory, max_row_hashes=10 ** 6):
+    """Swap the global hash processors for fresh ones of a NCT_DEDUP_STORE kind."""
+    saved = nct.file_hash_processor, nct.hash_processor
+    with override_settings(NCT_DEDUP_STORE=store, NCT_DEDUP_DB=os.path.join(directory, f'{store}.sqlite3'),
+                           NCT_DEDUP_MAX_ROW_HASHES=max_row_hashes):
+        nct.file_hash_processor, nct.hash_processor = nct.create_hash_processors()
+    try:
+        yield nct.hash_processor
+    finally:
+        nct.file_hash_processor, nct.hash_processor = saved
+
+
+def report_counts(report):
+    """The parts of a report that do not depend on when or where it was built."""
+    metadata = report['metadata']
+    dedup = metadata['deduplication_stats']
+    return {
+        'quota_counts': report['quota_counts'],
+        'specialization_counts': report['specialization_counts'],
+        'specialization_matrix': report['specialization_matrix'],
+        'counters': {key: metadata[key] for key in nct.REPORT_COUNTERS},
+        'dedup': {key: dedup[key] for key in nct.DEDUP_COUNTERS},
+    }
@@ -0,0 +1,630 @@
+import os
+import codecs
+import random
+import hashlib
+import multiprocessing
+import zipfile
+import datetime
+import tempfile
+from unittest import mock
+import numpy as np
+import openpyxl
+from openpyxl.worksheet._read_only import ReadOnlyWorksheet
+from django.test import SimpleTestCase, override_settings
+from stats import utils as nct
+from stats.block_cache import BlockCache, read_blocks, write_blocks
+from stats.csv_reader import detect_delimiter, detect_encoding, iter_delimited_rows
+from stats.fingerprint_index import FingerprintIndex
+from stats.hash_store import LOOKUP_BATCH_SIZE, SQLiteHashStore
+from stats.testing import dedup_store, report_counts
+from stats.synthetic import (
+    CATEGORY_COLUMNS, NCT_CATEGORY_ROW, NCT_HEADER, _banner_rows, _data_row, write_nct_csv, write_nct_workbook
+)
+from stats.xlsx_reader import NativeWorkbook
+
+
+class SyntheticWorkbookTests(SimpleTestCase):
+    def test_category_columns_are_the_ab_categories_in_a_fixed_order(self):
+        self.assertIsInstance(CATEGORY_COLUMNS, tuple)
+        self.assertEqual(len(CATEGORY_COLUMNS), len(nct.AB_CATEGORIES))
+        self.assertEqual(set(CATEGORY_COLUMNS), nct.AB_CATEGORIES)
+
+
+def list_nct_blocks(rows):
+    """The list-based block parser that iter_nct_blocks_from_rows() replaced, kept as a reference."""
+    i = 0
+    results = []
+    while i < len(rows):
+        if nct.is_nct_banner_row(rows[i]):
+            j = i + 1
+            categories = None
+            header_row = None
+            while j < len(rows):
+                header_row = rows[j]
+                if nct.is_nct_header_row(header_row):
+                    k = j + 1
+                    while k < len(rows) and not any(rows[k]):
+                        k += 1
+                    if k < len(rows):
+                        categories = list(rows[k])
+                        j = k + 1
+                    else:
+                        categories = list(header_row)
+                        j += 1
+                    break
+                j += 1
+            data = []
+            while j < len(rows):
+                if nct.is_nct_banner_row(rows[j]):
+                    break
+                if any(rows[j]):
+                    data.append(list(rows[j]))
+                j += 1
+            results.append({
+                "nct_row": i + 1,
+                "categories": categories if categories else [],
+                "header_row": header_row if header_row else [],
+                "data": data
+            })
+            i = j
+        else:
+            i += 1
+    return results
+
+
+class StreamingBlockTests(SimpleTestCase):
+    def setUp(self):
+        rng = random.Random(1)
+        banner, header, categories = (nct.NCT_BANNER,), tuple(NCT_HEADER), tuple(NCT_CATEGORY_ROW)
+        data = [tuple(_data_row(rng, number)) for number in range(1, 13)]
+        self.rows = [
+            ('Пояснение',),
+            banner, ('Список',), (), header, (None, None), categories, data[0], (), data[1], data[2],
+            # A banner without a header of its own takes the next block's header and rows
+            banner, banner, header, categories, data[3],
+            banner, data[4], data[5],
+            banner, header, categories, *data[6:],
+            # A header at the end of the sheet has no categories row
+            banner, header,
+        ]
+
+    def streamed(self, rows):
+        return [
+            {key: value for key, value in dict(block, data=list(block['data'])).items() if key != 'sheet_name'}
+            for block in nct.iter_nct_blocks_from_rows(rows)
+        ]
+
+    def test_streamed_blocks_equal_the_list_parser(self):
+        expected = list_nct_blocks(self.rows)
+        self.assertEqual([block['nct_row'] for block in expected], [2, 12, 17, 29])
+        self.assertEqual(self.streamed(iter(self.rows)), expected)
+
+    def test_generated_workbook_blocks_equal_the_list_parser(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'blocks.xlsx')
+            write_nct_workbook(path, 500, blocks=5, duplicate_ratio=0.1, seed=9)
+            wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+            rows = list(wb.active.iter_rows(values_only=True))
+            wb.close()
+            blocks = nct.parse_nct_blocks_correct_header(path)
+        self.assertEqual({block['sheet_name'] for block in blocks}, {''})
+        self.assertEqual([{key: value for key, value in block.items() if key != 'sheet_name'} for block in blocks],
+                         list_nct_blocks(rows))
+
+    def test_rows_are_read_as_blocks_are_consumed(self):
+        read = []
+
+        def rows():
+            for row in self.rows:
+                read.append(row)
+                yield row
+
+        blocks = nct.iter_nct_blocks_from_rows(rows())
+        first = next(blocks)
+        self.assertEqual(next(first['data']), list(self.rows[7]))
+        self.assertEqual(len(read), 8)
+        # Rows the consumer skips are drained before the next block is searched for
+        second = next(blocks)
+        self.assertEqual(second['nct_row'], 12)
+        self.assertEqual(list(second['data']), [list(self.rows[15])])
+        self.assertEqual([block['nct_row'] for block in blocks], [17, 29])
+
+
+class MultiSheetReportTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.path = os.path.join(cls.tmp.name, 'sheets.xlsx')
+        # Four sheets, with rows repeated across them
+        write_nct_workbook(cls.path, 2000, blocks=4, duplicate_ratio=0.05, seed=3, max_rows_per_sheet=500)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+        super().tearDownClass()
+
+    def build(self, max_workers):
+        report, error = nct.process_excel_file(self.path, sheet_names=nct.ALL_SHEETS, max_workers=max_workers)
+        self.assertIsNone(error)
+        return report_counts(report)
+
+    def test_active_sheet_is_parsed_by_default(self):
+        with dedup_store('memory', self.tmp.name):
+            report, error = nct.process_excel_file(self.path)
+        self.assertIsNone(error)
+        self.assertEqual(report['metadata']['total_rows_processed'], 500)
+
+    def test_pooled_report_equals_serial_report(self):
+        for store in ('memory', 'sqlite', 'compact'):
+            with self.subTest(store=store), dedup_store(store, self.tmp.name) as row_store:
+                serial = self.build(max_workers=1)
+                self.assertGreater(serial['dedup']['duplicate_rows_skipped'], 0)
+                for _ in range(2):
+                    row_store.reset()
+                    self.assertEqual(self.build(max_workers=4), serial)
+
+    def test_pooled_reprocessing_finds_every_row(self):
+        with dedup_store('memory', self.tmp.name):
+            self.build(max_workers=4)
+            again = self.build(max_workers=4)
+        self.assertEqual(again['dedup']['unique_rows_processed'], 0)
+        self.assertEqual(again['dedup']['duplicate_rows_skipped'], 2000)
+
+class SniffTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        self.preamble = [('Пояснение', i) for i in range(nct.NCT_SNIFF_ROWS + 50)]
+
+    def report(self, path):
+        with dedup_store('memory', self.tmp):
+            report, error = nct.process_excel_file(path)
+        self.assertIsNone(error)
+        return report_counts(report)
+
+    def test_workbook_with_first_block_past_the_sniffed_rows(self):
+        path = os.path.join(self.tmp, 'plain.xlsx')
+        write_nct_workbook(path, 200, blocks=2, seed=4)
+        wb = openpyxl.load_workbook(path, read_only=True)
+        rows = list(wb.active.iter_rows(values_only=True))
+        wb.close()
+        late_path = os.path.join(self.tmp, 'late.xlsx')
+        late = openpyxl.Workbook(write_only=True)
+        ws = late.create_sheet('Лист1')
+        for row in self.preamble + rows:
+            ws.append(row)
+        late.save(late_path)
+
+        self.assertTrue(nct.is_nct_excel(late_path))
+        self.assertEqual(self.report(late_path), self.report(path))
+
+    def test_csv_with_first_block_past_the_sniffed_rows(self):
+        path = os.path.join(self.tmp, 'plain.csv')
+        write_nct_csv(path, 200, blocks=2, seed=4)
+        late_path = os.path.join(self.tmp, 'late.csv')
+        with open(path, encoding='utf-8') as src, open(late_path, 'w', encoding='utf-8') as dst:
+            dst.writelines(f'{text},{number}\n' for text, number in self.preamble)
+            dst.write(src.read())
+
+        self.assertEqual(self.report(late_path), self.report(path))
+
+    def test_sniffed_head_is_replayed_in_front_of_the_rest(self):
+        rows = [(nct.NCT_BANNER,), tuple(NCT_HEADER), tuple(NCT_CATEGORY_ROW)] + [(i,) for i in range(1000)]
+        rest = iter(rows)
+        is_nct, head = nct.sniff_nct_head(rest, 100)
+        self.assertTrue(is_nct)
+        self.assertEqual(len(head), 100)
+        self.assertEqual(head + list(rest), rows)
+
+    @override_settings(NCT_XLSX_READER='openpyxl')
+    def test_workbook_rows_are_read_once(self):
+        path = os.path.join(self.tmp, 'plain.xlsx')
+        write_nct_workbook(path, 2 * nct.NCT_SNIFF_ROWS, blocks=2, seed=4)
+        wb = openpyxl.load_workbook(path, read_only=True)
+        sheet_rows = len(list(wb.active.iter_rows(values_only=True)))
+        wb.close()
+
+        read = []
+        iter_rows = ReadOnlyWorksheet.iter_rows
+
+        def counted_iter_rows(ws, *args, **kwargs):
+            for row in iter_rows(ws, *args, **kwargs):
+                read.append(row)
+                yield row
+
+        with mock.patch.object(ReadOnlyWorksheet, 'iter_rows', counted_iter_rows):
+            report = self.report(path)
+        self.assertEqual(report['counters']['total_rows_processed'], 2 * nct.NCT_SNIFF_ROWS)
+        self.assertEqual(len(read), sheet_rows)
+
+    def test_file_without_blocks_is_rejected(self):
+        path = os.path.join(self.tmp, 'other.csv')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.writelines(f'{text},{number}\n' for text, number in self.preamble)
+        self.assertEqual(nct.load_nct_workbook(path), (None, 'File does not match expected NCT pattern'))
+
+
+class DelimitedFileTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+
+    def report(self, path):
+        with dedup_store('memory', self.tmp):
+            report, error = nct.process_excel_file(path)
+        self.assertIsNone(error)
+        return report_counts(report)
+
+    def test_exports_in_every_encoding_and_delimiter_give_the_same_report(self):
+        path = os.path.join(self.tmp, 'plain.csv')
+        write_nct_csv(path, 300, blocks=3, duplicate_ratio=0.05, seed=7)
+        expected = self.report(path)
+        self.assertGreater(expected['counters']['rows_with_quotas'], 0)
+        for name, delimiter, encoding in (
+            ('semicolon.csv', ';', 'utf-8-sig'),
+            ('windows.csv', ';', 'cp1251'),
+            ('unicode.csv', '\t', 'utf-16'),
+            ('tabs.tsv', '\t', 'cp1251'),
+        ):
+            with self.subTest(name=name):
+                export = os.path.join(self.tmp, name)
+                write_nct_csv(export, 300, blocks=3, duplicate_ratio=0.05, seed=7,
+                              delimiter=delimiter, encoding=encoding)
+                rows = list(iter_delimited_rows(export))
+                self.assertEqual(rows[0], [nct.NCT_BANNER, None, None])
+                self.assertEqual(self.report(export), expected)
+
+    def test_encoding_detection(self):
+        text = 'Национальный Центр Тестирования'
+        self.assertEqual(detect_encoding(text.encode('cp1251')), 'cp1251')
+        self.assertEqual(detect_encoding(text.encode('utf-8')), 'utf-8')
+        # A sample cut in the middle of a two-byte character is still UTF-8
+        self.assertEqual(detect_encoding(text.encode('utf-8')[:3]), 'utf-8')
+        self.assertEqual(detect_encoding(codecs.BOM_UTF8 + text.encode('utf-8')), 'utf-8-sig')
+        self.assertEqual(detect_encoding(text.encode('utf-16')), 'utf-16')
+
+    def test_delimiter_detection(self):
+        self.assertEqual(detect_delimiter('a.csv', 'a;b;"c,d"\n1;2;3\n'), ';')
+        self.assertEqual(detect_delimiter('a.csv', 'a,b,c\n1,2,3\n'), ',')
+        self.assertEqual(detect_delimiter('a.csv', 'abc\n'), ',')
+        self.assertEqual(detect_delimiter('a.TSV', 'a,b,c\n'), '\t')
+
+
+class ColumnPlanTests(SimpleTestCase):
+    def test_plan_of_the_nct_header(self):
+        plan = nct.compile_column_plan(tuple(NCT_HEADER), tuple(NCT_CATEGORY_ROW))
+        self.assertEqual(plan.identity_columns, (3, 1, 4))
+        self.assertEqual(plan.quota_columns, tuple((6 + i, cat) for i, cat in enumerate(CATEGORY_COLUMNS)))
+        self.assertEqual(plan.prim_idx, NCT_HEADER.index('Примечание'))
+        self.assertEqual(plan.specialization_idx, NCT_HEADER.index(nct.NCT_HEADER_MARKER))
+
+    def test_plan_of_a_header_without_known_columns(self):
+        plan = nct.compile_column_plan(('a', 'b'), (None, 'Сир'))
+        self.assertEqual(plan.identity_columns, nct.DEFAULT_IDENTITY_COLUMNS)
+        self.assertEqual(plan.quota_columns, ((1, 'Сир'),))
+        self.assertIsNone(plan.prim_idx)
+        self.assertIsNone(plan.specialization_idx)
+
+    def test_specializations_outside_the_code_column_are_counted(self):
+        rng = random.Random(6)
+        data = [_data_row(rng, number) for number in range(1, 301)]
+        spec_idx = NCT_HEADER.index(nct.NCT_HEADER_MARKER)
+        moved = []
+        for number, row in enumerate(data):
+            row = list(row)
+            if number % 3 == 0:
+                # Specializations in an unnamed column past the header, the code cell left empty
+                row += [None, row[spec_idx]]
+                row[spec_idx] = None
+            moved.append(row)
+
+        with tempfile.TemporaryDirectory() as tmp, dedup_store('memory', tmp) as row_store:
+            for engine in ('python', 'pandas'):
+                with self.subTest(engine=engine):
+                    reports = []
+                    for rows in (data, moved):
+                        row_store.reset()
+                        blocks = nct.iter_nct_blocks_from_rows(_banner_rows(0) + rows)
+                        reports.append(report_counts(nct.generate_custom_report(blocks, engine=engine)))
+                    self.assertGreater(reports[0]['counters']['rows_with_specializations'], 0)
+                    self.assertEqual(reports[1], reports[0])
+
+
+class ReportEngineTests(SimpleTestCase):
+    def test_pandas_report_equals_python_report(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'engines.xlsx')
+            write_nct_workbook(path, 3000, blocks=4, duplicate_ratio=0.1, seed=12)
+            for store in ('memory', 'sqlite', 'compact'):
+                with self.subTest(store=store), dedup_store(store, tmp) as row_store:
+                    runs = {}
+                    for engine in ('python', 'pandas'):
+                        row_store.reset()
+                        # The second run finds every row in the store
+                        runs[engine] = [
+                            report_counts(nct.process_excel_file(path, engine=engine)[0]) for _ in range(2)
+                        ]
+                    self.assertGreater(runs['python'][0]['dedup']['duplicate_rows_skipped'], 0)
+                    self.assertEqual(runs['python'][1]['dedup']['unique_rows_processed'], 0)
+                    self.assertEqual(runs['pandas'], runs['python'])
+
+
+class BlockCacheTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        self.cache = BlockCache(os.path.join(self.tmp, 'cache'), 10 ** 9, nct.NCT_PARSER_VERSION)
+
+    def test_cell_values_read_back_with_their_types(self):
+        rows = [
+            [1, 2.5, 'a', None, True, float('inf')],
+            [datetime.datetime(2024, 7, 1, 9, 30), datetime.date(2024, 7, 1), datetime.time(12, 0, 1),
+             datetime.timedelta(days=1, seconds=5, microseconds=7)],
+            ['short'],
+        ]
+        block = {'sheet_name': 'Лист1', 'nct_row': 3, 'categories': [None, 'Сир'], 'header_row': ['№', None]}
+        path = os.path.join(self.tmp, 'blocks.jsonl.gz')
+        for written in write_blocks(path, [dict(block, data=iter(rows))], chunk_rows=2):
+            list(written['data'])
+        read = [dict(b, data=list(b['data'])) for b in read_blocks(path)]
+        self.assertEqual(read, [dict(block, data=rows)])
+        self.assertEqual([[type(value) for value in row] for row in read[0]['data']],
+                         [[type(value) for value in row] for row in rows])
+
+    def test_hit_replays_the_report_without_opening_the_workbook(self):
+        path = os.path.join(self.tmp, 'cached.xlsx')
+        write_nct_workbook(path, 300, blocks=3, seed=8)
+        with dedup_store('memory', self.tmp) as row_store:
+            miss, _ = nct.process_excel_file(path, block_cache=self.cache)
+            self.assertEqual(len(os.listdir(self.cache.directory)), 1)
+            row_store.reset()
+            with mock.patch.object(nct, 'load_nct_workbook', side_effect=AssertionError('workbook opened')):
+                hit, _ = nct.process_excel_file(path, block_cache=self.cache)
+        self.assertEqual(report_counts(hit), report_counts(miss))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        def store(name):
+            for block in self.cache.entry(name).record([{'sheet_name': '', 'nct_row': 1, 'categories': [],
+                                                         'header_row': [], 'data': iter([[name * 200]])}]):
+                list(block['data'])
+
+        store('a')
+        store('b')
+        os.utime(self.cache.entry_path('a'), (1, 1))
+        os.utime(self.cache.entry_path('b'), (2, 2))
+        self.assertIsNotNone(self.cache.get('a'))  # a is now the most recently used
+        self.cache.max_bytes = os.path.getsize(self.cache.entry_path('a')) * 2
+        store('c')
+        self.assertIsNotNone(self.cache.get('a'))
+        self.assertIsNone(self.cache.get('b'))
+        self.assertIsNotNone(self.cache.get('c'))
+
+
+def _add_to_store(path, hashes, seen_at):
+    SQLiteHashStore(path, 'row_hashes').add(hashes, seen_at)
+
+
+class SQLiteHashStoreTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'hashes.sqlite3')
+        self.store = SQLiteHashStore(self.path, 'row_hashes')
+        self.hashes = [hashlib.md5(str(i).encode()).hexdigest() for i in range(3 * LOOKUP_BATCH_SIZE)]
+
+    def test_lookups_span_several_batches(self):
+        stored = self.hashes[:2 * LOOKUP_BATCH_SIZE + 7]
+        self.store.add(stored[:LOOKUP_BATCH_SIZE], 100)
+        self.store.add(stored[LOOKUP_BATCH_SIZE:], 200)
+        self.assertEqual(self.store.recent(self.hashes, 0), set(stored))
+        self.assertEqual(self.store.recent(self.hashes, 150), set(stored[LOOKUP_BATCH_SIZE:]))
+        # Adding a hash again refreshes it
+        self.store.add(stored[:1], 300)
+        self.assertEqual(self.store.recent(self.hashes, 250), set(stored[:1]))
+
+    def test_hashes_added_by_another_process_are_found(self):
+        self.store.add(self.hashes[:10], 100)  # opens this process's connection first
+        process = multiprocessing.get_context('fork').Process(
+            target=_add_to_store, args=(self.path, self.hashes[10:LOOKUP_BATCH_SIZE + 10], 100)
+        )
+        process.start()
+        process.join()
+        self.assertEqual(process.exitcode, 0)
+        self.assertEqual(self.store.recent(self.hashes, 0), set(self.hashes[:LOOKUP_BATCH_SIZE + 10]))
+
+    def test_trim_keeps_the_newest_hashes(self):
+        for seen_at, h in enumerate(self.hashes[:20]):
+            self.store.add([h], seen_at)
+        self.assertEqual(self.store.trim(5), 15)
+        self.assertEqual(self.store.recent(self.hashes, 0), set(self.hashes[15:20]))
+
+    def test_processor_ignores_hashes_outside_its_time_window(self):
+        processor = nct.SQLiteTimeHashProcessor(self.path, time_window_hours=1)
+        processor.add_hashes(self.hashes[:5])
+        self.store.add(self.hashes[5:10], (datetime.datetime.now() - datetime.timedelta(hours=2)).timestamp())
+        self.assertEqual(processor.filter_recent(self.hashes[:10]), set(self.hashes[:5]))
+        processor.cleanup_old_hashes()
+        self.assertEqual(self.store.count(), 5)
+
+
+class FingerprintIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 0
+        self.index = FingerprintIndex(3600, 1000, clock=lambda: self.now)
+
+    def fingerprints(self, start, stop):
+        return np.arange(start, stop, dtype=np.uint64)
+
+    def test_oversized_batch_keeps_its_newest_entries(self):
+        self.index.add_many(self.fingerprints(1, 5001))
+        found = self.index.contains_many(self.fingerprints(1, 5001))
+        self.assertEqual(len(self.index), 1000)
+        self.assertFalse(found[:4000].any())
+        self.assertTrue(found[4000:].all())
+
+    def test_eviction_drops_oldest_entries_a_segment_at_a_time(self):
+        for start in range(1, 1001, 100):
+            self.index.add_many(self.fingerprints(start, start + 100))
+        self.now = 400  # a later time bucket
+        self.index.add_many(self.fingerprints(1001, 1101))
+        found = self.index.contains_many(self.fingerprints(1, 1101))
+        # 100 over capacity: at most one 62-entry segment more than that goes
+        self.assertGreaterEqual(len(self.index), 1000 - 1000 // 16)
+        self.assertLessEqual(len(self.index), 1000)
+        self.assertTrue(found[-200:].all())
+        self.assertFalse(found[:100].any())
+
+
+class CompactStoreTests(SimpleTestCase):
+    def test_store_keeps_the_newest_rows_of_a_larger_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'rows.xlsx')
+            write_nct_workbook(path, 3000, blocks=1, seed=5)
+            with dedup_store('compact', tmp, max_row_hashes=1000) as row_store:
+                for engine in ('python', 'pandas'):
+                    with self.subTest(engine=engine):
+                        row_store.reset()
+                        nct.process_excel_file(path, engine=engine)
+                        self.assertEqual(len(row_store.index), 1000)
+
+                # The pandas engine deduplicates all 3000 rows in one chunk, so the
+                # last 1000 are found before any row of the second run is added
+                report, _ = nct.process_excel_file(path, engine='pandas')
+                dedup = report['metadata']['deduplication_stats']
+                self.assertEqual(dedup['duplicate_rows_skipped'], 1000)
+
+XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/sharedStrings.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Лист1" sheetId="1" r:id="rId1"/></sheets></workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '<Relationship Id="rId2" Target="sharedStrings.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings"/>'
+        '<Relationship Id="rId3" Target="styles.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles"/>'
+        '</Relationships>'
+    ),
+    'xl/sharedStrings.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" count="5" uniqueCount="5">'
+        '<si><t>№</t></si>'
+        '<si><t>ФИО</t></si>'
+        '<si><t xml:space="preserve"> Абитуриент 1 </t></si>'
+        '<si><r><t>B044 - 031</t></r><r><rPr><b/></rPr><t xml:space="preserve">\nB063 - 421</t></r></si>'
+        '<si><t>Сирота, Инв</t></si>'
+        '</sst>'
+    ),
+    # Style 1 is a date, style 2 a date and time
+    'xl/styles.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<fonts count="1"><font/></fonts><fills count="1"><fill><patternFill patternType="none"/></fill></fills>'
+        '<borders count="1"><border/></borders>'
+        '<cellStyleXfs count="1"><xf/></cellStyleXfs>'
+        '<cellXfs count="3"><xf numFmtId="0"/><xf numFmtId="14" applyNumberFormat="1"/>'
+        '<xf numFmtId="22" applyNumberFormat="1"/></cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        '</styleSheet>'
+    ),
+    # The dimension is wider than the data, rows 3 and 5 are missing and cells are skipped
+    'xl/worksheets/sheet1.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<dimension ref="A1:I8"/><sheetData>'
+        '<row r="1"><c r="A1" t="s"><v>0</v></c><c r="B1" t="s"><v>1</v></c>'
+        '<c r="D1" t="inlineStr"><is><t>Код группы ОП</t></is></c></row>'
+        '<row r="2"><c r="A2"><v>1</v></c><c r="B2" t="s"><v>2</v></c><c r="C2"><v>3.5</v></c>'
+        '<c r="D2" s="1"><v>45000</v></c><c r="E2" t="b"><v>1</v></c><c r="F2" t="s"><v>3</v></c></row>'
+        '<row r="4"><c r="B4" t="inlineStr"><is><t>A &amp; B</t></is></c>'
+        '<c r="C4" t="str"><f>CONCAT("+","")</f><v>+</v></c><c r="G4" t="s"><v>4</v></c>'
+        '<c r="H4"><v>1E-3</v></c></row>'
+        '<row r="6"><c r="A6"><v>-2</v></c><c r="E6" s="2"><v>45000.5</v></c><c r="F6"/></row>'
+        '<row r="7"><c r="I7" t="inlineStr"><is><t xml:space="preserve">  </t></is></c></row>'
+        # Markup that only a real XML parser reads correctly
+        "<row r='8'><!-- <c r=\"A8\"><v>9</v></c> -->"
+        '<c r="A8"><f>IF(B8&lt;1,"&lt;c&gt;",C8&gt;2)</f><v>0</v></c>'
+        '<c r="B8" t="inlineStr"><is><t>Абиту</t><r><t>риент</t></r><r><rPr><b/></rPr><t> 8</t></r>'
+        '<rPh sb="0" eb="1"><t>ア</t></rPh></is></c>'
+        "<c r='C8' t='str'><v><![CDATA[<v>1</v> & 2]]></v></c>"
+        '<c r="D8" t="inlineStr"><is><t><![CDATA[x]]>y</t></is></c></row>'
+        '</sheetData></worksheet>'
+    ),
+}
+
+# The same sheet with an element the native reader does not know in row 4
+UNKNOWN_ROW_SHEET = XLSX_PARTS['xl/worksheets/sheet1.xml'].replace(
+    '<row r="4">', '<row r="4"><x:mark xmlns:x="urn:example"/>')
+
+
+class NativeReaderTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'cells.xlsx')
+        with zipfile.ZipFile(self.path, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for name, xml in XLSX_PARTS.items():
+                zf.writestr(name, xml)
+
+    def assertSameRows(self, path):
+        expected_workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        native_workbook = NativeWorkbook(path)
+        try:
+            for sheet_name in expected_workbook.sheetnames:
+                expected = list(expected_workbook[sheet_name].iter_rows(values_only=True))
+                actual = list(native_workbook[sheet_name].iter_rows(values_only=True))
+                self.assertEqual(actual, expected)
+                # 1 == 1.0 == True, so the types are compared as well
+                self.assertEqual([[type(value) for value in row] for row in actual],
+                                 [[type(value) for value in row] for row in expected])
+        finally:
+            expected_workbook.close()
+            native_workbook.close()
+
+    def test_cells_match_openpyxl(self):
+        self.assertSameRows(self.path)
+
+    def test_unknown_markup_falls_back_to_openpyxl(self):
+        path = os.path.join(os.path.dirname(self.path), 'unknown.xlsx')
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for name, xml in XLSX_PARTS.items():
+                zf.writestr(name, UNKNOWN_ROW_SHEET if name == 'xl/worksheets/sheet1.xml' else xml)
+        with self.assertLogs('stats.xlsx_reader', 'WARNING'):
+            self.assertSameRows(path)
+
+    def test_generated_workbook_matches_openpyxl(self):
+        path = os.path.join(os.path.dirname(self.path), 'generated.xlsx')
+        write_nct_workbook(path, 300, blocks=3, duplicate_ratio=0.1, seed=2, max_rows_per_sheet=150)
+        self.assertSameRows(path)
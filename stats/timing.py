@@ -0,0 +1,93 @@
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+_current_timer = ContextVar('nct_stage_timer', default=None)
+
+
+class StageTimer:
+    """
+    Wall time per pipeline stage, with nested stages timed exclusively.
+
+    The NCT pipeline is lazy: pulling a block's rows reads the workbook, and
+    aggregating a block pulls its rows, so stages interleave. The timer keeps
+    a stack of active stages; entering a stage pauses the one below it, so
+    each second is counted once, under the innermost stage.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.totals = {}
+        self._stack = []  # [stage, entered_at] pairs
+
+    def enter(self, stage):
+        now = time.perf_counter()
+        if self._stack:
+            parent = self._stack[-1]
+            self.totals[parent[0]] = self.totals.get(parent[0], 0.0) + now - parent[1]
+        self._stack.append([stage, now])
+
+    def exit(self):
+        now = time.perf_counter()
+        stage, entered_at = self._stack.pop()
+        self.totals[stage] = self.totals.get(stage, 0.0) + now - entered_at
+        if self._stack:
+            self._stack[-1][1] = now
+
+    @contextmanager
+    def stage(self, name):
+        self.enter(name)
+        try:
+            yield
+        finally:
+            self.exit()
+
+    def wrap(self, iterable, name):
+        """Yield from ``iterable``, timing each step under ``name``."""
+        iterator = iter(iterable)
+        enter, exit_ = self.enter, self.exit
+        while True:
+            enter(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                exit_()
+            yield item
+
+    def add(self, totals):
+        """Add stage totals measured elsewhere, e.g. in a pool worker."""
+        for stage, seconds in totals.items():
+            self.totals[stage] = self.totals.get(stage, 0.0) + seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def as_dict(self):
+        return {stage: round(seconds, 4) for stage, seconds in self.totals.items()}
+
+    @contextmanager
+    def activate(self):
+        """Make this the timer used by stage() and timed() in the current context."""
+        token = _current_timer.set(self)
+        try:
+            yield self
+        finally:
+            _current_timer.reset(token)
+
+
+def current_timer():
+    return _current_timer.get()
+
+
+def stage(name):
+    """Time a block of code under ``name`` if a timer is active, otherwise do nothing."""
+    timer = _current_timer.get()
+    return timer.stage(name) if timer is not None else nullcontext()
+
+
+def timed(iterable, name):
+    """Time the steps of an iterable under ``name`` if a timer is active."""
+    timer = _current_timer.get()
+    return timer.wrap(iterable, name) if timer is not None else iterable
@@ -1,12 +1,32 @@
 import os
+import logging
 import openpyxl
 import io
 import json
 from django.core.files.base import ContentFile
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 from datetime import datetime, timedelta
 import hashlib
+import itertools
+import tempfile
+from collections import namedtuple
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from stats.block_cache import write_blocks, read_blocks
+from stats.timing import StageTimer, current_timer, stage, timed
+from stats.xlsx_reader import NativeWorkbook, UnsupportedWorkbook
+from stats.csv_reader import is_delimited_file, iter_delimited_rows
+from stats.hash_store import SQLiteHashStore
+from stats.fingerprint_index import FingerprintIndex, fingerprints_from_hex
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
 
 class FileHashProcessor:
+    is_shared = False  # True when hashes are visible to other processes
+    
     def __init__(self, time_window_hours=24, max_file_hashes=1000):
         """
         Initialize the file hash processor to prevent duplicate file processing.
@@ -21,11 +41,17 @@ class FileHashProcessor:
         self.last_cleanup = datetime.now()
     
     def create_file_hash(self, file_path):
-        """Create hash of the entire file content."""
+        """Create hash of the entire file content, reading it in chunks."""
+        with stage("file_hash"):
+            return self._create_file_hash(file_path)
+
+    def _create_file_hash(self, file_path):
         try:
+            file_hash = hashlib.md5()
             with open(file_path, 'rb') as f:
-                file_content = f.read()
-                return hashlib.md5(file_content).hexdigest()
+                for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                    file_hash.update(chunk)
+            return file_hash.hexdigest()
         except Exception:
             # Fallback: hash file path and modification time
             stat = os.stat(file_path)
@@ -88,6 +114,8 @@ class FileHashProcessor:
         }
 
 class TimeHashProcessor:
+    is_shared = False  # True when hashes are visible to other processes
+    
     def __init__(self, time_window_hours=3, max_hashes=10000):
         """
         Initialize the hash processor with time window and memory limits.
@@ -101,20 +129,19 @@ class TimeHashProcessor:
         self.hash_timestamps = {}  # hash -> timestamp
         self.last_cleanup = datetime.now()
     
-    def create_row_hash(self, row, header_row=None):
-        """Create anonymous hash from personal data."""
-        # If header_row is provided, find indices
-        if header_row:
-            try:
-                iin_idx = header_row.index('ИИН')
-                fio_idx = header_row.index('ФИО')
-                cert_idx = header_row.index('№ сертификата')
-            except ValueError:
-                # If headers not found, use default positions
-                iin_idx, fio_idx, cert_idx = 6, 2, 11  # Based on sample data structure
-        else:
-            # Default positions based on sample data
-            iin_idx, fio_idx, cert_idx = 6, 2, 11
+    def create_row_hash(self, row, header_row=None, identity_columns=None):
+        """
+        Create anonymous hash from personal data.
+
+        Args:
+            row (list): Data row
+            header_row (list): Header of the row's block, to find the personal data columns in
+            identity_columns (tuple): (ИИН, ФИО, № сертификата) indices from a ColumnPlan,
+                used instead of looking them up in ``header_row``
+        """
+        if identity_columns is None:
+            identity_columns = find_identity_columns(tuple(header_row or ()))
+        iin_idx, fio_idx, cert_idx = identity_columns
         
         # Extract values safely
         iin = str(row[iin_idx] if iin_idx < len(row) else '')
@@ -134,6 +161,15 @@ class TimeHashProcessor:
         time_diff = datetime.now() - last_seen
         return time_diff <= self.time_window
     
+    def filter_recent(self, row_hashes):
+        """Return the subset of row_hashes seen recently within time window."""
+        return {h for h in row_hashes if self.is_hash_recent(h)}
+    
+    def add_hashes(self, row_hashes):
+        """Add several hashes with the current timestamp."""
+        for row_hash in row_hashes:
+            self.add_hash(row_hash)
+    
     def add_hash(self, row_hash):
         """Add hash with current timestamp."""
         current_time = datetime.now()
@@ -180,9 +216,232 @@ class TimeHashProcessor:
             "memory_usage_mb": len(self.hash_timestamps) * 0.0001  # Rough estimate
         }
 
+class SQLiteFileHashProcessor(FileHashProcessor):
+    """FileHashProcessor whose hashes live in a SQLite file shared by all processes."""
+    
+    is_shared = True
+    
+    def __init__(self, db_path, time_window_hours=24, max_file_hashes=1000, cleanup_interval_seconds=600):
+        super().__init__(time_window_hours=time_window_hours, max_file_hashes=max_file_hashes)
+        self.store = SQLiteHashStore(db_path, 'file_hashes')
+        self.cleanup_interval = timedelta(seconds=cleanup_interval_seconds)
+    
+    def is_file_recent(self, file_hash):
+        """Check if file was processed recently within time window."""
+        since = (datetime.now() - self.time_window).timestamp()
+        return file_hash in self.store.recent([file_hash], since)
+    
+    def add_file_hash(self, file_hash):
+        """Add file hash with current timestamp."""
+        self.store.add([file_hash], datetime.now().timestamp())
+        if datetime.now() - self.last_cleanup >= self.cleanup_interval:
+            self.cleanup_old_hashes()
+    
+    def cleanup_old_hashes(self):
+        """Remove expired file hashes, then the oldest ones beyond max_file_hashes."""
+        current_time = datetime.now()
+        self.store.delete_older_than((current_time - self.time_window).timestamp())
+        self.store.trim(self.max_file_hashes)
+        self.last_cleanup = current_time
+    
+    def reset(self):
+        """Reset the file hash processor - clear all stored hashes."""
+        self.store.clear()
+        self.last_cleanup = datetime.now()
+    
+    def get_stats(self):
+        """Get current statistics."""
+        return {
+            "total_file_hashes": self.store.count(),
+            "max_file_hashes": self.max_file_hashes,
+            "time_window_hours": self.time_window.total_seconds() / 3600,
+            "last_cleanup": self.last_cleanup.isoformat(),
+            "store_size_mb": round(self.store.size_bytes() / (1024 * 1024), 3)
+        }
+
+class SQLiteTimeHashProcessor(TimeHashProcessor):
+    """
+    TimeHashProcessor whose hashes live in a SQLite file shared by all processes.
+
+    Expired hashes are deleted every ``cleanup_interval_seconds`` rather than on
+    every insert; lookups ignore them in the meantime. Use filter_recent and
+    add_hashes to deduplicate a whole batch of rows with one query each.
+    """
+    
+    is_shared = True
+    
+    def __init__(self, db_path, time_window_hours=3, max_hashes=10000, cleanup_interval_seconds=600):
+        super().__init__(time_window_hours=time_window_hours, max_hashes=max_hashes)
+        self.store = SQLiteHashStore(db_path, 'row_hashes')
+        self.cleanup_interval = timedelta(seconds=cleanup_interval_seconds)
+    
+    def is_hash_recent(self, row_hash):
+        """Check if hash was seen recently within time window."""
+        return bool(self.filter_recent([row_hash]))
+    
+    def filter_recent(self, row_hashes):
+        """Return the subset of row_hashes seen recently within time window."""
+        since = (datetime.now() - self.time_window).timestamp()
+        return self.store.recent(row_hashes, since)
+    
+    def add_hash(self, row_hash):
+        """Add hash with current timestamp."""
+        self.add_hashes([row_hash])
+    
+    def add_hashes(self, row_hashes):
+        """Add several hashes with the current timestamp in one transaction."""
+        self.store.add(row_hashes, datetime.now().timestamp())
+        if datetime.now() - self.last_cleanup >= self.cleanup_interval:
+            self.cleanup_old_hashes()
+    
+    def cleanup_old_hashes(self):
+        """Remove expired hashes, then the oldest ones beyond max_hashes."""
+        current_time = datetime.now()
+        self.store.delete_older_than((current_time - self.time_window).timestamp())
+        self.store.trim(self.max_hashes)
+        self.last_cleanup = current_time
+    
+    def reset(self):
+        """Reset the hash processor - clear all stored hashes."""
+        self.store.clear()
+        self.last_cleanup = datetime.now()
+    
+    def get_stats(self):
+        """Get current statistics."""
+        return {
+            "total_hashes": self.store.count(),
+            "max_hashes": self.max_hashes,
+            "time_window_hours": self.time_window.total_seconds() / 3600,
+            "last_cleanup": self.last_cleanup.isoformat(),
+            "store_size_mb": round(self.store.size_bytes() / (1024 * 1024), 3)
+        }
+
+class CompactTimeHashProcessor(TimeHashProcessor):
+    """
+    TimeHashProcessor backed by a FingerprintIndex instead of a dict.
+
+    Each row hash is kept as a 64-bit fingerprint in sorted numpy arrays with
+    per-bucket integer timestamps (about 9 bytes per row with the Bloom
+    filter), and expiry and eviction are O(1) amortized, so tens of millions
+    of rows fit in a few hundred MB. Recency is tracked to
+    window / bucket_count rather than to the second.
+    """
+    
+    def __init__(self, time_window_hours=3, max_hashes=10000, bucket_count=16, bloom_bits_per_entry=10):
+        super().__init__(time_window_hours=time_window_hours, max_hashes=max_hashes)
+        self.hash_timestamps = None  # unused, fingerprints live in the index
+        self.index = FingerprintIndex(
+            self.time_window.total_seconds(), max_hashes,
+            bucket_count=bucket_count, bloom_bits_per_entry=bloom_bits_per_entry
+        )
+    
+    def is_hash_recent(self, row_hash):
+        """Check if hash was seen recently within time window."""
+        return bool(self.filter_recent([row_hash]))
+    
+    def filter_recent(self, row_hashes):
+        """Return the subset of row_hashes seen recently within time window."""
+        row_hashes = list(row_hashes)
+        if not row_hashes:
+            return set()
+        found = self.index.contains_many(fingerprints_from_hex(row_hashes))
+        return {h for h, hit in zip(row_hashes, found) if hit}
+    
+    def add_hash(self, row_hash):
+        """Add hash with current timestamp."""
+        self.add_hashes([row_hash])
+    
+    def add_hashes(self, row_hashes):
+        """Add several hashes with the current timestamp."""
+        row_hashes = list(row_hashes)
+        if row_hashes:
+            self.index.add_many(fingerprints_from_hex(row_hashes))
+    
+    def cleanup_old_hashes(self):
+        """Remove hashes older than time window."""
+        self.index.expire()
+        self.last_cleanup = datetime.now()
+    
+    def reset(self):
+        """Reset the hash processor - clear all stored hashes."""
+        self.index.reset()
+        self.last_cleanup = datetime.now()
+    
+    def get_stats(self):
+        """Get current statistics."""
+        return {
+            "total_hashes": len(self.index),
+            "max_hashes": self.max_hashes,
+            "time_window_hours": self.time_window.total_seconds() / 3600,
+            "last_cleanup": self.last_cleanup.isoformat(),
+            "memory_usage_mb": round(self.index.memory_bytes() / (1024 * 1024), 3)
+        }
+
+class LocalRowHashes(TimeHashProcessor):
+    """Row hashes of a single parse, kept in a set that never expires and no other process sees."""
+
+    def __init__(self):
+        super().__init__()
+        self.hash_timestamps = None  # unused, hashes live in a set
+        self.hashes = set()
+
+    def filter_recent(self, row_hashes):
+        """Return the subset of row_hashes added before."""
+        return self.hashes.intersection(row_hashes)
+
+    def is_hash_recent(self, row_hash):
+        return row_hash in self.hashes
+
+    def add_hash(self, row_hash):
+        self.hashes.add(row_hash)
+
+    def add_hashes(self, row_hashes):
+        self.hashes.update(row_hashes)
+
+    def cleanup_old_hashes(self):
+        self.last_cleanup = datetime.now()
+
+    def reset(self):
+        self.hashes.clear()
+        self.last_cleanup = datetime.now()
+
+    def get_stats(self):
+        return {"total_hashes": len(self.hashes)}
+
+def create_hash_processors():
+    """
+    Build the global (file, row) hash processors from settings.
+
+    NCT_DEDUP_STORE = 'sqlite' shares hashes between processes through the
+    NCT_DEDUP_DB file; 'memory' (the default, and the fallback outside
+    Django) keeps them in per-process dicts; 'compact' keeps row hashes in a
+    per-process FingerprintIndex sized by NCT_DEDUP_MAX_ROW_HASHES.
+    """
+    try:
+        store = getattr(settings, 'NCT_DEDUP_STORE', 'memory')
+        db_path = getattr(settings, 'NCT_DEDUP_DB', None)
+        max_row_hashes = getattr(settings, 'NCT_DEDUP_MAX_ROW_HASHES', 10000)
+    except ImproperlyConfigured:
+        store, db_path, max_row_hashes = 'memory', None, 10000
+    if store == 'sqlite':
+        return (
+            SQLiteFileHashProcessor(db_path, time_window_hours=24, max_file_hashes=1000),
+            SQLiteTimeHashProcessor(db_path, time_window_hours=3, max_hashes=max_row_hashes)
+        )
+    if store == 'compact':
+        return (
+            FileHashProcessor(time_window_hours=24, max_file_hashes=1000),
+            CompactTimeHashProcessor(time_window_hours=3, max_hashes=max_row_hashes)
+        )
+    if store != 'memory':
+        raise ImproperlyConfigured(f"Unknown NCT_DEDUP_STORE {store!r}, expected 'memory', 'sqlite' or 'compact'")
+    return (
+        FileHashProcessor(time_window_hours=24, max_file_hashes=1000),
+        TimeHashProcessor(time_window_hours=3, max_hashes=max_row_hashes)
+    )
+
 # Global processor instances
-file_hash_processor = FileHashProcessor(time_window_hours=24, max_file_hashes=1000)
-hash_processor = TimeHashProcessor(time_window_hours=3, max_hashes=10000)
+file_hash_processor, hash_processor = create_hash_processors()
 
 def reset_file_hash_processor():
     """Reset the file hash processor for testing purposes."""
@@ -191,126 +450,437 @@ def reset_file_hash_processor():
 def is_xlsx_file(file_path):
     return file_path.lower().endswith('.xlsx')
 
-def parse_nct_blocks_correct_header(file_path):
-    wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
-    ws = wb.active
-    rows = list(ws.iter_rows(values_only=True))
-    i = 0
-    results = []
-    while i < len(rows):
-        row = rows[i]
-        if any(cell and "Национальный Центр Тестирования" in str(cell) for cell in row):
-            # Find the first header row with "Код группы ОП"
-            j = i + 1
-            categories = None
-            header_row = None
-            while j < len(rows):
-                header_row = rows[j]
-                if header_row and "Код группы ОП" in [str(c).strip() if c else "" for c in header_row]:
-                    # Now, look for the next non-empty row (the ab-categories row)
-                    k = j + 1
-                    while k < len(rows) and not any(rows[k]):
-                        k += 1
-                    if k < len(rows):
-                        categories = [c for c in rows[k]]
-                        j = k + 1
-                    else:
-                        categories = [c for c in header_row]
-                        j += 1
-                    break
-                j += 1
-            # Now j is at the first data row
-            data = []
-            while j < len(rows):
-                next_row = rows[j]
-                if any(cell and "Национальный Центр Тестирования" in str(cell) for cell in next_row):
-                    break
-                if any(next_row):  # skip empty rows
-                    data.append([c for c in next_row])
-                j += 1
-            results.append({
-                "nct_row": i + 1,
-                "categories": categories if categories else [],
-                "header_row": header_row if header_row else [],
-                "data": data
-            })
-            i = j
+def is_supported_file(file_path):
+    """Whether the file is an .xlsx workbook or a CSV/TSV export the parser can read."""
+    return is_xlsx_file(file_path) or is_delimited_file(file_path)
+
+UNSUPPORTED_FILE_ERROR = "Not an Excel, CSV or TSV file"
+
+NCT_BANNER = "Национальный Центр Тестирования"
+NCT_HEADER_MARKER = "Код группы ОП"
+NCT_SNIFF_ROWS = 300  # rows read to decide whether a file is NCT at all
+NCT_PARSER_VERSION = 1  # bump whenever the parsed block output changes, invalidates BlockCache
+
+def is_nct_banner_row(row):
+    return any(cell and NCT_BANNER in str(cell) for cell in row)
+
+def is_nct_header_row(row):
+    return bool(row) and NCT_HEADER_MARKER in [str(c).strip() if c else "" for c in row]
+
+class _RowStream:
+    """Row iterator with one row of push-back, numbered from 1 like Excel."""
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._pushed = None
+        self.row_number = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._pushed is not None:
+            row, self._pushed = self._pushed, None
         else:
-            i += 1
-    return results
+            row = next(self._rows)
+        self.row_number += 1
+        return row
+
+    def push_back(self, row):
+        self._pushed = row
+        self.row_number -= 1
+
+def iter_nct_blocks_from_rows(rows, sheet_name=""):
+    """
+    Yield NCT blocks from an iterable of row tuples without materializing it.
+
+    Each yielded block has the same keys as the dicts returned by
+    parse_nct_blocks_correct_header, except that ``data`` is a generator
+    reading data rows lazily from the shared row iterator. ``sheet_name`` is
+    recorded on every block ("" for CSV files and unnamed sheets). Rows of a block
+    that the consumer leaves unread are skipped before the next block is
+    searched for, so blocks must be consumed in order.
+    """
+    stream = _RowStream(rows)
+    for row in stream:
+        if not is_nct_banner_row(row):
+            continue
+        nct_row = stream.row_number
+        # Find the first header row with "Код группы ОП"
+        categories = None
+        header_row = None
+        for header_row in stream:
+            if is_nct_header_row(header_row):
+                # Now, look for the next non-empty row (the ab-categories row)
+                for next_row in stream:
+                    if any(next_row):
+                        categories = [c for c in next_row]
+                        break
+                else:
+                    categories = [c for c in header_row]
+                break
+        # The stream is now at the first data row
+        data = timed(_iter_block_data(stream), "block_detection")
+        yield {
+            "sheet_name": sheet_name,
+            "nct_row": nct_row,
+            "categories": categories if categories else [],
+            "header_row": header_row if header_row else [],
+            "data": data
+        }
+        # Drain whatever the consumer did not read so the next banner is found
+        for _ in data:
+            pass
+
+def _iter_block_data(stream):
+    for next_row in stream:
+        if is_nct_banner_row(next_row):
+            stream.push_back(next_row)
+            return
+        if any(next_row):  # skip empty rows
+            yield [c for c in next_row]
+
+def _close_workbook_after(wb, iterator):
+    try:
+        yield from iterator
+    finally:
+        wb.close()
+
+XLSX_READERS = ("openpyxl", "native")
+
+def open_workbook(file_path, reader=None):
+    """
+    Open a workbook read-only with the reader named by NCT_XLSX_READER.
+
+    'native' (stats.xlsx_reader) yields the same rows as openpyxl about twice
+    as fast; a workbook it cannot read is opened with openpyxl instead.
+    """
+    reader = reader or getattr(settings, 'NCT_XLSX_READER', 'openpyxl')
+    if reader not in XLSX_READERS:
+        raise ImproperlyConfigured(f"Unknown NCT_XLSX_READER {reader!r}, expected one of {XLSX_READERS}")
+    with stage("workbook_open"):
+        if reader == "native":
+            try:
+                return NativeWorkbook(file_path)
+            except UnsupportedWorkbook as e:
+                logger.warning("Native reader cannot read %s, using openpyxl: %s", file_path, e)
+        return openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+
+ALL_SHEETS = "*"  # NCT_SHEETS value that parses every sheet of a workbook
+
+def select_sheet_names(wb, sheet_names=None):
+    """
+    Return the sheets to parse: the active sheet by default, every sheet for
+    ALL_SHEETS, otherwise the requested sheets that exist in the workbook.
+    """
+    if sheet_names is None:
+        return [wb.active.title] if wb.active is not None else []
+    if sheet_names == ALL_SHEETS:
+        return list(wb.sheetnames)
+    return [name for name in sheet_names if name in wb.sheetnames]
+
+def iter_workbook_rows(file_path, sheet_name=None, reader=None):
+    """
+    Yield value tuples from a sheet (the active one by default), closing the workbook when done.
+
+    CSV and TSV files have a single unnamed sheet and are streamed as they are.
+    """
+    if is_delimited_file(file_path):
+        return timed(iter_delimited_rows(file_path), "row_iteration")
+    wb = open_workbook(file_path, reader)
+    ws = wb[sheet_name] if sheet_name else wb.active
+    return _close_workbook_after(wb, timed(ws.iter_rows(values_only=True), "row_iteration"))
+
+def iter_nct_blocks(file_path, sheet_name=None):
+    """Stream NCT blocks from a sheet of a workbook, one row at a time."""
+    rows = iter_workbook_rows(file_path, sheet_name)
+    try:
+        yield from iter_nct_blocks_from_rows(rows, sheet_name or "")
+    finally:
+        rows.close()
+
+def parse_nct_blocks_correct_header(file_path, sheet_name=None):
+    """Parse all NCT blocks into memory. Prefer iter_nct_blocks for large files."""
+    return [dict(block, data=list(block["data"])) for block in iter_nct_blocks(file_path, sheet_name)]
+
+def sniff_nct_rows(rows):
+    """Check whether the given rows contain at least one NCT block with categories."""
+    return any(block['categories'] for block in iter_nct_blocks_from_rows(rows))
+
+def sniff_nct_head(rows, sniff_rows=NCT_SNIFF_ROWS):
+    """
+    Sniff a sheet for NCT blocks, buffering its first ``sniff_rows`` rows.
+
+    Returns (is_nct, head) where ``head`` is the buffered rows, to be replayed
+    in front of what is left of ``rows``. When the head holds no NCT block the
+    rest of the sheet is scanned as well, as the first banner can come later;
+    ``head`` is None then, ``rows`` is used up and the sheet has to be read
+    again.
+    """
+    head = list(itertools.islice(rows, sniff_rows))
+    if sniff_nct_rows(head):
+        return True, head
+    if sniff_rows is None or len(head) < sniff_rows:
+        return False, head
+    return sniff_nct_rows(itertools.chain(head, rows)), None
 
 def is_nct_excel(file_path):
     """Check if the Excel file contains at least one NCT block with categories."""
     try:
-        blocks = parse_nct_blocks_correct_header(file_path)
-        return bool(blocks and any(block['categories'] for block in blocks))
+        rows = iter_workbook_rows(file_path)
+        try:
+            return sniff_nct_rows(rows)
+        finally:
+            rows.close()
     except Exception:
         return False
 
-def generate_custom_report(blocks):
-    ab_categories = {"АБ", "АГП", "ТиПО", "О, КНП, ИК, СС", "Сир", "Инв", "ВОВ", "Отл", "Село", "Кандас", "Многод. семья", "Неполная семья", "Семьи с инв."}
-    quota_counts = {cat: 0 for cat in ab_categories}
-    specialization_counts = {}
-    prim_counts = {}  # For Примечание values
-    
-    # Metadata tracking
-    from datetime import datetime
-    start_time = datetime.now()
-    
-    metadata = {
-        "total_rows_processed": 0,
-        "rows_with_quotas": 0,
-        "rows_with_specializations": 0,
-        "rows_with_prim": 0,
-        "blocks_processed": len(blocks),
-        "processing_start": start_time.isoformat(),
-        "processing_end": None,
-        "processing_duration_seconds": None,
-        "deduplication_stats": {
-            "duplicate_rows_skipped": 0,
-            "unique_rows_processed": 0,
-            "hash_processor_stats": None
-        },
-        "file_hash_stats": None
-    }
-    
-    for block in blocks:
-        cats = block['categories']
-        header_row = block.get('header_row', [])
-        # Find all indices for each ab-category
-        ab_indices = {cat: [i for i, c in enumerate(cats) if c == cat] for cat in ab_categories}
-        # Find index for Примечание in header row
+def load_nct_workbook(file_path, file_hash=None, sniff_rows=NCT_SNIFF_ROWS, sheet_names=None):
+    """
+    Validate, fingerprint and open an NCT workbook with a single parse.
+
+    The first ``sniff_rows`` rows are buffered to decide whether the file is
+    NCT at all and then replayed in front of the rest of the sheet, so every
+    row is read from the workbook exactly once. Only a sheet whose first block
+    starts past those rows is read twice, see sniff_nct_head. ``file_hash`` can be passed in
+    when the caller has already hashed the upload.
+
+    ``sheet_names`` selects the sheets to parse: the active one by default,
+    ALL_SHEETS for every sheet, or a list of names. When
+    more than one sheet is selected the workbook is only sniffed and closed,
+    ``blocks`` is None and the sheets are meant to be parsed with
+    generate_multi_sheet_report. CSV and TSV files are one sheet with no
+    name, ``sheet_names`` does not apply to them.
+
+    Returns:
+        tuple: ({"file_hash": str, "sheet_names": list, "blocks": iterator or None}, None)
+        or (None, error)
+    """
+    if not is_supported_file(file_path):
+        return None, UNSUPPORTED_FILE_ERROR
+    not_nct_error = "File does not match expected NCT pattern"
+    if is_delimited_file(file_path):
+        return _load_nct_delimited(file_path, file_hash, sniff_rows, not_nct_error)
+    try:
+        wb = open_workbook(file_path)
+    except Exception:
+        return None, not_nct_error
+    blocks = None
+    try:
+        sheets = select_sheet_names(wb, sheet_names)
+        if len(sheets) > 1:
+            is_nct = any(
+                sniff_nct_head(wb[name].iter_rows(values_only=True), sniff_rows)[0]
+                for name in sheets
+            )
+            wb.close()
+        elif sheets:
+            ws = wb[sheets[0]]
+            rows = timed(ws.iter_rows(values_only=True), "row_iteration")
+            is_nct, head = sniff_nct_head(rows, sniff_rows)
+            if is_nct and head is None:
+                rows.close()
+                head, rows = [], timed(ws.iter_rows(values_only=True), "row_iteration")
+            if is_nct:
+                blocks = _close_workbook_after(wb, iter_nct_blocks_from_rows(itertools.chain(head, rows), sheets[0]))
+        else:
+            is_nct = False
+    except Exception:
+        is_nct = False
+    if not is_nct:
+        wb.close()
+        return None, not_nct_error
+    if file_hash is None:
+        file_hash = file_hash_processor.create_file_hash(file_path)
+    return {
+        "file_hash": file_hash,
+        "sheet_names": sheets,
+        "blocks": blocks
+    }, None
+
+def _load_nct_delimited(file_path, file_hash, sniff_rows, not_nct_error):
+    rows = iter_workbook_rows(file_path)
+    try:
+        is_nct, head = sniff_nct_head(rows, sniff_rows)
+    except Exception:
+        is_nct = False
+    if not is_nct:
+        rows.close()
+        return None, not_nct_error
+    if head is None:
+        rows.close()
+        head, rows = [], iter_workbook_rows(file_path)
+    if file_hash is None:
+        file_hash = file_hash_processor.create_file_hash(file_path)
+    return {
+        "file_hash": file_hash,
+        "sheet_names": [],
+        "blocks": iter_nct_blocks_from_rows(itertools.chain(head, rows))
+    }, None
+
+AB_CATEGORIES = {"АБ", "АГП", "ТиПО", "О, КНП, ИК, СС", "Сир", "Инв", "ВОВ", "Отл", "Село", "Кандас", "Многод. семья", "Неполная семья", "Семьи с инв."}
+
+# Metadata counters that are summed when partial reports are merged
+REPORT_COUNTERS = ("total_rows_processed", "rows_with_quotas", "rows_with_specializations", "rows_with_prim", "blocks_processed")
+DEDUP_COUNTERS = ("duplicate_rows_skipped", "unique_rows_processed")
+DEDUP_BATCH_ROWS = 1000  # rows deduplicated per hash store lookup
+DEFAULT_IDENTITY_COLUMNS = (6, 2, 11)  # ИИН, ФИО, № сертификата positions in the sample data
+
+# Column indices a block's rows are read with, compiled once per header
+ColumnPlan = namedtuple("ColumnPlan", [
+    "identity_columns",  # (ИИН, ФИО, № сертификата) indices for the row hash
+    "quota_columns",  # (index, ab-category) of every quota column, in column order
+    "prim_idx",  # Примечание column, or None
+    "specialization_idx",  # "Код группы ОП" column, checked before the rest of the row, or None
+])
+
+@lru_cache(maxsize=256)
+def find_identity_columns(header_row):
+    """Return the (ИИН, ФИО, № сертификата) indices of a header tuple, or the default positions."""
+    try:
+        return header_row.index('ИИН'), header_row.index('ФИО'), header_row.index('№ сертификата')
+    except ValueError:
+        # An empty header or one without these columns
+        return DEFAULT_IDENTITY_COLUMNS
+
+@lru_cache(maxsize=256)
+def compile_column_plan(header_row, categories):
+    """
+    Resolve a block's header and ab-category rows into a ColumnPlan.
+
+    Memoized on the two rows, passed as tuples, so the blocks of every file
+    sharing a header compile it once per process.
+    """
+    def index(value):
         try:
-            prim_idx = header_row.index("Примечание")
+            return header_row.index(value)
         except ValueError:
-            prim_idx = None
-        for row in block['data']:
-            metadata["total_rows_processed"] += 1
-            
-            # Create row hash for deduplication
-            row_hash = hash_processor.create_row_hash(row, header_row)
-            
-            # Check if this row is a duplicate
-            if hash_processor.is_hash_recent(row_hash):
-                metadata["deduplication_stats"]["duplicate_rows_skipped"] += 1
-                continue  # Skip this row
-            
-            # Process unique row
-            metadata["deduplication_stats"]["unique_rows_processed"] += 1
-            hash_processor.add_hash(row_hash)
-            
+            return None
+
+    return ColumnPlan(
+        identity_columns=find_identity_columns(header_row),
+        quota_columns=tuple((i, cat) for i, cat in enumerate(categories) if cat in AB_CATEGORIES),
+        prim_idx=index("Примечание"),
+        specialization_idx=index(NCT_HEADER_MARKER),
+    )
+
+def get_column_plan(block):
+    return compile_column_plan(tuple(block.get('header_row') or ()), tuple(block['categories']))
+
+MAX_SPECIALIZATION_CHOICES = 4  # an applicant lists up to four "code - university" choices
+
+def get_specialization_settings():
+    """
+    Return (university code, choices) from NCT_UNIVERSITY_CODE and NCT_SPECIALIZATION_CHOICES.
+
+    The university's first choices fill specialization_counts; the first
+    ``choices`` choices of every row go into the specialization matrix.
+    """
+    university = str(getattr(settings, 'NCT_UNIVERSITY_CODE', '421'))
+    choices = getattr(settings, 'NCT_SPECIALIZATION_CHOICES', 1)
+    if not 1 <= choices <= MAX_SPECIALIZATION_CHOICES:
+        raise ImproperlyConfigured(
+            f"NCT_SPECIALIZATION_CHOICES must be between 1 and {MAX_SPECIALIZATION_CHOICES}, got {choices!r}"
+        )
+    return university, choices
+
+def merge_specialization_matrix(matrix, other):
+    """Add the counts of ``other`` into ``matrix``, both {choice: {university: {specialization: count}}}."""
+    for choice, universities in other.items():
+        target = matrix.setdefault(choice, {})
+        for univ, specs in universities.items():
+            counts = target.setdefault(univ, {})
+            for spec, count in specs.items():
+                counts[spec] = counts.get(spec, 0) + count
+    return matrix
+
+class ReportBuilder:
+    """
+    Accumulates the custom report over NCT blocks.
+
+    Blocks can be added one at a time, and partial results computed elsewhere
+    (for example in a worker process parsing another sheet) can be merged in
+    before the final report is built.
+    """
+
+    def __init__(self, file_hash=None, collect_hashes=False, previous_rows=None, record_rows=False,
+                 row_store=None):
+        """
+        Args:
+            file_hash (str): Hash of the source file, recorded in the metadata
+            collect_hashes (bool): Keep the row hashes added to the row store so
+                they can be replayed into another process by merge()
+            previous_rows (set): 64-bit row fingerprints (see fingerprints_from_hex) of
+                the file's previous version, never counted as duplicates
+            record_rows (bool): Keep the hash of every row read in ``seen_row_hashes``,
+                duplicates included
+            row_store (TimeHashProcessor): Where rows are deduplicated, hash_processor by default
+        """
+        self.quota_counts = {cat: 0 for cat in AB_CATEGORIES}
+        self.specialization_counts = {}
+        self.university, self.specialization_choices = get_specialization_settings()
+        # choice number ("1".."4") -> university -> specialization -> count, for every university
+        self.specialization_matrix = {str(choice): {} for choice in range(1, self.specialization_choices + 1)}
+        self.prim_counts = {}  # For Примечание values
+        self.row_hashes = [] if collect_hashes else None
+        self.previous_rows = previous_rows
+        self.seen_row_hashes = [] if record_rows else None
+        self.row_store = row_store if row_store is not None else hash_processor
+        self.start_time = datetime.now()
+        self.metadata = {
+            "total_rows_processed": 0,
+            "rows_with_quotas": 0,
+            "rows_with_specializations": 0,
+            "rows_with_prim": 0,
+            "blocks_processed": 0,
+            "processing_start": self.start_time.isoformat(),
+            "processing_end": None,
+            "processing_duration_seconds": None,
+            "deduplication_stats": {
+                "duplicate_rows_skipped": 0,
+                "unique_rows_processed": 0,
+                "hash_processor_stats": None
+            },
+            "file_hash": file_hash,
+            "file_hash_stats": None
+        }
+
+    def add_blocks(self, blocks):
+        # Time spent pulling a block's rows is counted under their own stages, not aggregation
+        for block in timed(blocks, "block_detection"):
+            with stage("aggregation"):
+                self.add_block(block)
+        return self
+
+    def add_block(self, block):
+        metadata = self.metadata
+        quota_counts = self.quota_counts
+        specialization_counts = self.specialization_counts
+        prim_counts = self.prim_counts
+        university = self.university
+        choice_counts = list(self.specialization_matrix.values())
+
+        metadata["blocks_processed"] += 1
+        plan = get_column_plan(block)
+        quota_columns = plan.quota_columns
+        prim_idx = plan.prim_idx
+        spec_idx = plan.specialization_idx
+        # Rows seen recently are dropped here, a batch at a time
+        for row in self.iter_new_rows(block['data'], plan):
+            row_length = len(row)
             # Track quota rows
             has_quota = False
-            for cat, indices in ab_indices.items():
-                for idx in indices:
-                    if idx < len(row) and row[idx] and str(row[idx]).strip() == "+":
+            for idx, cat in quota_columns:
+                if idx < row_length:
+                    val = row[idx]
+                    if val and str(val).strip() == "+":
                         quota_counts[cat] += 1
                         has_quota = True
             if has_quota:
                 metadata["rows_with_quotas"] += 1
             
             # Track Примечание rows
-            if prim_idx is not None and prim_idx < len(row):
+            if prim_idx is not None and prim_idx < row_length:
                 val = row[prim_idx]
                 if isinstance(val, str) and val.strip():
                     metadata["rows_with_prim"] += 1
@@ -321,59 +891,394 @@ def generate_custom_report(blocks):
             
             # Track specialization rows
             has_specialization = False
-            for idx, cell in enumerate(row):
-                if isinstance(cell, str) and " - " in cell and "\n" in cell:
-                    # This looks like specialization data
-                    lines = cell.split('\n')
-                    for line in lines:
-                        line = line.strip()
-                        if " - " in line:
-                            spec, univ = line.split(" - ")
-                            spec = spec.strip()
-                            univ = univ.strip()
-                            if univ == "421":  # KBTU
-                                specialization_counts[spec] = specialization_counts.get(spec, 0) + 1
-                                has_specialization = True
-                            break  # Only count the first choice
-                    break  # Only process the first specialization cell found
+            # Specialization data has " - " and a line break; the "Код группы ОП" cell is
+            # checked first and the rest of the row only if it holds none
+            cell = row[spec_idx] if spec_idx is not None and spec_idx < row_length else None
+            if not (isinstance(cell, str) and " - " in cell and "\n" in cell):
+                cell = next((value for value in row if isinstance(value, str) and " - " in value and "\n" in value),
+                            None)
+            if cell is not None:
+                # One choice per line
+                lines = cell.split('\n')
+                choice = 0
+                for line in lines:
+                    line = line.strip()
+                    if " - " in line:
+                        spec, univ = line.split(" - ")
+                        spec = spec.strip()
+                        univ = univ.strip()
+                        if choice == 0 and univ == university:
+                            specialization_counts[spec] = specialization_counts.get(spec, 0) + 1
+                            has_specialization = True
+                        counts = choice_counts[choice].setdefault(univ, {})
+                        counts[spec] = counts.get(spec, 0) + 1
+                        choice += 1
+                        if choice == len(choice_counts):
+                            break  # Later choices are not counted
             if has_specialization:
                 metadata["rows_with_specializations"] += 1
-    
-    if prim_counts:
-        quota_counts["Примечание"] = prim_counts
-    
-    # Calculate processing duration
-    end_time = datetime.now()
-    duration = (end_time - start_time).total_seconds()
-    
-    metadata["processing_end"] = end_time.isoformat()
-    metadata["processing_duration_seconds"] = round(duration, 3)
-    
-    # Add hash processor stats
-    metadata["deduplication_stats"]["hash_processor_stats"] = hash_processor.get_stats()
-    
-    # Add file hash processor stats
-    metadata["file_hash_stats"] = file_hash_processor.get_stats()
-    
+
+    def filter_new_rows(self, rows, plan):
+        """
+        Deduplicate a batch of rows against the row store and record the new ones.
+
+        The batch is looked up with one filter_recent call and stored with one
+        add_hashes call; a row repeated inside the batch counts as a duplicate
+        exactly as it would row by row.
+        """
+        with stage("dedup"):
+            dedup = self.metadata["deduplication_stats"]
+            create_row_hash = hash_processor.create_row_hash
+            identity_columns = plan.identity_columns
+            row_hashes = [create_row_hash(row, identity_columns=identity_columns) for row in rows]
+            recent = self.row_store.filter_recent(row_hashes)
+            if self.previous_rows and recent:
+                # A revised file replaces its previous version, whose rows are not duplicates
+                recent = {h for h in recent if int(h[:16], 16) not in self.previous_rows}
+            if self.seen_row_hashes is not None:
+                self.seen_row_hashes.extend(row_hashes)
+            new_rows = []
+            new_hashes = []
+            seen = set()
+            for row, row_hash in zip(rows, row_hashes):
+                if row_hash in recent or row_hash in seen:
+                    dedup["duplicate_rows_skipped"] += 1
+                    continue
+                seen.add(row_hash)
+                new_rows.append(row)
+                new_hashes.append(row_hash)
+            dedup["unique_rows_processed"] += len(new_rows)
+            self.row_store.add_hashes(new_hashes)
+            if self.row_hashes is not None:
+                self.row_hashes.extend(new_hashes)
+            return new_rows
+
+    def iter_new_rows(self, rows, plan):
+        """Yield the rows not seen recently, deduplicating DEDUP_BATCH_ROWS rows per lookup."""
+        rows = iter(rows)
+        while True:
+            batch = list(itertools.islice(rows, DEDUP_BATCH_ROWS))
+            if not batch:
+                return
+            self.metadata["total_rows_processed"] += len(batch)
+            yield from self.filter_new_rows(batch, plan)
+
+    def partial(self):
+        """Return the picklable counts accumulated so far, for merge() in another builder."""
+        dedup = self.metadata["deduplication_stats"]
+        timer = current_timer()
+        return {
+            "stage_timings": dict(timer.totals) if timer is not None else {},
+            "quota_counts": self.quota_counts,
+            "prim_counts": self.prim_counts,
+            "specialization_counts": self.specialization_counts,
+            "specialization_matrix": self.specialization_matrix,
+            "counters": {key: self.metadata[key] for key in REPORT_COUNTERS},
+            "dedup_counters": {key: dedup[key] for key in DEDUP_COUNTERS},
+            "row_hashes": self.row_hashes or []
+        }
+
+    def merge(self, partial):
+        """Add the counts of a partial() result and replay its row hashes into the row store."""
+        for cat, count in partial["quota_counts"].items():
+            self.quota_counts[cat] = self.quota_counts.get(cat, 0) + count
+        for item, count in partial["prim_counts"].items():
+            self.prim_counts[item] = self.prim_counts.get(item, 0) + count
+        for spec, count in partial["specialization_counts"].items():
+            self.specialization_counts[spec] = self.specialization_counts.get(spec, 0) + count
+        merge_specialization_matrix(self.specialization_matrix, partial.get("specialization_matrix", {}))
+        for key, count in partial["counters"].items():
+            self.metadata[key] += count
+        dedup = self.metadata["deduplication_stats"]
+        for key, count in partial["dedup_counters"].items():
+            dedup[key] += count
+        self.row_store.add_hashes(partial["row_hashes"])
+        timer = current_timer()
+        if timer is not None:
+            # Worker stage times add up across processes, so they can exceed the wall time
+            timer.add(partial.get("stage_timings", {}))
+        return self
+
+    def build(self):
+        quota_counts = dict(self.quota_counts)
+        if self.prim_counts:
+            quota_counts["Примечание"] = self.prim_counts
+        
+        # Calculate processing duration
+        end_time = datetime.now()
+        duration = (end_time - self.start_time).total_seconds()
+        
+        metadata = self.metadata
+        metadata["processing_end"] = end_time.isoformat()
+        metadata["processing_duration_seconds"] = round(duration, 3)
+        
+        # Add hash processor stats
+        metadata["deduplication_stats"]["hash_processor_stats"] = self.row_store.get_stats()
+        
+        # Add file hash processor stats
+        metadata["file_hash_stats"] = file_hash_processor.get_stats()
+        metadata["university_code"] = self.university
+        metadata["specialization_choices"] = self.specialization_choices
+        
+        return {
+            "quota_counts": quota_counts,
+            "specialization_counts": self.specialization_counts,
+            "specialization_matrix": self.specialization_matrix,
+            "metadata": metadata
+        }
+
+def report_partial(report):
+    """Turn a built report back into the partial() form accepted by ReportBuilder.merge()."""
+    quota_counts = dict(report["quota_counts"])
+    prim_counts = quota_counts.pop("Примечание", {})
+    metadata = report["metadata"]
+    dedup = metadata["deduplication_stats"]
     return {
         "quota_counts": quota_counts,
-        "specialization_counts": specialization_counts,
-        "metadata": metadata
+        "prim_counts": prim_counts,
+        "specialization_counts": report["specialization_counts"],
+        "specialization_matrix": report.get("specialization_matrix", {}),
+        "counters": {key: metadata.get(key, 0) for key in REPORT_COUNTERS},
+        "dedup_counters": {key: dedup.get(key, 0) for key in DEDUP_COUNTERS},
+        "row_hashes": []
     }
 
-def process_excel_file(file_path):
-    if not is_xlsx_file(file_path):
-        return None, "Not an Excel file"
-    if not is_nct_excel(file_path):
-        return None, "File does not match expected NCT pattern"
+def merge_reports(reports, start_time=None):
+    """
+    Combine the reports of several files into one.
+
+    Args:
+        reports (list): Reports built by process_excel_file
+        start_time (datetime): When processing of the batch started, for the merged duration
+    """
+    builder = ReportBuilder()
+    if start_time is not None:
+        builder.start_time = start_time
+        builder.metadata["processing_start"] = start_time.isoformat()
+    for report in reports:
+        builder.merge(report_partial(report))
+    report = builder.build()
+    report["metadata"]["files_merged"] = len(reports)
+    return report
+
+REPORT_ENGINES = ("python", "pandas")
+
+def get_report_builder_class(engine="python"):
+    """Return the ReportBuilder implementation for a report engine name."""
+    if engine == "python":
+        return ReportBuilder
+    if engine == "pandas":
+        from stats.pandas_engine import PandasReportBuilder
+        return PandasReportBuilder
+    raise ValueError(f"Unknown report engine {engine!r}, expected one of {REPORT_ENGINES}")
+
+def generate_custom_report(blocks, file_hash=None, engine="python"):
+    """
+    Aggregate quota, Примечание and specialization counts over NCT blocks.
+
+    specialization_counts holds the first choices of NCT_UNIVERSITY_CODE;
+    specialization_matrix counts the first NCT_SPECIALIZATION_CHOICES
+    choices of every row by choice, university and specialization.
+
+    ``blocks`` may be any iterable, including the lazy generator returned by
+    iter_nct_blocks; each block is aggregated as soon as it is read.
+    ``file_hash`` is recorded in the metadata when given. ``engine`` selects
+    the row-by-row "python" loop or the vectorized "pandas" engine; both
+    produce the same report.
+    """
+    builder_class = get_report_builder_class(engine)
+    return builder_class(file_hash).add_blocks(blocks).build()
+
+def aggregate_sheet(file_path, sheet_name, engine="python", segment=None):
+    """
+    Parse one sheet and return its partial report. Runs inside pool workers.
+
+    Rows are deduplicated within the sheet only, against LocalRowHashes, and
+    the partial lists the hashes of the rows it counted; the parent decides
+    whether it stands (see generate_multi_sheet_report). The parsed blocks
+    are written to ``segment``, for the parent to aggregate again and for
+    BlockCache.commit_segments().
+    """
+    builder = get_report_builder_class(engine)(collect_hashes=True, row_store=LocalRowHashes())
+    with StageTimer().activate():
+        builder.add_blocks(write_blocks(segment, iter_nct_blocks(file_path, sheet_name)))
+        return builder.partial()
+
+def generate_multi_sheet_report(file_path, sheet_names, file_hash=None, max_workers=None, engine="python",
+                                cache_entry=None):
+    """
+    Build one report over several sheets, parsing each sheet in its own process.
+
+    Workers parse and aggregate their sheet with duplicates removed within
+    the sheet only, and the parent deduplicates across sheets in sheet
+    order, so the report equals the one-process parse. A sheet none of
+    whose counted rows is in hash_processor (from an earlier sheet or file)
+    is merged as the worker built it; any other sheet is aggregated again
+    in the parent from the blocks the worker wrote, against hash_processor.
+    With a BlockCache ``cache_entry`` the parsed sheets are stored in it.
+    """
+    builder = get_report_builder_class(engine)(file_hash)
+    workers = min(len(sheet_names), max_workers or os.cpu_count() or 1)
+    if workers <= 1:
+        blocks = itertools.chain.from_iterable(
+            iter_nct_blocks(file_path, sheet_name) for sheet_name in sheet_names
+        )
+        if cache_entry is not None:
+            blocks = cache_entry.record(blocks)
+        builder.add_blocks(blocks)
+        return builder.build()
+    with tempfile.TemporaryDirectory(prefix="nct-sheets-") as tmp:
+        if cache_entry is not None:
+            segments = cache_entry.segment_paths(len(sheet_names))
+        else:
+            segments = [os.path.join(tmp, f"{i}.blocks.jsonl.gz") for i in range(len(sheet_names))]
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                partials = pool.map(
+                    aggregate_sheet, itertools.repeat(file_path), sheet_names, itertools.repeat(engine), segments
+                )
+                for segment, partial in zip(segments, partials):
+                    if not builder.row_store.filter_recent(partial["row_hashes"]):
+                        builder.merge(partial)
+                        continue
+                    # Some rows were counted on an earlier sheet or in an earlier file
+                    timer = current_timer()
+                    if timer is not None:
+                        timer.add(partial["stage_timings"])
+                    builder.add_blocks(read_blocks(segment))
+        except Exception:
+            if cache_entry is not None:
+                cache_entry.discard(segments)
+            raise
+        if cache_entry is not None:
+            cache_entry.commit_segments(segments)
+    return builder.build()
+
+def parse_sheet(file_path, sheet_name, segment):
+    """Parse one sheet into a block file and return its stage timings. Runs inside pool workers."""
+    timer = StageTimer()
+    with timer.activate():
+        for _ in write_blocks(segment, iter_nct_blocks(file_path, sheet_name)):
+            pass
+    return dict(timer.totals)
+
+def _iter_pooled_sheets(file_path, sheet_names, workers, cache_entry=None):
+    """Yield the blocks of several sheets in order while the sheets are parsed in a process pool."""
+    with tempfile.TemporaryDirectory(prefix="nct-sheets-") as tmp:
+        if cache_entry is not None:
+            segments = cache_entry.segment_paths(len(sheet_names))
+        else:
+            segments = [os.path.join(tmp, f"{i}.blocks.jsonl.gz") for i in range(len(sheet_names))]
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                timings = pool.map(parse_sheet, itertools.repeat(file_path), sheet_names, segments)
+                for segment, stage_timings in zip(segments, timings):
+                    timer = current_timer()
+                    if timer is not None:
+                        timer.add(stage_timings)
+                    yield from read_blocks(segment)
+        except BaseException:
+            # GeneratorExit included: a partly read file is never committed to the cache
+            if cache_entry is not None:
+                cache_entry.discard(segments)
+            raise
+        if cache_entry is not None:
+            cache_entry.commit_segments(segments)
+
+def load_nct_blocks(file_path, file_hash=None, sheet_names=None, max_workers=None, block_cache=None):
+    """
+    Validate an NCT file and stream its blocks, sheet after sheet.
+
+    For callers that need the blocks themselves rather than a report. A
+    ``block_cache`` hit replays the cached blocks without opening the file;
+    otherwise the file is parsed once, sniff included (see
+    load_nct_workbook), and the blocks are stored in the cache as they are
+    read. Several sheets are parsed in up to ``max_workers`` processes that
+    write their blocks to temporary files, read back here in sheet order.
+    Every block has its sheet_name.
+
+    Returns:
+        tuple: ({"file_hash": str, "blocks": iterator}, None) or (None, error)
+    """
+    cache_entry = None
+    if block_cache is not None:
+        if not is_supported_file(file_path):
+            return None, UNSUPPORTED_FILE_ERROR
+        file_hash = file_hash or file_hash_processor.create_file_hash(file_path)
+        cache_entry = block_cache.entry(file_hash, sheet_names)
+        cached_blocks = cache_entry.get()
+        if cached_blocks is not None:
+            return {"file_hash": file_hash, "blocks": cached_blocks}, None
+
+    parsed, error = load_nct_workbook(file_path, file_hash=file_hash, sheet_names=sheet_names)
+    if error:
+        return None, error
+    blocks = parsed["blocks"]
+    if blocks is None:
+        sheets = parsed["sheet_names"]
+        workers = min(len(sheets), max_workers or os.cpu_count() or 1)
+        if workers > 1:
+            return {"file_hash": parsed["file_hash"],
+                    "blocks": _iter_pooled_sheets(file_path, sheets, workers, cache_entry)}, None
+        blocks = itertools.chain.from_iterable(iter_nct_blocks(file_path, name) for name in sheets)
+    if cache_entry is not None:
+        blocks = cache_entry.record(blocks)
+    return {"file_hash": parsed["file_hash"], "blocks": blocks}, None
+
+def process_excel_file(file_path, file_hash=None, sheet_names=None, max_workers=None, engine="python",
+                       block_cache=None):
+    """
+    Validate an NCT workbook and build its report.
+
+    With a ``block_cache`` the file is hashed first and a cached parse of the
+    same content is replayed without opening the workbook at all; on a miss
+    the parsed blocks are stored while the report is built.
+
+    The report metadata gets the time spent in each pipeline stage under
+    "stage_timings", and processing_duration_seconds covers the whole call,
+    opening the workbook included.
+    """
+    start_time = datetime.now()
+    timer = StageTimer()
+    with timer.activate():
+        report, error = _process_excel_file(file_path, file_hash, sheet_names, max_workers, engine, block_cache)
+    if report is not None:
+        metadata = report["metadata"]
+        metadata["processing_start"] = start_time.isoformat()
+        metadata["processing_duration_seconds"] = round(timer.elapsed(), 3)
+        metadata["stage_timings"] = timer.as_dict()
+    return report, error
+
+def _process_excel_file(file_path, file_hash, sheet_names, max_workers, engine, block_cache):
+    cache_entry = None
+    if block_cache is not None:
+        if not is_supported_file(file_path):
+            return None, UNSUPPORTED_FILE_ERROR
+        file_hash = file_hash or file_hash_processor.create_file_hash(file_path)
+        cache_entry = block_cache.entry(file_hash, sheet_names)
+        cached_blocks = cache_entry.get()
+        if cached_blocks is not None:
+            report = generate_custom_report(cached_blocks, file_hash=file_hash, engine=engine)
+            file_hash_processor.add_file_hash(file_hash)
+            return report, None
+    
+    parsed, error = load_nct_workbook(file_path, file_hash=file_hash, sheet_names=sheet_names)
+    if error:
+        return None, error
     
-    # Process the file
-    blocks = parse_nct_blocks_correct_header(file_path)
-    report = generate_custom_report(blocks)
+    # Process the file, streaming blocks straight into the report
+    if parsed["blocks"] is not None:
+        blocks = parsed["blocks"]
+        if cache_entry is not None:
+            blocks = cache_entry.record(blocks)
+        report = generate_custom_report(blocks, file_hash=parsed["file_hash"], engine=engine)
+    else:
+        report = generate_multi_sheet_report(
+            file_path, parsed["sheet_names"], file_hash=parsed["file_hash"],
+            max_workers=max_workers, engine=engine, cache_entry=cache_entry
+        )
     
     # Add file hash to processor AFTER successful processing
-    file_hash = file_hash_processor.create_file_hash(file_path)
-    file_hash_processor.add_file_hash(file_hash)
+    file_hash_processor.add_file_hash(parsed["file_hash"])
     
     return report, None
-
@@ -0,0 +1,361 @@
+import logging
+import zipfile
+import itertools
+import posixpath
+from xml.etree.ElementTree import iterparse, parse
+import openpyxl
+from openpyxl.styles.numbers import builtin_format_code, is_date_format, is_timedelta_format
+from openpyxl.utils.datetime import from_excel, from_ISO8601, WINDOWS_EPOCH, MAC_EPOCH
+
+logger = logging.getLogger(__name__)
+
+MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+STRICT_MAIN_NS = "http://purl.oclc.org/ooxml/spreadsheetml/main"
+REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+OFFICE_DOCUMENT_REL = "/officeDocument"
+WORKSHEET_REL = "/worksheet"
+SHARED_STRINGS_REL = "/sharedStrings"
+STYLES_REL = "/styles"
+
+CELL_TYPES = ("n", "s", "str", "b", "e", "inlineStr", "d")
+
+_column_cache = {}
+
+
+class UnsupportedWorkbook(Exception):
+    """The workbook uses XML the native reader does not handle; read it with openpyxl instead."""
+
+
+def column_index(letters):
+    """1-based column number of a column name such as "AB"."""
+    index = _column_cache.get(letters)
+    if index is None:
+        if not letters.isalpha():
+            raise UnsupportedWorkbook(f"{letters!r} is not a column name")
+        index = 0
+        for letter in letters.upper():
+            index = index * 26 + ord(letter) - 64
+        _column_cache[letters] = index
+    return index
+
+
+def _split_ref(ref):
+    """("AB", 12) for "AB12"; the row is None for a bare column."""
+    letters = ref.rstrip("0123456789")
+    digits = ref[len(letters):]
+    return letters.lstrip("$"), int(digits) if digits else None
+
+
+def _cast_number(value):
+    if "." in value or "E" in value or "e" in value:
+        return float(value)
+    return int(value)
+
+
+def _row_number(value):
+    try:
+        return int(value)
+    except ValueError:
+        number = float(value)
+        if not number.is_integer():
+            raise
+        return int(number)
+
+
+def _text_content(element, ns):
+    """Text of a shared or inline string: the plain <t> and the <t> of each rich text run."""
+    t_tag = f"{{{ns}}}t"
+    snippets = [element.findtext(t_tag) or ""]
+    for run in element.iterfind(f"{{{ns}}}r"):
+        snippets.append(run.findtext(t_tag) or "")
+    return "".join(snippets)
+
+
+class NativeWorksheet:
+    """One sheet of a NativeWorkbook."""
+
+    def __init__(self, workbook, title, path):
+        self.parent = workbook
+        self.title = title
+        self._path = path
+
+    def iter_rows(self, max_row=None, values_only=True):
+        """
+        Yield the sheet's rows as value tuples, like openpyxl's read-only iter_rows(values_only=True).
+
+        Rows are padded to the width in the sheet's <dimension> and missing
+        rows are yielded empty, so the output matches openpyxl row for row.
+        When the sheet turns out to hold XML the reader does not handle, the
+        rest of it is read with openpyxl, from the row the reader got to.
+        """
+        if not values_only:
+            raise ValueError("NativeWorksheet only yields cell values")
+        return self._iter_rows(max_row)
+
+    def _iter_rows(self, max_row):
+        read = 0
+        try:
+            for row in self.parent._iter_sheet_rows(self._path, max_row):
+                yield row
+                read += 1
+            return
+        except UnsupportedWorkbook as e:
+            logger.warning("Native reader cannot read sheet %s of %s, using openpyxl from row %d: %s",
+                           self.title, self.parent.file_path, read + 1, e)
+        wb = openpyxl.load_workbook(self.parent.file_path, read_only=True, data_only=True)
+        try:
+            yield from itertools.islice(wb[self.title].iter_rows(max_row=max_row, values_only=True), read, None)
+        finally:
+            wb.close()
+
+
+class NativeWorkbook:
+    """
+    Minimal read-only .xlsx reader built on zipfile and ElementTree.
+
+    openpyxl's read-only mode still turns every cell into a dict and runs it
+    through its descriptors and a ReadOnlyCell; here the sheet XML is
+    stream-parsed with ElementTree.iterparse and each <row> element becomes
+    a tuple directly, then is cleared so memory stays flat. The small parts
+    (workbook, relationships, styles, shared strings) are read with
+    ElementTree too.
+
+    It offers the part of openpyxl's read-only workbook API the NCT parser
+    uses (sheetnames, active, wb[name], iter_rows(values_only=True) and
+    close()) and reads values as load_workbook(data_only=True) does: cached
+    formula results, shared and inline strings, booleans, errors, and dates
+    for date-formatted numbers, using openpyxl's own format-code and
+    serial-date helpers so the two readers agree. A sheet that is not a
+    spreadsheetml worksheet, or holds a cell type, element or value the
+    reader does not expect, raises UnsupportedWorkbook while it is read.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._archive = zipfile.ZipFile(file_path)
+        try:
+            self._load()
+        except Exception:
+            self._archive.close()
+            raise
+
+    def _root_of(self, path):
+        with self._archive.open(path) as f:
+            return parse(f).getroot()
+
+    def _rels(self, part):
+        directory, name = posixpath.split(part)
+        rels_path = posixpath.join(directory, "_rels", f"{name}.rels")
+        if rels_path not in self._archive.NameToInfo:
+            return {}
+        rels = {}
+        for rel in self._root_of(rels_path).iter(f"{{{REL_NS}}}Relationship"):
+            target = rel.get("Target")
+            if rel.get("TargetMode") == "External":
+                continue
+            if target.startswith("/"):
+                target = target[1:]
+            else:
+                target = posixpath.normpath(posixpath.join(directory, target))
+            rels[rel.get("Id")] = (rel.get("Type"), target)
+        return rels
+
+    def _load(self):
+        workbook_part = "xl/workbook.xml"
+        for rel_type, target in self._rels("").values():
+            if rel_type.endswith(OFFICE_DOCUMENT_REL):
+                workbook_part = target
+        workbook = self._root_of(workbook_part)
+        ns = workbook.tag[1:].partition("}")[0]
+        self.ns = ns if ns in (MAIN_NS, STRICT_MAIN_NS) else MAIN_NS
+        rels = self._rels(workbook_part)
+
+        self._sheets = {}
+        for sheet in workbook.iter(f"{{{self.ns}}}sheet"):
+            rel_id = next((value for attr, value in sheet.attrib.items() if attr.endswith("}id")), None)
+            rel_type, target = rels.get(rel_id, ("", None))
+            if rel_type.endswith(WORKSHEET_REL):
+                self._sheets[sheet.get("name")] = target
+        self.sheetnames = list(self._sheets)
+
+        view = workbook.find(f"{{{self.ns}}}bookViews/{{{self.ns}}}workbookView")
+        self._active_index = int(view.get("activeTab", 0)) if view is not None else 0
+        properties = workbook.find(f"{{{self.ns}}}workbookPr")
+        date1904 = properties is not None and properties.get("date1904", "").lower() in ("1", "true")
+        self.epoch = MAC_EPOCH if date1904 else WINDOWS_EPOCH
+
+        self.shared_strings = []
+        self.date_styles = set()
+        self.timedelta_styles = set()
+        for rel_type, target in rels.values():
+            if rel_type.endswith(SHARED_STRINGS_REL) and target in self._archive.NameToInfo:
+                self.shared_strings = self._read_shared_strings(target)
+            elif rel_type.endswith(STYLES_REL) and target in self._archive.NameToInfo:
+                self._read_styles(target)
+
+    def _read_shared_strings(self, path):
+        si_tag = f"{{{self.ns}}}si"
+        strings = []
+        with self._archive.open(path) as f:
+            for _, element in iterparse(f):
+                if element.tag == si_tag:
+                    strings.append(_text_content(element, self.ns).replace("x005F_", ""))
+                    element.clear()
+        return strings
+
+    def _read_styles(self, path):
+        """Index the cell formats whose number format shows a date or a duration."""
+        styles = self._root_of(path)
+        ns = self.ns
+        custom = {
+            int(fmt.get("numFmtId")): fmt.get("formatCode")
+            for fmt in styles.iterfind(f"{{{ns}}}numFmts/{{{ns}}}numFmt")
+        }
+        for index, xf in enumerate(styles.iterfind(f"{{{ns}}}cellXfs/{{{ns}}}xf")):
+            format_id = int(xf.get("numFmtId", 0))
+            fmt = custom[format_id] if format_id in custom else builtin_format_code(format_id)
+            if is_date_format(fmt):
+                self.date_styles.add(index)
+            if is_timedelta_format(fmt):
+                self.timedelta_styles.add(index)
+
+    @property
+    def active(self):
+        names = self.sheetnames
+        if 0 <= self._active_index < len(names):
+            return self[names[self._active_index]]
+        return None
+
+    def __getitem__(self, name):
+        if name not in self._sheets:
+            raise KeyError(f"Worksheet {name} does not exist.")
+        return NativeWorksheet(self, name, self._sheets[name])
+
+    def close(self):
+        self._archive.close()
+
+    def _cell_value(self, cell, ns):
+        """Convert a <c> element according to its type and style, None if it has no value."""
+        data_type = cell.get("t", "n")
+        if data_type == "inlineStr":
+            inline = cell.find(f"{{{ns}}}is")
+            return _text_content(inline, ns) if inline is not None else None
+        text = cell.findtext(f"{{{ns}}}v")
+        if not text:
+            if data_type not in CELL_TYPES:
+                raise UnsupportedWorkbook(f"unknown cell type {data_type!r}")
+            return None
+        if data_type == "s":
+            return self.shared_strings[int(text)]
+        if data_type == "n":
+            value = _cast_number(text)
+            style = cell.get("s")
+            if style and int(style) in self.date_styles:
+                try:
+                    return from_excel(value, self.epoch, timedelta=int(style) in self.timedelta_styles)
+                except (OverflowError, ValueError):
+                    return "#VALUE!"
+            return value
+        if data_type == "b":
+            return bool(int(text))
+        if data_type == "d":
+            return from_ISO8601(text)
+        if data_type in ("str", "e"):
+            return text  # formula results and errors
+        raise UnsupportedWorkbook(f"unknown cell type {data_type!r}")
+
+    def _iter_sheet_rows(self, path, max_row=None):
+        """
+        Stream-parse a sheet's XML into value tuples.
+
+        Only the <dimension> and the <row> elements are looked at; each row is
+        cleared from the tree once it is converted.
+        """
+        columns = _column_cache
+        shared_strings = self.shared_strings
+        cell_value = self._cell_value
+        max_col = None
+        empty_row = []
+        counter = 1
+        row_number = 0
+        with self._archive.open(path) as f:
+            events = iterparse(f, events=("start", "end"))
+            try:
+                _, root = next(events)
+                ns = root.tag[1:].partition("}")[0]
+                if root.tag != f"{{{ns}}}worksheet" or ns not in (MAIN_NS, STRICT_MAIN_NS):
+                    raise UnsupportedWorkbook(f"{path} is not a spreadsheetml worksheet")
+                row_tag, cell_tag, value_tag = f"{{{ns}}}row", f"{{{ns}}}c", f"{{{ns}}}v"
+                dimension_tag, data_tag = f"{{{ns}}}dimension", f"{{{ns}}}sheetData"
+                ext_tag = f"{{{ns}}}extLst"
+                sheet_data = None
+                for event, element in events:
+                    if event == "start":
+                        if element.tag == data_tag:
+                            sheet_data = element
+                        continue
+                    tag = element.tag
+                    if tag == dimension_tag and sheet_data is None:
+                        # Same bounds as openpyxl: rows past the declared last row are never read
+                        start, _, end = element.get("ref", "").partition(":")
+                        letters, last_row = _split_ref(end or start)
+                        if letters:
+                            max_col = column_index(letters)
+                            empty_row = (None,) * max_col
+                        if last_row:
+                            max_row = max_row or last_row
+                        continue
+                    if tag != row_tag:
+                        continue
+
+                    number = element.get("r")
+                    row_number = _row_number(number) if number is not None else row_number + 1
+                    if max_row is not None and row_number > max_row:
+                        # openpyxl fills the rows up to the last declared one before it stops
+                        while counter <= max_row:
+                            counter += 1
+                            yield empty_row
+                        return
+
+                    values = {}
+                    column = 0
+                    for cell in element:
+                        if cell.tag != cell_tag:
+                            if cell.tag == ext_tag:
+                                continue
+                            raise UnsupportedWorkbook(f"unexpected {cell.tag} in a row of {path}")
+                        ref = cell.get("r")
+                        if ref:
+                            letters = ref.rstrip("0123456789")
+                            column = columns.get(letters) or column_index(letters)
+                        else:
+                            column += 1
+                        # Shared strings and unstyled numbers directly, anything else through _cell_value
+                        data_type = cell.get("t")
+                        if data_type == "s":
+                            text = cell.findtext(value_tag)
+                            values[column] = shared_strings[int(text)] if text else None
+                        elif data_type is None and cell.get("s") is None:
+                            text = cell.findtext(value_tag)
+                            values[column] = (int(text) if text.isdigit() else _cast_number(text)) if text else None
+                        else:
+                            values[column] = cell_value(cell, ns)
+                    sheet_data.clear()
+
+                    while counter < row_number:
+                        counter += 1
+                        yield empty_row
+                    if counter > row_number:
+                        continue  # rows out of order, openpyxl skips them too
+                    counter += 1
+                    if not values and not max_col:
+                        yield ()
+                        continue
+                    width = max_col or column
+                    row = [None] * width
+                    for column, value in values.items():
+                        if column <= width:
+                            row[column - 1] = value
+                    yield tuple(row)
+            except (ValueError, IndexError, TypeError, AttributeError) as e:
+                raise UnsupportedWorkbook(f"{path}: {e!r}") from e